@@ -1,16 +1,51 @@
 # app.py - Сайт Пэрры с сохранением чатов и именами
 
-from flask import Flask, render_template_string, request, redirect, url_for, flash, send_from_directory, jsonify, session
+from flask import Flask, render_template, request, redirect, url_for, flash, send_from_directory, jsonify, session, g
 import os
+import re
+import json
+import time
+import hashlib
 import random
 import datetime
-import json
 import uuid
+import threading
+from collections import OrderedDict
 from werkzeug.utils import secure_filename
+from werkzeug.security import safe_join
+from werkzeug.middleware.proxy_fix import ProxyFix
+from markupsafe import Markup
+from chat_storage import create_chat_storage, number_messages, CachedChatStorage
+from stats_counters import StatsCounters
+from classifier import classify_message, response_branch, CAT_COMMAND
+import metrics
+from compression import choose_encoding, should_compress, compress, mark_encoded, static_cache
+from rate_limit import RateLimiter
+from search_index import SearchIndex
 
-app = Flask(__name__)
+# Встроенный static Flask отключаем: статику отдаёт маршрут static_files
+app = Flask(__name__, static_folder=None)
 app.secret_key = 'perra-ai-secret-key-2026'
 
+# Сколько обратных прокси (nginx и т.п.) стоит перед сайтом. Адрес клиента
+# берётся из X-Forwarded-For, только если прокси задан явно: иначе клиент
+# подставил бы туда что угодно. 0 - заголовкам не доверяем
+TRUSTED_PROXIES = int(os.environ.get('PERRA_TRUSTED_PROXIES', '0'))
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES, x_proto=TRUSTED_PROXIES)
+STATIC_FOLDER = os.path.join(app.root_path, 'static')
+
+# Статика с отпечатком содержимого в адресе кэшируется браузером надолго
+LOGO_FILE = '1000162143-fotor-bg-remover-2026030214294.png'
+FINGERPRINTED_ASSETS = ['perra.css', 'perra.js', 'manifest.json', LOGO_FILE]
+ASSET_MAX_AGE = 365 * 24 * 60 * 60
+
+# Файлы виджета для чужих сайтов: адрес у них постоянный, поэтому кэш
+# на сутки, а после - отдаём старую копию, пока в фоне проверяется новая
+EMBED_ASSETS = {'embed.js', 'embed-widget.js', 'embed-widget.css'}
+EMBED_MAX_AGE = 24 * 60 * 60
+EMBED_STALE_WHILE_REVALIDATE = 7 * 24 * 60 * 60
+
 # Настройки загрузки (оставляем, но не используем на сайте)
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
@@ -22,43 +57,87 @@ app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB
 CHATS_FOLDER = 'saved_chats'
 os.makedirs(CHATS_FOLDER, exist_ok=True)
 
-# Глобальная переменная для хранения текущей версии
-current_version = "5.0"
+# Хранилище чатов: 'sqlite' (база chats.db), 'jsonl' (журналы в saved_chats)
+# или 'json' (по файлу на чат в saved_chats)
+CHAT_STORAGE = os.environ.get('PERRA_CHAT_STORAGE', 'sqlite')
+CHATS_DB = os.environ.get('PERRA_CHATS_DB', 'chats.db')
+# Для журналов: как часто делать fsync (0 - после каждой записи)
+CHATS_FSYNC_INTERVAL = float(os.environ.get('PERRA_CHATS_FSYNC_INTERVAL', '1'))
+chat_storage = create_chat_storage(CHAT_STORAGE, CHATS_FOLDER, CHATS_DB, CHATS_FSYNC_INTERVAL)
 
-# Статистика посещений
-if not os.path.exists('stats.json'):
-    with open('stats.json', 'w') as f:
-        json.dump({'visits': 0, 'refusals': 0, 'chat_messages': 0, 'saved_chats': 0}, f)
+# Кэш горячих чатов в памяти воркера (0 - выключен)
+CHAT_CACHE_SIZE = int(os.environ.get('PERRA_CHAT_CACHE_SIZE', '10000'))
+CHAT_CACHE_BYTES = int(os.environ.get('PERRA_CHAT_CACHE_BYTES', str(64 * 1024 * 1024)))
+if CHAT_CACHE_SIZE:
+    chat_storage = CachedChatStorage(chat_storage, CHAT_CACHE_SIZE, CHAT_CACHE_BYTES)
 
-# Приветствия
-GREETINGS = ['привет', 'здравствуй', 'хай', 'hello', 'ку', 'здарова', 'дороу', 'здорово', 'прив']
+# Сколько чатов показывать в боковой панели за раз
+SIDEBAR_PAGE_SIZE = 30
 
-# Прощания
-GOODBYE_WORDS = ['пока', 'до свидания', 'прощай', 'bye', 'bb', 'до встречи', 'удачи', 'счастливо']
+# Полнотекстовый поиск по чатам (/api/search): выключен по умолчанию,
+# включается PERRA_SEARCH=1. С PERRA_SEARCH_TOKEN поиск требует заголовка
+# Authorization: Bearer <токен>
+SEARCH_ENABLED = os.environ.get('PERRA_SEARCH', '') not in ('', '0')
+SEARCH_DB = os.environ.get('PERRA_SEARCH_DB', 'search.db')
+SEARCH_TOKEN = os.environ.get('PERRA_SEARCH_TOKEN', '')
+SEARCH_PAGE_SIZE = 20
+search_index = SearchIndex(SEARCH_DB) if SEARCH_ENABLED else None
+
+# Чат создаётся первым сообщением. Уборка мусора раз в CHAT_GC_INTERVAL секунд
+# удаляет пустые чаты старше CHAT_EMPTY_TTL и, если задан CHAT_IDLE_TTL,
+# чаты, в которые не писали дольше него (0 - выключено)
+CHAT_GC_INTERVAL = float(os.environ.get('PERRA_CHAT_GC_INTERVAL', '600'))
+CHAT_EMPTY_TTL = float(os.environ.get('PERRA_CHAT_EMPTY_TTL', '3600'))
+CHAT_IDLE_TTL = float(os.environ.get('PERRA_CHAT_IDLE_TTL', '0'))
+# Файловые хранилища сжимают чаты без записей дольше этого срока (0 - не сжимать)
+CHAT_COLD_AFTER = float(os.environ.get('PERRA_CHAT_COLD_AFTER', str(30 * 24 * 60 * 60)))
 
-# Слова-команды
-COMMAND_WORDS = ['реши', 'выполни', 'сделай', 'напиши', 'посчитай', 'открой', 'закрой', 
-                 'принеси', 'подними', 'создай', 'пиши', 'отправляй', 'жду', 'расскажи', 
-                 'покажи', 'скажи', 'ответь', 'сгенерируй', 'придумай']
+def chat_gc_loop():
+    while True:
+        time.sleep(CHAT_GC_INTERVAL)
+        try:
+            chat_storage.collect_garbage(CHAT_EMPTY_TTL, CHAT_IDLE_TTL,
+                                         on_remove=search_index.remove_chat if search_index else None)
+            chat_storage.freeze_idle(CHAT_COLD_AFTER)
+        except Exception as e:
+            print(f"⚠️ Уборка чатов не удалась: {e}")
 
-# Слова для вопросов о времени и дате
-TIME_WORDS = ['время', 'часов', 'час', 'который час', 'сколько времени', 'time']
-DATE_WORDS = ['дата', 'число', 'какое сегодня', 'день недели', 'месяц', 'год', 'date', 'день']
+if CHAT_GC_INTERVAL:
+    threading.Thread(target=chat_gc_loop, name='chat-gc', daemon=True).start()
 
-# Слова для вопросов о новостях
-NEWS_WORDS = ['новости', 'новость', 'что нового', 'что в мире', 'что случилось', 'news', 
-              'события', 'произошло', 'случилось', 'что там', 'что интересного']
+# Максимальная страница истории чата в API
+HISTORY_PAGE_SIZE = 200
 
-# Слова, указывающие на просьбу написать код
-CODE_WORDS = ['код', 'программу', 'скрипт', 'функцию', 'класс', 'метод', 'алгоритм', 
-              'program', 'code', 'script', 'function']
+# Сколько последних сообщений чата рисуется в HTML, остальное - по прокрутке
+INITIAL_MESSAGES = 50
 
-# Оскорбления
-BAD_WORDS = ['дурак', 'тупой', 'лох', 'идиот', 'козел', 'гад', 'тварь', 'сука', 'блять', 
-             'нахер', 'нафиг', 'пидор', 'дебил', 'мудак', 'хер', 'хуй', 'пиздец']
+# Сколько сообщений можно прислать в одном пакетном запросе
+BATCH_MAX_ITEMS = 1000
 
-# Хвастовство/игнорирование
-IGNORE_PHRASES = ['бот', 'робот', 'искусственный интеллект', 'ии', 'нейросеть']
+# Пауза между токенами при потоковом ответе, в секундах. В ASGI-режиме это
+# asyncio.sleep; под WSGI пауза держит поток воркера, поэтому её можно
+# отдельно убрать (PERRA_WSGI_STREAM_TOKEN_DELAY=0) на синхронных воркерах
+STREAM_TOKEN_DELAY = float(os.environ.get('PERRA_STREAM_TOKEN_DELAY', '0.03'))
+WSGI_STREAM_TOKEN_DELAY = float(os.environ.get('PERRA_WSGI_STREAM_TOKEN_DELAY', str(STREAM_TOKEN_DELAY)))
+REPLY_TOKEN_RE = re.compile(r'\s*\S+')
+
+# ID чатов - uuid4 в каноническом виде, как их выдаёт new_chat_id
+CHAT_ID_RE = re.compile(r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}')
+
+# Виджет на чужих сайтах: длина сообщения и лимит запросов с одного IP
+# (за прокси - см. PERRA_TRUSTED_PROXIES)
+EMBED_MAX_MESSAGE = 1000
+EMBED_RATE = float(os.environ.get('PERRA_EMBED_RATE', '1'))      # запросов в секунду, 0 - без лимита
+EMBED_BURST = int(os.environ.get('PERRA_EMBED_BURST', '10'))
+embed_limiter = RateLimiter(EMBED_RATE, EMBED_BURST) if EMBED_RATE else None
+
+# Глобальная переменная для хранения текущей версии
+current_version = "5.0"
+
+# Статистика посещений: счётчики в памяти, раз в несколько секунд - в stats.db
+STATS_DB = os.environ.get('PERRA_STATS_DB', 'stats.db')
+STATS_FLUSH_INTERVAL = float(os.environ.get('PERRA_STATS_FLUSH_INTERVAL', '5'))
+stats_counters = StatsCounters(STATS_DB, json_path='stats.json', flush_interval=STATS_FLUSH_INTERVAL)
 
 # Фразы для отказа (для обычных команд)
 REFUSAL_PHRASES = [
@@ -277,423 +356,190 @@ def get_current_date():
     
     return f"{day_name}, {now.day} {month_name} {now.year} года"
 
-def get_bot_response(message_text, user_name):
-    """Основная логика ответов бота с обращением по имени"""
-    text = message_text.lower().strip()
-    
-    # Проверяем разные категории
-    is_greeting = any(greeting in text for greeting in GREETINGS)
-    is_goodbye = any(goodbye in text for goodbye in GOODBYE_WORDS)
-    has_command = any(command in text for command in COMMAND_WORDS)
-    has_bad_word = any(bad in text for bad in BAD_WORDS)
-    has_bot_word = any(ignore in text for ignore in IGNORE_PHRASES)
-    
-    # Проверка на время и дату
-    wants_time = any(time_word in text for time_word in TIME_WORDS)
-    wants_date = any(date_word in text for date_word in DATE_WORDS)
-    
-    # Проверка на новости
-    wants_news = any(news_word in text for news_word in NEWS_WORDS)
-    
-    # Проверка на код
-    wants_code = any(code_word in text for code_word in CODE_WORDS)
-    code_phrases = ['напиши код', 'сделай код', 'напиши программу', 'сделай программу', 
-                   'код на', 'программу на']
-    wants_code_phrase = any(phrase in text for phrase in code_phrases)
-    
-    # Проверка на "что"
-    is_what = text in ['что', 'чо', 'шо', 'че', 'чё', 'что?', 'чо?', 'шо?', 'че?', 'чё?']
-    
-    # Проверка на "нет"
-    is_no = text in ['нет', 'нет.', 'не', 'не.']
-    
-    # Проверка на вопросы
-    is_why = text in ['почему', 'почему?', 'поч', 'почему так', 'почему нет']
-    is_year = any(phrase in text for phrase in ['какой год', 'год какой', 'какой сейчас год', 'год сейчас', 'который год'])
-    is_how = text in ['как', 'как?', 'как так', 'как это', 'каким образом']
-    is_why_need = text in ['зачем', 'зачем?', 'для чего', 'с какой целью']
-    is_please = any(phrase in text for phrase in ['пожалуйста', 'ну пожалуйста', 'прошу', 'умоляю'])
-    
-    # Логика ответов с обращением по имени
-    if has_bad_word:
-        return random.choice(BAD_RESPONSES)
-    
-    elif has_bot_word and not has_command and not wants_code and not wants_news:
-        return random.choice(BOT_RESPONSES)
-    
-    elif wants_time and not has_command:
-        current_time = get_current_time()
-        response = random.choice(TIME_RESPONSES)
-        if "{time}" in response:
-            response = response.format(time=current_time)
-        return response
-    
-    elif wants_date and not has_command:
-        current_date = get_current_date()
-        return random.choice(DATE_RESPONSES).format(date=current_date)
-    
-    elif wants_news and not has_command:
-        if random.random() < 0.3:
-            return f"📢 Срочно в номер:\n• Бот ничего не делает\n• На улице {random.randint(-20, 30)}°C\n• {user_name} зря старается!"
-        else:
-            return random.choice(NEWS_RESPONSES)
-    
-    elif (wants_code or wants_code_phrase) and not has_command:
-        return random.choice(CODE_REFUSAL_PHRASES)
-    
-    elif is_goodbye and not has_command:
-        response = random.choice(GOODBYE_RESPONSES)
-        return response.replace('{user_name}', user_name)
-    
-    elif is_year:
-        return random.choice(YEAR_RESPONSES)
-    
-    elif is_how:
-        return random.choice(HOW_RESPONSES)
-    
-    elif is_why_need:
-        return random.choice(WHY_NEED_RESPONSES)
-    
-    elif is_why:
-        return random.choice(WHY_RESPONSES)
-    
-    elif is_please and (has_command or wants_code):
-        return random.choice(PLEASE_RESPONSES)
-    
-    elif is_what:
-        return random.choice(WHAT_RESPONSES)
-    
-    elif is_greeting and not has_command:
-        greetings = [
-            f"Привет, {user_name}! Что хотел? 😎",
-            f"Здарова, {user_name}! Чего надо?",
-            f"Хай, {user_name}! Слушаю тебя...",
-            f"Приветствую, {user_name}! С чем пожаловал?",
-            f"О, {user_name}! Я тут, слушаю.",
-            f"{user_name}! Рад тебя слышать! Или не рад... Посмотрим."
-        ]
-        return random.choice(greetings)
-    
-    elif has_command:
-        return random.choice(REFUSAL_PHRASES)
-    
-    elif is_no:
-        return random.choice(NO_RESPONSES)
-    
-    else:
-        if random.random() < 0.3:
-            response = random.choice(CASUAL_RESPONSES)
-            return f"{user_name}, {response.lower() if response[0].islower() else response}"
+# Приветствия по имени
+GREETING_RESPONSES = [
+    "Привет, {user_name}! Что хотел? 😎",
+    "Здарова, {user_name}! Чего надо?",
+    "Хай, {user_name}! Слушаю тебя...",
+    "Приветствую, {user_name}! С чем пожаловал?",
+    "О, {user_name}! Я тут, слушаю.",
+    "{user_name}! Рад тебя слышать! Или не рад... Посмотрим."
+]
+
+# Иногда вместо новостей - «срочный выпуск»
+NEWS_FLASH = "📢 Срочно в номер:\n• Бот ничего не делает\n• На улице {temperature}°C\n• {user_name} зря старается!"
+
+# Шаблоны ответов заранее режутся на куски: подстановка имени - просто join
+TEMPLATE_FIELD_RE = re.compile(r'\{(user_name|time|date|temperature)\}')
+
+def split_template(text):
+    """'Привет, {user_name}!' -> ('Привет, ', 'user_name', '!'): на нечётных местах - поля"""
+    return tuple(TEMPLATE_FIELD_RE.split(text))
+
+def compile_responses(responses):
+    return tuple(split_template(text) for text in responses)
+
+# Ветка ответа -> шаблоны (ветки - см. classifier.response_branch)
+RESPONSE_TABLE = {
+    'bad': compile_responses(BAD_RESPONSES),
+    'bot': compile_responses(BOT_RESPONSES),
+    'time': compile_responses(TIME_RESPONSES),
+    'date': compile_responses(DATE_RESPONSES),
+    'news': compile_responses(NEWS_RESPONSES),
+    'code': compile_responses(CODE_REFUSAL_PHRASES),
+    'goodbye': compile_responses(GOODBYE_RESPONSES),
+    'year': compile_responses(YEAR_RESPONSES),
+    'how': compile_responses(HOW_RESPONSES),
+    'why_need': compile_responses(WHY_NEED_RESPONSES),
+    'why': compile_responses(WHY_RESPONSES),
+    'please': compile_responses(PLEASE_RESPONSES),
+    'what': compile_responses(WHAT_RESPONSES),
+    'greeting': compile_responses(GREETING_RESPONSES),
+    'refusal': compile_responses(REFUSAL_PHRASES),
+    'no': compile_responses(NO_RESPONSES),
+    'casual': compile_responses(CASUAL_RESPONSES),
+}
+
+# С вероятностью p ответ берётся из другой таблицы: (p, шаблоны)
+RARE_RESPONSES = {
+    'news': (0.3, compile_responses([NEWS_FLASH])),
+    'casual': (0.3, compile_responses(
+        ['{user_name}, ' + (text.lower() if text[0].islower() else text) for text in CASUAL_RESPONSES])),
+}
+
+# Поля шаблонов, кроме имени: считаются только когда встретились в шаблоне
+TEMPLATE_FIELDS = {
+    'time': lambda rng: get_current_time(),
+    'date': lambda rng: get_current_date(),
+    'temperature': lambda rng: str(rng.randint(-20, 30)),
+}
+
+def fill_template(parts, user_name, rng):
+    if len(parts) == 1:
+        return parts[0]
+    filled = list(parts)
+    for i in range(1, len(parts), 2):
+        name = parts[i]
+        filled[i] = user_name if name == 'user_name' else TEMPLATE_FIELDS[name](rng)
+    return ''.join(filled)
+
+def pick_response(branch, user_name, rng=random):
+    """Случайный ответ ветки branch; rng - генератор (модуль random или Random)"""
+    templates = RESPONSE_TABLE[branch]
+    rare = RARE_RESPONSES.get(branch)
+    if rare and rng.random() < rare[0]:
+        templates = rare[1]
+    parts = templates[0] if len(templates) == 1 else rng.choice(templates)
+    return fill_template(parts, user_name, rng)
+
+def classify(message_text):
+    """Битовая маска категорий сообщения (один проход классификатора)"""
+    with metrics.phase('classify'):
+        return classify_message(message_text)
+
+def get_bot_response(message_text, user_name, rng=random, flags=None):
+    """Основная логика ответов бота с обращением по имени.
+    flags - уже посчитанная classify маска, чтобы не разбирать сообщение дважды"""
+    if flags is None:
+        flags = classify(message_text)
+    return pick_response(response_branch(flags), user_name, rng)
+
+# Воспроизводимые ответы: с PERRA_RESPONSE_SEED у каждого чата свой генератор,
+# засеянный seed и chat_id, - один и тот же разговор повторяется слово в слово
+RESPONSE_SEED = os.environ.get('PERRA_RESPONSE_SEED')
+CHAT_RNG_LIMIT = 10000
+chat_rngs = OrderedDict()
+chat_rngs_lock = threading.Lock()
+
+def chat_rng(chat_id):
+    """Генератор случайных чисел для ответов в чате"""
+    if RESPONSE_SEED is None:
+        return random
+    with chat_rngs_lock:
+        rng = chat_rngs.get(chat_id)
+        if rng is None:
+            rng = chat_rngs[chat_id] = random.Random(f'{RESPONSE_SEED}:{chat_id}')
+            if len(chat_rngs) > CHAT_RNG_LIMIT:
+                chat_rngs.popitem(last=False)
         else:
-            return random.choice(CASUAL_RESPONSES)
+            chat_rngs.move_to_end(chat_id)
+    return rng
+
+def split_reply_tokens(text):
+    """Режет ответ на слова вместе с пробелами перед ними"""
+    return REPLY_TOKEN_RE.findall(text)
+
+def stream_bot_response(message_text, user_name, rng=random, flags=None):
+    """Ответ бота по кусочкам - словам вместе с пробелами перед ними.
+    Маршруты отдают токены по мере того, как генератор их выдаёт, так что
+    его можно заменить медленным настоящим генератором"""
+    yield from split_reply_tokens(get_bot_response(message_text, user_name, rng, flags))
+
+def start_stream_turn(chat_id, message, user_name, flags):
+    """Начало потокового ответа: с chat_id сообщение пользователя сохраняется
+    до первого токена. Возвращает его с номером seq или None"""
+    if not chat_id:
+        return None
+    update_stats('chat_messages')
+    if flags & CAT_COMMAND:
+        update_stats('refusals')
+    user_message = {'sender': 'user', 'text': message,
+                    'time': datetime.datetime.now().strftime('%H:%M')}
+    return dict(user_message, seq=append_chat_messages(chat_id, user_name, [user_message]))
+
+def finish_stream_turn(chat_id, user_message, tokens, user_name):
+    """Конец потокового ответа: сохраняет ответ бота - целиком или ту часть,
+    что успела уйти клиенту до обрыва. Возвращает данные события done"""
+    response = ''.join(tokens)
+    done = {'response': response}
+    if user_message:
+        bot_message = {'sender': 'bot', 'text': response, 'time': user_message['time']}
+        seq = append_chat_messages(chat_id, user_name, [bot_message])
+        done.update(messages=[user_message, dict(bot_message, seq=seq)], seq=seq)
+    return done
+
+def sse_event(event, data):
+    """Одно событие server-sent events"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def allow_cross_origin(response):
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    response.headers['Access-Control-Allow-Methods'] = 'POST, OPTIONS'
+    response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+    return response
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 def update_stats(key, increment=1):
-    with open('stats.json', 'r') as f:
-        stats = json.load(f)
-    stats[key] += increment
-    with open('stats.json', 'w') as f:
-        json.dump(stats, f)
-    return stats
-
-def save_chat(chat_id, user_name, messages):
-    """Сохраняет чат в файл"""
-    chat_data = {
-        'chat_id': chat_id,
-        'user_name': user_name,
-        'messages': messages,
-        'last_updated': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    }
-    filename = os.path.join(CHATS_FOLDER, f'{chat_id}.json')
-    with open(filename, 'w', encoding='utf-8') as f:
-        json.dump(chat_data, f, ensure_ascii=False, indent=2)
+    with metrics.phase('update_stats'):
+        stats_counters.incr(key, increment)
+
+def get_stats():
+    return stats_counters.snapshot()
+
+def append_chat_messages(chat_id, user_name, new_messages):
+    """Дописывает новые сообщения в конец чата, возвращает seq последнего"""
+    with metrics.phase('append_chat'):
+        last_seq = chat_storage.append(chat_id, user_name, new_messages)
+    if search_index:
+        search_index.add(chat_id, user_name, number_messages(new_messages, last_seq - len(new_messages) + 1))
+    return last_seq
 
 def load_chat(chat_id):
-    """Загружает чат из файла"""
-    filename = os.path.join(CHATS_FOLDER, f'{chat_id}.json')
-    if os.path.exists(filename):
-        with open(filename, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return None
-
-def get_all_chats():
-    """Возвращает список всех сохранённых чатов"""
-    chats = []
-    for filename in os.listdir(CHATS_FOLDER):
-        if filename.endswith('.json'):
-            with open(os.path.join(CHATS_FOLDER, filename), 'r', encoding='utf-8') as f:
-                chat_data = json.load(f)
-                chats.append({
-                    'id': chat_data['chat_id'],
-                    'user_name': chat_data['user_name'],
-                    'last_updated': chat_data['last_updated'],
-                    'message_count': len(chat_data['messages'])
-                })
-    # Сортируем по дате (сначала новые)
-    chats.sort(key=lambda x: x['last_updated'], reverse=True)
-    return chats
-
-# HTML шаблон для вставки на другие сайты
-EMBED_HTML = '''
-<!-- ПЭРРА - АВТОНОМНЫЙ ЧАТ С ХАРАКТЕРОМ -->
-<div id="perra-chat-container" style="position: fixed; bottom: 20px; right: 20px; z-index: 9999; font-family: Arial, sans-serif;">
-    <style>
-        .perra-chat-button {
-            width: 60px;
-            height: 60px;
-            border-radius: 50%;
-            background: linear-gradient(145deg, #38bdf8, #0284c7);
-            cursor: pointer;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            box-shadow: 0 5px 20px rgba(2, 132, 199, 0.5);
-            transition: transform 0.3s;
-            border: 2px solid white;
-            animation: pulse 2s infinite;
-        }
-        @keyframes pulse {
-            0% { transform: scale(1); }
-            50% { transform: scale(1.05); }
-            100% { transform: scale(1); }
-        }
-        .perra-chat-button:hover {
-            transform: scale(1.1);
-            animation: none;
-        }
-        .perra-chat-button span { font-size: 30px; }
-        
-        .perra-chat-window {
-            position: fixed;
-            bottom: 100px;
-            right: 20px;
-            width: 350px;
-            height: 500px;
-            background: white;
-            border-radius: 20px;
-            box-shadow: 0 10px 40px rgba(0,0,0,0.2);
-            display: none;
-            flex-direction: column;
-            overflow: hidden;
-            border: 2px solid #0284c7;
-        }
-        
-        .perra-chat-header {
-            background: linear-gradient(145deg, #38bdf8, #0284c7);
-            color: white;
-            padding: 15px;
-            font-weight: bold;
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-            cursor: move;
-        }
-        
-        .perra-chat-close {
-            cursor: pointer;
-            font-size: 20px;
-            background: none;
-            border: none;
-            color: white;
-            width: 30px;
-            height: 30px;
-            border-radius: 50%;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            transition: background 0.3s;
-        }
-        .perra-chat-close:hover { background: rgba(255,255,255,0.2); }
-        
-        .perra-chat-messages {
-            flex: 1;
-            padding: 15px;
-            overflow-y: auto;
-            background: #f0f9ff;
-        }
-        
-        .perra-message {
-            margin-bottom: 15px;
-            max-width: 80%;
-            padding: 10px 15px;
-            border-radius: 15px;
-            word-wrap: break-word;
-            animation: messageAppear 0.3s;
-        }
-        @keyframes messageAppear {
-            from { opacity: 0; transform: translateY(10px); }
-            to { opacity: 1; transform: translateY(0); }
-        }
-        
-        .perra-user-message {
-            background: #0284c7;
-            color: white;
-            margin-left: auto;
-            border-bottom-right-radius: 5px;
-        }
-        
-        .perra-bot-message {
-            background: white;
-            color: #0c4a6e;
-            border: 1px solid #bae6fd;
-            border-bottom-left-radius: 5px;
-        }
-        
-        .perra-chat-input {
-            padding: 15px;
-            background: white;
-            border-top: 1px solid #bae6fd;
-            display: flex;
-            gap: 10px;
-        }
-        
-        .perra-chat-input input {
-            flex: 1;
-            padding: 10px;
-            border: 2px solid #bae6fd;
-            border-radius: 10px;
-            outline: none;
-            font-size: 14px;
-            transition: border-color 0.3s;
-        }
-        .perra-chat-input input:focus { border-color: #0284c7; }
-        
-        .perra-chat-input button {
-            background: #0284c7;
-            color: white;
-            border: none;
-            border-radius: 10px;
-            padding: 10px 20px;
-            cursor: pointer;
-            font-weight: bold;
-            transition: all 0.3s;
-        }
-        .perra-chat-input button:hover {
-            background: #0369a1;
-            transform: scale(1.05);
-        }
-        
-        .perra-typing {
-            color: #64748b;
-            font-style: italic;
-            padding: 10px;
-            animation: blink 1.5s infinite;
-        }
-        @keyframes blink {
-            0%, 100% { opacity: 0.5; }
-            50% { opacity: 1; }
-        }
-        
-        .perra-timestamp {
-            font-size: 10px;
-            color: #94a3b8;
-            margin-top: 5px;
-            text-align: right;
-        }
-    </style>
-
-    <div class="perra-chat-button" onclick="togglePerraChat()">
-        <span>🤖</span>
-    </div>
+    """Загружает чат из хранилища"""
+    with metrics.phase('load_chat'):
+        return chat_storage.load(chat_id)
 
-    <div class="perra-chat-window" id="perraChatWindow">
-        <div class="perra-chat-header" id="perraChatHeader">
-            <span>Чат с Пэррой 🤖</span>
-            <button class="perra-chat-close" onclick="togglePerraChat()">✕</button>
-        </div>
-        <div class="perra-chat-messages" id="perraChatMessages">
-            <div class="perra-message perra-bot-message">
-                Привет! Я Пэрра - бот с характером! Команды не выполняю, домашку не решаю. Что хотел? 😎
-                <div class="perra-timestamp">только что</div>
-            </div>
-        </div>
-        <div class="perra-chat-input">
-            <input type="text" id="perraChatInput" placeholder="Напиши сообщение..." onkeypress="if(event.key==='Enter') sendPerraMessage()">
-            <button onclick="sendPerraMessage()">➤</button>
-        </div>
-    </div>
+def get_chats_page(limit=SIDEBAR_PAGE_SIZE, cursor=None):
+    """Возвращает страницу свежих чатов и курсор следующей страницы"""
+    with metrics.phase('get_chats_page'):
+        return chat_storage.list_chats(limit, cursor)
 
-    <script>
-        function togglePerraChat() {
-            const window = document.getElementById('perraChatWindow');
-            window.style.display = window.style.display === 'flex' ? 'none' : 'flex';
-        }
-
-        function sendPerraMessage() {
-            const input = document.getElementById('perraChatInput');
-            const message = input.value.trim();
-            if (!message) return;
-
-            const messagesDiv = document.getElementById('perraChatMessages');
-            const currentTime = new Date().toLocaleTimeString('ru-RU', { hour: '2-digit', minute: '2-digit' });
-
-            messagesDiv.innerHTML += `<div class="perra-message perra-user-message">${escapeHtml(message)}<div class="perra-timestamp">${currentTime}</div></div>`;
-            input.value = '';
-
-            messagesDiv.innerHTML += `<div class="perra-typing" id="typingIndicator">Пэрра печатает...</div>`;
-            messagesDiv.scrollTop = messagesDiv.scrollHeight;
-
-            setTimeout(() => {
-                document.getElementById('typingIndicator')?.remove();
-
-                const responses = [
-                    "Не дождёшься! 😜",
-                    "А с чего ты взял, что я буду это делать? 🤔",
-                    "Нет. 🙅‍♂️",
-                    "Сам сделай, я занят! 💅",
-                    "Иди сам решай свои проблемы!",
-                    "Ха! А мозги включить слабо? 🧠",
-                    "Ошибка 418: Я - чайник ☕",
-                    "Потому что гладиолус! 🌸",
-                    "Ничего 😎",
-                    "Как-как... Криво! 😜"
-                ];
-                
-                const response = responses[Math.floor(Math.random() * responses.length)];
-                
-                messagesDiv.innerHTML += `<div class="perra-message perra-bot-message">${escapeHtml(response)}<div class="perra-timestamp">${currentTime}</div></div>`;
-                messagesDiv.scrollTop = messagesDiv.scrollHeight;
-            }, 1000);
-        }
-
-        function escapeHtml(unsafe) {
-            return unsafe.replace(/&/g, "&amp;").replace(/</g, "&lt;").replace(/>/g, "&gt;");
-        }
-
-        function makeDraggable() {
-            const chatWindow = document.getElementById('perraChatWindow');
-            const chatHeader = document.getElementById('perraChatHeader');
-            
-            let isDragging = false;
-            let offsetX, offsetY;
-
-            chatHeader.addEventListener('mousedown', (e) => {
-                isDragging = true;
-                offsetX = e.clientX - chatWindow.offsetLeft;
-                offsetY = e.clientY - chatWindow.offsetTop;
-            });
-
-            document.addEventListener('mousemove', (e) => {
-                if (isDragging) {
-                    e.preventDefault();
-                    chatWindow.style.left = (e.clientX - offsetX) + 'px';
-                    chatWindow.style.top = (e.clientY - offsetY) + 'px';
-                    chatWindow.style.right = 'auto';
-                    chatWindow.style.bottom = 'auto';
-                }
-            });
-
-            document.addEventListener('mouseup', () => {
-                isDragging = false;
-            });
-        }
-
-        window.addEventListener('load', makeDraggable);
-    </script>
-</div>
-'''
+# Код для вставки на другие сайты: только асинхронный загрузчик,
+# окно чата он подгружает с нашего сервера при первом открытии
+EMBED_HTML = '''<!-- ПЭРРА - ЧАТ С ХАРАКТЕРОМ -->
+<script async src="//YOUR-SITE.com/static/embed.js"></script>'''
 
 # Основной HTML шаблон сайта
 TEMPLATE = '''
@@ -703,486 +549,15 @@ TEMPLATE = '''
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Пэрра ИИ | Бот с характером</title>
-    <link rel="icon" href="/static/1000162143-fotor-bg-remover-2026030214294.png" type="image/png">
+    <link rel="icon" href="{{ asset_url('1000162143-fotor-bg-remover-2026030214294.png') }}" type="image/png">
     
     <!-- PWA Support -->
-    <link rel="manifest" href="/static/manifest.json">
+    <link rel="manifest" href="{{ asset_url('manifest.json') }}">
     <meta name="theme-color" content="#0284c7">
     <meta name="apple-mobile-web-app-capable" content="yes">
     <meta name="apple-mobile-web-app-status-bar-style" content="default">
     
-    <style>
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-        }
-        
-        body {
-            background: linear-gradient(135deg, #e0f2fe 0%, #bae6fd 50%, #7dd3fc 100%);
-            min-height: 100vh;
-            padding: 20px;
-            position: relative;
-            overflow-x: hidden;
-        }
-        
-        .cloud {
-            position: absolute;
-            background: rgba(255, 255, 255, 0.7);
-            border-radius: 1000px;
-            box-shadow: 0 10px 30px rgba(0, 0, 0, 0.05);
-            z-index: 0;
-        }
-        
-        .cloud1 {
-            width: 200px;
-            height: 80px;
-            top: 10%;
-            left: 5%;
-            animation: float 20s infinite ease-in-out;
-        }
-        
-        .cloud2 {
-            width: 300px;
-            height: 100px;
-            bottom: 15%;
-            right: 5%;
-            animation: float 25s infinite ease-in-out reverse;
-        }
-        
-        .cloud3 {
-            width: 150px;
-            height: 60px;
-            top: 30%;
-            right: 15%;
-            animation: float 18s infinite ease-in-out;
-        }
-        
-        @keyframes float {
-            0%, 100% { transform: translateY(0) translateX(0); }
-            50% { transform: translateY(-20px) translateX(10px); }
-        }
-        
-        .container {
-            background: rgba(255, 255, 255, 0.9);
-            backdrop-filter: blur(10px);
-            border-radius: 40px;
-            padding: 40px;
-            max-width: 1400px;
-            width: 100%;
-            margin: 0 auto;
-            box-shadow: 0 20px 60px rgba(0, 150, 255, 0.3);
-            border: 2px solid rgba(255, 255, 255, 0.5);
-            z-index: 1;
-            position: relative;
-        }
-        
-        .header {
-            display: flex;
-            align-items: center;
-            gap: 30px;
-            margin-bottom: 40px;
-            flex-wrap: wrap;
-        }
-        
-        .bot-avatar {
-            width: 150px;
-            height: 150px;
-            background: linear-gradient(145deg, #38bdf8, #0284c7);
-            border-radius: 50%;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            overflow: hidden;
-            box-shadow: 0 10px 30px rgba(2, 132, 199, 0.5);
-            border: 5px solid white;
-            transition: transform 0.3s;
-        }
-        
-        .bot-avatar img {
-            width: 100%;
-            height: 100%;
-            object-fit: cover;
-        }
-        
-        .bot-avatar:hover {
-            transform: scale(1.05) rotate(5deg);
-        }
-        
-        .bot-info {
-            flex: 1;
-        }
-        
-        .bot-name {
-            font-size: 48px;
-            font-weight: 800;
-            background: linear-gradient(135deg, #0284c7, #0c4a6e);
-            -webkit-background-clip: text;
-            -webkit-text-fill-color: transparent;
-            margin-bottom: 10px;
-        }
-        
-        .bot-tagline {
-            font-size: 24px;
-            color: #0369a1;
-            font-style: italic;
-            margin-bottom: 15px;
-        }
-        
-        .bot-status {
-            display: inline-block;
-            background: #dc2626;
-            color: white;
-            padding: 8px 20px;
-            border-radius: 50px;
-            font-weight: bold;
-            font-size: 18px;
-            box-shadow: 0 5px 15px rgba(220, 38, 38, 0.3);
-            animation: pulse 2s infinite;
-        }
-        
-        @keyframes pulse {
-            0%, 100% { transform: scale(1); }
-            50% { transform: scale(1.05); }
-        }
-        
-        .user-info {
-            background: white;
-            border-radius: 20px;
-            padding: 20px;
-            margin-bottom: 20px;
-            display: flex;
-            gap: 20px;
-            align-items: center;
-            flex-wrap: wrap;
-        }
-        
-        .user-info input {
-            flex: 1;
-            padding: 15px;
-            border: 2px solid #bae6fd;
-            border-radius: 15px;
-            font-size: 16px;
-            outline: none;
-            min-width: 250px;
-        }
-        
-        .user-info input:focus {
-            border-color: #0284c7;
-        }
-        
-        .user-info button {
-            background: #0284c7;
-            color: white;
-            border: none;
-            border-radius: 15px;
-            padding: 15px 30px;
-            font-size: 16px;
-            font-weight: bold;
-            cursor: pointer;
-            transition: all 0.3s;
-        }
-        
-        .user-info button:hover {
-            background: #0369a1;
-            transform: scale(1.05);
-        }
-        
-        .main-content {
-            display: grid;
-            grid-template-columns: 300px 1fr;
-            gap: 30px;
-            margin-bottom: 40px;
-        }
-        
-        .sidebar {
-            background: white;
-            border-radius: 30px;
-            padding: 20px;
-            box-shadow: 0 10px 30px rgba(0, 0, 0, 0.05);
-        }
-        
-        .sidebar h3 {
-            color: #0c4a6e;
-            margin-bottom: 20px;
-            font-size: 20px;
-        }
-        
-        .chat-list {
-            max-height: 500px;
-            overflow-y: auto;
-        }
-        
-        .chat-item {
-            padding: 15px;
-            border-radius: 15px;
-            background: #f8fafc;
-            margin-bottom: 10px;
-            cursor: pointer;
-            transition: all 0.3s;
-            border: 1px solid #e2e8f0;
-        }
-        
-        .chat-item:hover {
-            background: #e0f2fe;
-            transform: translateX(5px);
-            border-color: #0284c7;
-        }
-        
-        .chat-item .chat-name {
-            font-weight: bold;
-            color: #0c4a6e;
-            margin-bottom: 5px;
-        }
-        
-        .chat-item .chat-date {
-            font-size: 12px;
-            color: #64748b;
-        }
-        
-        .chat-item .chat-count {
-            font-size: 12px;
-            color: #0284c7;
-        }
-        
-        .new-chat-btn {
-            width: 100%;
-            padding: 15px;
-            background: #0284c7;
-            color: white;
-            border: none;
-            border-radius: 15px;
-            font-size: 16px;
-            font-weight: bold;
-            cursor: pointer;
-            transition: all 0.3s;
-            margin-bottom: 20px;
-        }
-        
-        .new-chat-btn:hover {
-            background: #0369a1;
-            transform: scale(1.02);
-        }
-        
-        .chat-section {
-            background: white;
-            border-radius: 30px;
-            overflow: hidden;
-            box-shadow: 0 10px 30px rgba(0, 0, 0, 0.1);
-            display: flex;
-            flex-direction: column;
-        }
-        
-        .chat-header {
-            background: linear-gradient(145deg, #38bdf8, #0284c7);
-            color: white;
-            padding: 20px;
-            font-size: 24px;
-            font-weight: bold;
-            display: flex;
-            align-items: center;
-            justify-content: space-between;
-        }
-        
-        .chat-header span {
-            display: flex;
-            align-items: center;
-            gap: 10px;
-        }
-        
-        .save-chat-btn {
-            background: white;
-            color: #0284c7;
-            border: none;
-            border-radius: 15px;
-            padding: 10px 20px;
-            font-size: 14px;
-            font-weight: bold;
-            cursor: pointer;
-            transition: all 0.3s;
-        }
-        
-        .save-chat-btn:hover {
-            background: #e0f2fe;
-            transform: scale(1.05);
-        }
-        
-        .chat-messages {
-            height: 400px;
-            padding: 20px;
-            overflow-y: auto;
-            background: #f8fafc;
-        }
-        
-        .message {
-            margin-bottom: 15px;
-            max-width: 80%;
-            padding: 12px 18px;
-            border-radius: 15px;
-            word-wrap: break-word;
-            animation: messageAppear 0.3s;
-        }
-        
-        @keyframes messageAppear {
-            from {
-                opacity: 0;
-                transform: translateY(10px);
-            }
-            to {
-                opacity: 1;
-                transform: translateY(0);
-            }
-        }
-        
-        .user-message {
-            background: #0284c7;
-            color: white;
-            margin-left: auto;
-            border-bottom-right-radius: 5px;
-        }
-        
-        .bot-message {
-            background: white;
-            color: #0c4a6e;
-            border: 1px solid #bae6fd;
-            border-bottom-left-radius: 5px;
-        }
-        
-        .chat-input {
-            padding: 20px;
-            background: white;
-            border-top: 2px solid #bae6fd;
-            display: flex;
-            gap: 10px;
-        }
-        
-        .chat-input input {
-            flex: 1;
-            padding: 15px;
-            border: 2px solid #e2e8f0;
-            border-radius: 15px;
-            font-size: 16px;
-            outline: none;
-            transition: border-color 0.3s;
-        }
-        
-        .chat-input input:focus {
-            border-color: #0284c7;
-        }
-        
-        .chat-input button {
-            background: #0284c7;
-            color: white;
-            border: none;
-            border-radius: 15px;
-            padding: 15px 30px;
-            font-size: 16px;
-            font-weight: bold;
-            cursor: pointer;
-            transition: all 0.3s;
-        }
-        
-        .chat-input button:hover {
-            background: #0369a1;
-            transform: scale(1.05);
-        }
-        
-        .typing-indicator {
-            color: #64748b;
-            font-style: italic;
-            padding: 10px;
-        }
-        
-        .embed-section {
-            background: white;
-            border-radius: 30px;
-            padding: 30px;
-            margin-top: 30px;
-        }
-        
-        .embed-title {
-            font-size: 24px;
-            color: #0c4a6e;
-            margin-bottom: 20px;
-            display: flex;
-            align-items: center;
-            gap: 10px;
-        }
-        
-        .code-block {
-            background: #1e293b;
-            color: #e2e8f0;
-            padding: 20px;
-            border-radius: 15px;
-            font-family: 'Courier New', monospace;
-            font-size: 14px;
-            overflow-x: auto;
-            white-space: pre-wrap;
-            margin-bottom: 20px;
-            position: relative;
-        }
-        
-        .copy-btn {
-            background: #0284c7;
-            color: white;
-            border: none;
-            border-radius: 10px;
-            padding: 10px 20px;
-            cursor: pointer;
-            font-weight: bold;
-            transition: all 0.3s;
-        }
-        
-        .copy-btn:hover {
-            background: #0369a1;
-        }
-        
-        .flash {
-            padding: 15px 25px;
-            border-radius: 15px;
-            margin-bottom: 20px;
-            font-weight: 500;
-            animation: slideIn 0.5s;
-        }
-        
-        .flash-success {
-            background: #dcfce7;
-            color: #166534;
-            border-left: 5px solid #22c55e;
-        }
-        
-        .flash-error {
-            background: #fee2e2;
-            color: #991b1b;
-            border-left: 5px solid #ef4444;
-        }
-        
-        @keyframes slideIn {
-            from {
-                transform: translateY(-20px);
-                opacity: 0;
-            }
-            to {
-                transform: translateY(0);
-                opacity: 1;
-            }
-        }
-        
-        @media (max-width: 768px) {
-            .container {
-                padding: 20px;
-            }
-            
-            .bot-name {
-                font-size: 36px;
-            }
-            
-            .main-content {
-                grid-template-columns: 1fr;
-            }
-        }
-    </style>
+    <link rel="stylesheet" href="{{ asset_url('perra.css') }}">
 </head>
 <body>
     <div class="cloud cloud1"></div>
@@ -1192,7 +567,7 @@ TEMPLATE = '''
     <div class="container">
         <div class="header">
             <div class="bot-avatar">
-                <img src="/static/1000162143-fotor-bg-remover-2026030214294.png" alt="Пэрра">
+                <img src="{{ asset_url('1000162143-fotor-bg-remover-2026030214294.png') }}" alt="Пэрра">
             </div>
             <div class="bot-info">
                 <div class="bot-name">Пэрра ИИ</div>
@@ -1201,6 +576,7 @@ TEMPLATE = '''
             </div>
         </div>
         
+        {% if not shell %}
         {% with messages = get_flashed_messages(with_categories=true) %}
             {% if messages %}
                 {% for category, message in messages %}
@@ -1208,6 +584,7 @@ TEMPLATE = '''
                 {% endfor %}
             {% endif %}
         {% endwith %}
+        {% endif %}
         
         <div class="user-info">
             <input type="text" id="userName" placeholder="Введите ваше имя..." value="{{ user_name }}">
@@ -1219,14 +596,11 @@ TEMPLATE = '''
                 <button class="new-chat-btn" onclick="newChat()">➕ Новый чат</button>
                 <h3>📁 Сохранённые чаты</h3>
                 <div class="chat-list" id="chatList">
-                    {% for chat in saved_chats %}
-                    <div class="chat-item" onclick="loadChat('{{ chat.id }}')">
-                        <div class="chat-name">{{ chat.user_name }}</div>
-                        <div class="chat-date">{{ chat.last_updated }}</div>
-                        <div class="chat-count">{{ chat.message_count }} сообщений</div>
-                    </div>
-                    {% endfor %}
+                    {{ chat_list_html }}
                 </div>
+                {% if next_cursor %}
+                <button class="more-chats-btn" id="moreChatsBtn" data-cursor="{{ next_cursor }}" onclick="loadMoreChats()">Показать ещё</button>
+                {% endif %}
             </div>
             
             <div class="chat-section">
@@ -1238,12 +612,7 @@ TEMPLATE = '''
                     <button class="save-chat-btn" onclick="saveCurrentChat()">💾 Сохранить чат</button>
                 </div>
                 <div class="chat-messages" id="chatMessages">
-                    {% for msg in current_chat %}
-                    <div class="message {{ 'user-message' if msg.sender == 'user' else 'bot-message' }}">
-                        {{ msg.text }}
-                        <div style="font-size: 10px; color: #94a3b8; margin-top: 5px;">{{ msg.time }}</div>
-                    </div>
-                    {% endfor %}
+                    {{ messages_html }}
                 </div>
                 <div class="chat-input">
                     <input type="text" id="messageInput" placeholder="Напиши сообщение..." onkeypress="if(event.key==='Enter') sendMessage()">
@@ -1271,154 +640,325 @@ TEMPLATE = '''
     
     <script>
         let currentChatId = '{{ current_chat_id }}';
-        let messages = {{ current_chat|tojson }};
-        
-        // PWA Service Worker Registration
-        if ('serviceWorker' in navigator) {
-            window.addEventListener('load', () => {
-                navigator.serviceWorker.register('/static/sw.js')
-                    .then(reg => console.log('✅ PWA ready!'))
-                    .catch(err => console.log('❌ PWA error:', err));
-            });
-        }
-        
-        function setUserName() {
-            const name = document.getElementById('userName').value.trim();
-            if (name) {
-                fetch('/set_username', {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ name: name })
-                }).then(() => {
-                    showNotification('✅ Имя сохранено!');
-                });
-            }
-        }
-        
-        async function sendMessage() {
-            const input = document.getElementById('messageInput');
-            const message = input.value.trim();
-            if (!message) return;
-            
-            const messagesDiv = document.getElementById('chatMessages');
-            const currentTime = new Date().toLocaleTimeString('ru-RU', { hour: '2-digit', minute: '2-digit' });
-            
-            messagesDiv.innerHTML += `<div class="message user-message">${escapeHtml(message)}<div style="font-size: 10px; color: #94a3b8; margin-top: 5px;">${currentTime}</div></div>`;
-            input.value = '';
-            
-            messagesDiv.innerHTML += `<div class="typing-indicator" id="typingIndicator">Пэрра печатает...</div>`;
-            messagesDiv.scrollTop = messagesDiv.scrollHeight;
-            
-            try {
-                const response = await fetch('/api/chat', {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ 
-                        message: message,
-                        chat_id: currentChatId
-                    })
-                });
-                
-                const data = await response.json();
-                
-                document.getElementById('typingIndicator')?.remove();
-                messagesDiv.innerHTML += `<div class="message bot-message">${escapeHtml(data.response)}<div style="font-size: 10px; color: #94a3b8; margin-top: 5px;">${currentTime}</div></div>`;
-                messagesDiv.scrollTop = messagesDiv.scrollHeight;
-                
-                messages = data.messages;
-                
-            } catch (error) {
-                document.getElementById('typingIndicator')?.remove();
-                messagesDiv.innerHTML += `<div class="message bot-message">Ошибка связи. Но я всё равно ничего не сделаю! 😜<div style="font-size: 10px; color: #94a3b8; margin-top: 5px;">${currentTime}</div></div>`;
-            }
-        }
-        
-        function newChat() {
-            fetch('/new_chat', {
-                method: 'POST'
-            }).then(response => response.json())
-              .then(data => {
-                  window.location.href = `/?chat_id=${data.chat_id}`;
-              });
-        }
-        
-        function loadChat(chatId) {
-            window.location.href = `/?chat_id=${chatId}`;
-        }
-        
-        function saveCurrentChat() {
-            fetch('/save_chat', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ chat_id: currentChatId })
-            }).then(() => {
-                showNotification('✅ Чат сохранён!');
-                setTimeout(() => location.reload(), 1000);
-            });
-        }
-        
-        function copyEmbedCode() {
-            const codeElement = document.getElementById('embedCode');
-            navigator.clipboard.writeText(codeElement.textContent).then(() => {
-                alert('✅ Код скопирован!');
-            });
-        }
-        
-        function escapeHtml(unsafe) {
-            return unsafe.replace(/&/g, "&amp;").replace(/</g, "&lt;").replace(/>/g, "&gt;");
-        }
-        
-        function showNotification(text) {
-            const div = document.createElement('div');
-            div.className = 'flash flash-success';
-            div.textContent = text;
-            document.querySelector('.container').insertBefore(div, document.querySelector('.main-content'));
-            setTimeout(() => div.remove(), 3000);
-        }
+        let lastSeq = {{ last_seq }};
+        let historyBefore = {{ history_before|tojson }};
     </script>
+    <script src="{{ asset_url('perra.js') }}"></script>
 </body>
 </html>
 '''
 
-@app.route('/', methods=['GET'])
-def index():
-    stats = update_stats('visits')
-    
-    # Получаем или создаём имя пользователя
-    if 'user_name' not in session:
-        session['user_name'] = f"Гость_{random.randint(100, 999)}"
+# Фрагменты страницы, которые меняются от запроса к запросу
+CHAT_LIST_TEMPLATE = '''
+{% for chat in saved_chats %}
+<div class="chat-item" onclick="loadChat('{{ chat.id }}')">
+    <div class="chat-name">{{ chat.user_name }}</div>
+    <div class="chat-date">{{ chat.last_updated }}</div>
+    <div class="chat-count">{{ chat.message_count }} сообщений</div>
+</div>
+{% endfor %}
+'''
+
+MESSAGES_TEMPLATE = '''
+{% for msg in current_chat %}
+<div class="message {{ 'user-message' if msg.sender == 'user' else 'bot-message' }}" data-seq="{{ msg.seq }}">
+    {{ msg.text }}
+    <div style="font-size: 10px; color: #94a3b8; margin-top: 5px;">{{ msg.time }}</div>
+</div>
+{% endfor %}
+'''
+
+def file_fingerprint(path):
+    with open(path, 'rb') as f:
+        return hashlib.md5(f.read()).hexdigest()[:12]
+
+ASSET_VERSIONS = {
+    name: file_fingerprint(os.path.join(STATIC_FOLDER, name)) for name in FINGERPRINTED_ASSETS
+}
+
+@app.template_global()
+def asset_url(filename):
+    """Адрес статики с отпечатком содержимого"""
+    version = ASSET_VERSIONS.get(filename)
+    if version:
+        return f'/static/{filename}?v={version}'
+    return f'/static/{filename}'
+
+# Оболочка главной: та же страница, но без сессии, списка чатов и сообщений -
+# одна на всех. Service worker отдаёт её на заходы на /, а данные страница
+# догружает через API
+SHELL_URL = '/shell'
+
+# Service worker собирается при запуске: имя кэша - отпечаток всей статики,
+# так что новая версия сайта сама вытесняет старый кэш
+SERVICE_WORKER_TEMPLATE = """
+const CACHE_NAME = '__CACHE_NAME__';
+const PRECACHE = __PRECACHE__;
+const SHELL_URL = '__SHELL_URL__';
+
+self.addEventListener('install', event => {
+    event.waitUntil(
+        caches.open(CACHE_NAME)
+            .then(cache => cache.addAll(PRECACHE))
+            .then(() => self.skipWaiting())
+    );
+});
+
+self.addEventListener('activate', event => {
+    // Удаляем кэши прошлых версий
+    event.waitUntil(
+        caches.keys()
+            .then(names => Promise.all(names
+                .filter(name => name.startsWith('perra-') && name !== CACHE_NAME)
+                .map(name => caches.delete(name))))
+            .then(() => self.clients.claim())
+    );
+});
+
+self.addEventListener('fetch', event => {
+    const request = event.request;
+    const url = new URL(request.url);
+    // POST, чужие сайты и API - всегда напрямую в сеть
+    if (request.method !== 'GET' || url.origin !== self.location.origin || url.pathname.startsWith('/api/')) {
+        return;
+    }
+    if (url.pathname.startsWith('/static/') && url.searchParams.has('v')) {
+        event.respondWith(cacheFirst(request));
+    } else if (request.mode === 'navigate' && url.pathname === '/') {
+        // Любой ?chat_id=... - та же оболочка, чат она загрузит сама
+        event.respondWith(staleWhileRevalidate(event, SHELL_URL));
+    }
+});
+
+async function cacheFirst(request) {
+    // Адрес с отпечатком никогда не меняет содержимое
+    const cached = await caches.match(request);
+    if (cached) return cached;
+    const response = await fetch(request);
+    if (response.ok) {
+        const cache = await caches.open(CACHE_NAME);
+        cache.put(request, response.clone());
+    }
+    return response;
+}
+
+async function staleWhileRevalidate(event, url) {
+    // Оболочка не зависит от сессии: сразу из кэша, а свежая копия - в фоне
+    const cache = await caches.open(CACHE_NAME);
+    const cached = await cache.match(url);
+    const fresh = fetch(url).then(response => {
+        if (response.ok) cache.put(url, response.clone());
+        return response;
+    });
+    if (cached) {
+        event.waitUntil(fresh.catch(() => {}));
+        return cached;
+    }
+    return fresh;
+}
+"""
+
+def build_service_worker():
+    precache = [asset_url(name) for name in FINGERPRINTED_ASSETS] + [SHELL_URL]
+    fingerprint = hashlib.md5(json.dumps([SERVICE_WORKER_TEMPLATE, ASSET_VERSIONS, TEMPLATE],
+                                         sort_keys=True).encode('utf-8')).hexdigest()[:12]
+    script = (SERVICE_WORKER_TEMPLATE
+              .replace('__CACHE_NAME__', f'perra-{fingerprint}')
+              .replace('__PRECACHE__', json.dumps(precache))
+              .replace('__SHELL_URL__', SHELL_URL))
+    return script, fingerprint
+
+SERVICE_WORKER, SERVICE_WORKER_VERSION = build_service_worker()
+
+# Шаблоны компилируем один раз при запуске
+PAGE_TEMPLATE = app.jinja_env.from_string(TEMPLATE)
+CHAT_LIST_FRAGMENT = app.jinja_env.from_string(CHAT_LIST_TEMPLATE)
+MESSAGES_FRAGMENT = app.jinja_env.from_string(MESSAGES_TEMPLATE)
+
+def build_index_page(chat_id, user_name, host):
+    """Собирает всё для главной страницы (с обращениями к хранилищу)"""
+    update_stats('visits')
     
-    # Получаем ID чата из параметров или создаём новый
-    chat_id = request.args.get('chat_id')
-    if not chat_id:
-        chat_id = str(uuid.uuid4())
+    # ID чата из параметров или новый. Новый чат живёт только в адресе
+    # страницы - в хранилище он появится с первым сообщением
+    if not valid_chat_id(chat_id):
+        chat_id = new_chat_id()
     
-    # Загружаем текущий чат
-    current_chat = load_chat(chat_id)
-    if not current_chat:
-        current_chat = {
-            'chat_id': chat_id,
-            'user_name': session['user_name'],
-            'messages': [],
-            'last_updated': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        }
-        save_chat(chat_id, session['user_name'], [])
+    # Только хвост текущего чата: страница не растёт вместе с историей
+    with metrics.phase('load_chat'):
+        messages = chat_storage.messages_before(chat_id, None, INITIAL_MESSAGES)
     
-    # Получаем список всех чатов
-    saved_chats = get_all_chats()
+    # Получаем первую страницу чатов
+    saved_chats, next_cursor = get_chats_page()
     
     # Создаём код для вставки
-    embed_code = EMBED_HTML.replace('YOUR-SITE.com', request.host)
+    embed_code = EMBED_HTML.replace('YOUR-SITE.com', host)
+    
+    with metrics.phase('render_fragments'):
+        chat_list_html = Markup(CHAT_LIST_FRAGMENT.render(saved_chats=saved_chats))
+        messages_html = Markup(MESSAGES_FRAGMENT.render(current_chat=messages))
     
-    return render_template_string(
-        TEMPLATE, 
-        stats=stats, 
-        saved_chats=saved_chats,
-        current_chat=current_chat['messages'],
-        current_chat_id=chat_id,
-        user_name=session['user_name'],
-        embed_code=embed_code
-    )
+    return {
+        'stats': get_stats(),
+        'chat_list_html': chat_list_html,
+        'messages_html': messages_html,
+        'next_cursor': next_cursor,
+        'last_seq': messages[-1]['seq'] if messages else 0,
+        'history_before': messages[0]['seq'] if messages and messages[0]['seq'] > 1 else None,
+        'current_chat_id': chat_id,
+        'user_name': user_name,
+        'embed_code': embed_code
+    }
+
+def build_shell_page(host):
+    """Оболочка главной: без сессии, чата и статистики. Всё это JS берёт из API"""
+    return {
+        'shell': True,
+        'chat_list_html': '',
+        'messages_html': '',
+        'next_cursor': None,
+        'last_seq': 0,
+        'history_before': None,
+        'current_chat_id': '',
+        'user_name': '',
+        'embed_code': EMBED_HTML.replace('YOUR-SITE.com', host)
+    }
+
+def new_guest_name():
+    return f"Гость_{random.randint(100, 999)}"
+
+def new_chat_id():
+    """ID для нового чата. Ничего не записывает: append создаст чат
+    при первом сообщении"""
+    return str(uuid.uuid4())
+
+def valid_chat_id(chat_id):
+    """Годится ли chat_id из запроса. Принимаются только uuid:
+    из ID строится путь к файлу чата"""
+    return isinstance(chat_id, str) and CHAT_ID_RE.fullmatch(chat_id) is not None
+
+def mark_chat_saved(chat_id):
+    """Кнопка «Сохранить чат»: обновляет дату чата"""
+    if chat_storage.touch(chat_id):
+        update_stats('saved_chats')
+
+def get_messages_page(chat_id, after, limit):
+    """Страница истории чата для API"""
+    messages = chat_storage.messages_after(chat_id, after, limit)
+    next_after = messages[-1]['seq'] if len(messages) == limit else None
+    return {'messages': messages, 'next_after': next_after}
+
+def history_validators(chat_id, *params):
+    """ETag и Last-Modified страницы истории - по сводке чата из индекса,
+    без чтения сообщений. (None, None), если чата нет"""
+    summary = chat_storage.chat_summary(chat_id)
+    if not summary:
+        return None, None
+    key = json.dumps([chat_id, summary['message_count'], summary['last_updated'], params])
+    etag = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    last_modified = datetime.datetime.strptime(summary['last_updated'], '%Y-%m-%d %H:%M:%S').astimezone()
+    return etag, last_modified
+
+def not_modified(req, etag, last_modified):
+    """Есть ли у клиента актуальная копия (If-None-Match важнее If-Modified-Since)"""
+    if req.if_none_match:
+        return req.if_none_match.contains_weak(etag)
+    if req.if_modified_since:
+        return last_modified <= req.if_modified_since
+    return False
+
+def set_validators(response, etag, last_modified):
+    if etag:
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        # Кэшировать можно, но каждый раз сверяясь с сервером
+        response.cache_control.no_cache = True
+    return response
+
+def get_older_messages_page(chat_id, before, limit):
+    """Страница истории перед сообщением before - для подгрузки при прокрутке вверх"""
+    messages = chat_storage.messages_before(chat_id, before, limit)
+    next_before = messages[0]['seq'] if messages and messages[0]['seq'] > 1 else None
+    return {'messages': messages, 'next_before': next_before}
+
+def request_route():
+    """Шаблон маршрута для подписи замеров (без конкретных chat_id)"""
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+@app.before_request
+def start_request_metrics():
+    if metrics.ENABLED:
+        g.metrics_start = time.perf_counter()
+        if metrics.profiler:
+            g.profile = metrics.profiler.start()
+
+@app.after_request
+def finish_request_metrics(response):
+    if metrics.ENABLED and 'metrics_start' in g:
+        profile = g.pop('profile', None)
+        if profile:
+            metrics.profiler.stop(profile, request_route())
+        metrics.observe_request(request.method, request_route(), response.status_code,
+                                time.perf_counter() - g.metrics_start)
+    return response
+
+@app.after_request
+def compress_response(response):
+    """Сжимает HTML и JSON, если клиент умеет. Потоковые ответы (SSE) и файлы не трогаем"""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers):
+        return response
+    body = response.get_data()
+    if not should_compress(response.mimetype, len(body)):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding:
+        body = compress(body, encoding)
+        response.set_data(body)
+        mark_encoded(response, encoding, body)
+    return response
+
+def metrics_gauges():
+    """Текущие значения, которые не копятся в metrics: кэш чатов и статистика"""
+    gauges = {f'perra_stats_{key}': value for key, value in get_stats().items()}
+    if isinstance(chat_storage, CachedChatStorage):
+        gauges.update({f'perra_chat_cache_{key}': value
+                       for key, value in chat_storage.cache_stats().items()})
+    return gauges
+
+@app.route('/', methods=['GET'])
+def index():
+    # Получаем или создаём имя пользователя
+    if 'user_name' not in session:
+        session['user_name'] = new_guest_name()
+    
+    page = build_index_page(request.args.get('chat_id'), session['user_name'], request.host)
+    with metrics.phase('render'):
+        return render_template(PAGE_TEMPLATE, **page)
+
+@app.route(SHELL_URL, methods=['GET'])
+def shell():
+    response = app.response_class(render_template(PAGE_TEMPLATE, **build_shell_page(request.host)),
+                                  mimetype='text/html')
+    response.cache_control.no_cache = True
+    return response
+
+@app.route('/api/session', methods=['GET'])
+def session_api():
+    """Имя пользователя для оболочки. Заход через оболочку - тоже посещение"""
+    if 'user_name' not in session:
+        session['user_name'] = new_guest_name()
+    update_stats('visits')
+    response = jsonify({'user_name': session['user_name']})
+    response.cache_control.no_store = True
+    return response
+
+@app.route('/api/chats', methods=['GET'])
+def chats_api():
+    limit = min(max(request.args.get('limit', SIDEBAR_PAGE_SIZE, type=int), 1), 100)
+    chats, next_cursor = get_chats_page(limit, request.args.get('cursor'))
+    return jsonify({'chats': chats, 'next_cursor': next_cursor})
 
 @app.route('/set_username', methods=['POST'])
 def set_username():
@@ -1428,78 +968,276 @@ def set_username():
 
 @app.route('/new_chat', methods=['POST'])
 def new_chat():
-    chat_id = str(uuid.uuid4())
-    save_chat(chat_id, session['user_name'], [])
-    return jsonify({'chat_id': chat_id})
+    return jsonify({'chat_id': new_chat_id()})
 
 @app.route('/save_chat', methods=['POST'])
 def save_chat_route():
     data = request.json
-    chat_id = data.get('chat_id')
-    chat_data = load_chat(chat_id)
-    if chat_data:
-        chat_data['last_updated'] = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        filename = os.path.join(CHATS_FOLDER, f'{chat_id}.json')
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(chat_data, f, ensure_ascii=False, indent=2)
-        update_stats('saved_chats')
+    if not valid_chat_id(data.get('chat_id')):
+        return jsonify({'error': 'нужен chat_id'}), 400
+    mark_chat_saved(data.get('chat_id'))
     return jsonify({'status': 'ok'})
 
-@app.route('/api/chat', methods=['POST'])
-def chat_api():
-    data = request.json
-    message = data.get('message', '')
-    chat_id = data.get('chat_id')
-    
+def process_chat_message(chat_id, message, user_name):
+    """Отвечает на сообщение и дописывает пару сообщений в чат.
+    Возвращает (ответ, новые сообщения с номерами seq)"""
+    flags = classify(message)
+    response = get_bot_response(message, user_name, chat_rng(chat_id), flags)
+    return response, record_chat_turn(chat_id, message, response, user_name, flags)
+
+def record_chat_turn(chat_id, message, response, user_name, flags):
+    """Сохраняет сообщение и ответ, обновляет статистику; flags - маска
+    категорий сообщения. Возвращает новые сообщения с номерами seq"""
     # Обновляем статистику
     update_stats('chat_messages')
     
-    # Получаем имя пользователя из сессии
-    user_name = session.get('user_name', 'Гость')
+    # Дописываем только новую пару сообщений
+    current_time = datetime.datetime.now().strftime('%H:%M')
+    new_messages = [
+        {'sender': 'user', 'text': message, 'time': current_time},
+        {'sender': 'bot', 'text': response, 'time': current_time}
+    ]
+    last_seq = append_chat_messages(chat_id, user_name, new_messages)
+    
+    # Если это команда - увеличиваем счётчик отказов
+    if flags & CAT_COMMAND:
+        update_stats('refusals')
     
-    # Получаем ответ от бота
-    response = get_bot_response(message, user_name)
+    return number_messages(new_messages, last_seq - len(new_messages) + 1)
+
+def process_chat_batch(items, user_name):
+    """Отвечает на пачку сообщений {chat_id, message}.
+    Каждый затронутый чат дописывается одной записью, статистика -
+    одним увеличением на всю пачку. Результаты - в порядке items"""
+    current_time = datetime.datetime.now().strftime('%H:%M')
+    by_chat = {}
+    refusals = 0
+    for position, item in enumerate(items):
+        message = item.get('message', '')
+        flags = classify(message)
+        response = get_bot_response(message, user_name, chat_rng(item['chat_id']), flags)
+        if flags & CAT_COMMAND:
+            refusals += 1
+        by_chat.setdefault(item['chat_id'], []).append((position, message, response))
+    
+    results = [None] * len(items)
+    for chat_id, turns in by_chat.items():
+        new_messages = []
+        for _, message, response in turns:
+            new_messages.append({'sender': 'user', 'text': message, 'time': current_time})
+            new_messages.append({'sender': 'bot', 'text': response, 'time': current_time})
+        last_seq = append_chat_messages(chat_id, user_name, new_messages)
+        numbered = number_messages(new_messages, last_seq - len(new_messages) + 1)
+        for i, (position, _, response) in enumerate(turns):
+            pair = numbered[2 * i:2 * i + 2]
+            results[position] = {'chat_id': chat_id, 'response': response,
+                                 'messages': pair, 'seq': pair[-1]['seq']}
     
-    # Загружаем текущий чат
+    update_stats('chat_messages', len(items))
+    if refusals:
+        update_stats('refusals', refusals)
+    return results
+
+def validate_chat_batch(data):
+    """Проверяет тело пакетного запроса, возвращает (items, ошибка)"""
+    items = data.get('items') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return None, 'items должен быть непустым списком'
+    if len(items) > BATCH_MAX_ITEMS:
+        return None, f'не больше {BATCH_MAX_ITEMS} сообщений за раз'
+    for item in items:
+        if (not isinstance(item, dict) or not valid_chat_id(item.get('chat_id'))
+                or not isinstance(item.get('message', ''), str)):
+            return None, 'каждый элемент - {chat_id, message}'
+    return items, None
+
+@app.route('/api/chat', methods=['POST'])
+def chat_api():
+    """Старый формат ответа: вся история чата целиком"""
+    data = request.json
+    chat_id = data.get('chat_id')
+    if not valid_chat_id(chat_id):
+        return jsonify({'error': 'нужен chat_id'}), 400
+    user_name = session.get('user_name', 'Гость')
+    response, _ = process_chat_message(chat_id, data.get('message', ''), user_name)
     chat_data = load_chat(chat_id)
-    if not chat_data:
-        chat_data = {
-            'chat_id': chat_id,
-            'user_name': user_name,
-            'messages': []
-        }
+    return jsonify({'response': response, 'messages': chat_data['messages']})
+
+@app.route('/api/v2/chat', methods=['POST'])
+def chat_api_v2():
+    """Ответ только с новой парой сообщений и номером последнего из них"""
+    data = request.json
+    if not valid_chat_id(data.get('chat_id')):
+        return jsonify({'error': 'нужен chat_id'}), 400
+    user_name = session.get('user_name', 'Гость')
+    response, new_messages = process_chat_message(data.get('chat_id'), data.get('message', ''), user_name)
+    return jsonify({'response': response, 'messages': new_messages, 'seq': new_messages[-1]['seq']})
+
+@app.route('/api/v2/chat/batch', methods=['POST'])
+def chat_batch_api():
+    """Пачка сообщений в один запрос: {"items": [{"chat_id": ..., "message": ...}, ...]}"""
+    items, error = validate_chat_batch(request.get_json(silent=True))
+    if error:
+        return jsonify({'error': error}), 400
+    user_name = session.get('user_name', 'Гость')
+    return jsonify({'results': process_chat_batch(items, user_name)})
+
+@app.route('/api/v2/chat/stream', methods=['POST'])
+def chat_stream_api():
+    """Ответ бота потоком server-sent events, по одному токену.
+    Сообщение пользователя сохраняется сразу, ответ - когда поток кончится
+    или оборвётся. Без chat_id ничего не сохраняется. Чужим сайтам маршрут закрыт: виджет
+    ходит в /api/embed/chat с ограничением частоты"""
+    data = request.get_json(force=True, silent=True) or {}
+    message = data.get('message', '')
+    chat_id = data.get('chat_id')
+    if chat_id and not valid_chat_id(chat_id):
+        return jsonify({'error': 'неверный chat_id'}), 400
+    user_name = session.get('user_name', 'Гость')
     
-    # Добавляем сообщения в историю
-    current_time = datetime.datetime.now().strftime('%H:%M')
-    chat_data['messages'].append({
-        'sender': 'user',
-        'text': message,
-        'time': current_time
-    })
-    chat_data['messages'].append({
-        'sender': 'bot',
-        'text': response,
-        'time': current_time
-    })
-    chat_data['last_updated'] = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    flags = classify(message)
+    user_message = start_stream_turn(chat_id, message, user_name, flags)
+    reply = stream_bot_response(message, user_name, chat_rng(chat_id), flags)
     
-    # Сохраняем чат
-    save_chat(chat_id, user_name, chat_data['messages'])
+    def generate():
+        tokens = []
+        try:
+            for token in reply:
+                tokens.append(token)
+                yield sse_event('token', {'text': token})
+                if WSGI_STREAM_TOKEN_DELAY:
+                    time.sleep(WSGI_STREAM_TOKEN_DELAY)
+        finally:
+            # Ответ сохраняется и при обрыве соединения (GeneratorExit)
+            done = finish_stream_turn(chat_id, user_message, tokens, user_name)
+        yield sse_event('done', done)
     
-    # Если это команда - увеличиваем счётчик отказов
-    if any(command in message.lower() for command in COMMAND_WORDS):
+    stream = app.response_class(generate(), mimetype='text/event-stream')
+    stream.headers['Cache-Control'] = 'no-cache'
+    stream.headers['X-Accel-Buffering'] = 'no'
+    return stream
+
+def embed_chat_reply(data, client):
+    """Ответ виджету на чужом сайте: без сессии и без сохранения чата.
+    Возвращает (тело, код ответа, заголовки)"""
+    wait = embed_limiter.acquire(client) if embed_limiter else 0
+    if wait:
+        return {'error': 'слишком много сообщений'}, 429, {'Retry-After': str(int(wait) + 1)}
+    message = data.get('message') if isinstance(data, dict) else None
+    if not isinstance(message, str) or not message.strip():
+        return {'error': 'нужно поле message'}, 400, {}
+    if len(message) > EMBED_MAX_MESSAGE:
+        return {'error': f'не длиннее {EMBED_MAX_MESSAGE} символов'}, 413, {}
+    update_stats('chat_messages')
+    flags = classify(message)
+    if flags & CAT_COMMAND:
         update_stats('refusals')
-    
-    return jsonify({'response': response, 'messages': chat_data['messages']})
+    return {'response': get_bot_response(message, 'Гость', flags=flags)}, 200, {}
+
+@app.route('/api/embed/chat', methods=['POST', 'OPTIONS'])
+def embed_chat_api():
+    """Чат для виджета. Виджет шлёт JSON как text/plain, чтобы браузер
+    обходился без preflight-запроса; OPTIONS оставлен для других клиентов"""
+    if request.method == 'OPTIONS':
+        return allow_cross_origin(app.response_class(status=204))
+    body, status, headers = embed_chat_reply(request.get_json(force=True, silent=True), request.remote_addr)
+    response = jsonify(body)
+    response.status_code = status
+    response.headers.update(headers)
+    response.cache_control.no_store = True
+    return allow_cross_origin(response)
+
+@app.route('/api/chats/<chat_id>/messages', methods=['GET'])
+def chat_messages_api(chat_id):
+    """История чата по страницам: сообщения с seq больше after
+    или, с параметром before, более старые - с seq меньше before
+    (before=0 - последние сообщения чата)"""
+    if not valid_chat_id(chat_id):
+        return jsonify({'error': 'нет такого чата'}), 404
+    limit = min(max(request.args.get('limit', HISTORY_PAGE_SIZE, type=int), 1), HISTORY_PAGE_SIZE)
+    # before=0 - хвост чата
+    before = max(request.args.get('before', 0, type=int), 0) if 'before' in request.args else None
+    after = max(request.args.get('after', 0, type=int), 0)
+    etag, last_modified = history_validators(chat_id, before, after, limit)
+    if etag and not_modified(request, etag, last_modified):
+        return set_validators(app.response_class(status=304), etag, last_modified)
+    if before is not None:
+        response = jsonify(get_older_messages_page(chat_id, before or None, limit))
+    else:
+        response = jsonify(get_messages_page(chat_id, after, limit))
+    return set_validators(response, etag, last_modified)
 
 @app.route('/static/<path:filename>')
 def static_files(filename):
-    return send_from_directory('static', filename)
+    # send_from_directory сам ставит ETag и Last-Modified и отвечает 304
+    response = send_from_directory(STATIC_FOLDER, filename)
+    version = ASSET_VERSIONS.get(filename)
+    if version and request.args.get('v') == version:
+        response.cache_control.public = True
+        response.cache_control.max_age = ASSET_MAX_AGE
+        response.cache_control.immutable = True
+        response.cache_control.no_cache = None
+    elif filename in EMBED_ASSETS:
+        # Эти файлы грузят чужие сайты - пусть кэшируют и браузеры, и CDN
+        response.cache_control.public = True
+        response.cache_control.max_age = EMBED_MAX_AGE
+        response.cache_control.stale_while_revalidate = EMBED_STALE_WHILE_REVALIDATE
+        response.cache_control.no_cache = None
+    if response.status_code == 200 and should_compress(response.mimetype, response.content_length or 0):
+        response.vary.add('Accept-Encoding')
+        encoding = choose_encoding(request.accept_encodings)
+        if encoding:
+            # Сжатая версия файла берётся из кэша, а не сжимается на каждый запрос
+            body = static_cache.get(safe_join(STATIC_FOLDER, filename), encoding)
+            if hasattr(response.response, 'close'):
+                response.response.close()
+            response.direct_passthrough = False
+            response.set_data(body)
+            mark_encoded(response, encoding, body)
+    return response
+
+@app.route('/sw.js')
+def service_worker():
+    """Service worker с корня сайта - только так он видит запросы к /"""
+    response = app.response_class(SERVICE_WORKER, mimetype='application/javascript')
+    response.set_etag(SERVICE_WORKER_VERSION)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
     return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
 
+def search_chats(query, page, limit):
+    """Страница результатов поиска для API"""
+    results, has_more = search_index.search(query, limit, (page - 1) * limit)
+    return {'query': query, 'results': results, 'next_page': page + 1 if has_more else None}
+
+def search_allowed(req):
+    return not SEARCH_TOKEN or req.headers.get('Authorization') == f'Bearer {SEARCH_TOKEN}'
+
+@app.route('/api/search', methods=['GET'])
+def search_api():
+    """Поиск по всем чатам: ?q=запрос&page=1&limit=20"""
+    if not search_index:
+        return 'Not Found', 404
+    if not search_allowed(request):
+        return jsonify({'error': 'нужен токен поиска'}), 403
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'нужен параметр q'}), 400
+    page = max(request.args.get('page', 1, type=int), 1)
+    limit = min(max(request.args.get('limit', SEARCH_PAGE_SIZE, type=int), 1), 100)
+    return jsonify(search_chats(query, page, limit))
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Замеры в формате Prometheus (только с PERRA_METRICS=1)"""
+    if not metrics.ENABLED:
+        return 'Not Found', 404
+    return app.response_class(metrics.render(metrics_gauges()),
+                              mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
     print("=" * 50)
     print("🌐 САЙТ ПЭРРЫ С СОХРАНЕНИЕМ ЧАТОВ ЗАПУЩЕН!")
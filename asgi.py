@@ -0,0 +1,305 @@
+# asgi.py - Асинхронный (ASGI) режим сайта Пэрры
+#
+# Те же маршруты, что и в app.py, но на одном цикле событий: тысячи
+# keep-alive и потоковых соединений не занимают по потоку каждое.
+# Работа с хранилищем уходит в ограниченный пул потоков.
+#
+# Запуск:
+#   pip install quart hypercorn
+#   hypercorn asgi:app --bind 0.0.0.0:9876
+
+import os
+import time
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from quart import Quart, request, session, jsonify, send_from_directory, render_template, Response, g
+from quart.wrappers.response import DataBody
+from hypercorn.middleware import ProxyFixMiddleware
+from werkzeug.security import safe_join
+
+import metrics
+from compression import choose_encoding, should_compress, compress, mark_encoded, static_cache
+
+import app as perra
+
+# Сколько потоков выделить под блокирующий I/O хранилища
+IO_THREADS = int(os.environ.get('PERRA_ASGI_IO_THREADS', '8'))
+io_pool = ThreadPoolExecutor(max_workers=IO_THREADS, thread_name_prefix='perra-io')
+
+app = Quart(__name__, static_folder=None)
+app.secret_key = perra.app.secret_key
+if perra.TRUSTED_PROXIES:
+    # Адрес клиента из X-Forwarded-For - как ProxyFix в app.py
+    app.asgi_app = ProxyFixMiddleware(app.asgi_app, mode='legacy', trusted_hops=perra.TRUSTED_PROXIES)
+app.config['MAX_CONTENT_LENGTH'] = perra.app.config['MAX_CONTENT_LENGTH']
+app.jinja_env.globals['asset_url'] = perra.asset_url
+
+# Шаблон страницы компилируем один раз, уже в окружении Quart
+PAGE_TEMPLATE = app.jinja_env.from_string(perra.TEMPLATE)
+
+
+async def run_io(func, *args):
+    """Выполняет блокирующий вызов в пуле потоков"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(io_pool, functools.partial(func, *args))
+
+
+@app.before_request
+async def start_request_metrics():
+    # cProfile здесь не снимаем: корутины разных запросов перемешаны в одном потоке
+    if metrics.ENABLED:
+        g.metrics_start = time.perf_counter()
+
+
+@app.after_request
+async def finish_request_metrics(response):
+    if metrics.ENABLED and 'metrics_start' in g:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe_request(request.method, route, response.status_code,
+                                time.perf_counter() - g.metrics_start)
+    return response
+
+
+@app.after_request
+async def compress_response(response):
+    # Сжимаем только готовые тела: потоки SSE и файлы идут как есть
+    if (response.status_code != 200 or not isinstance(response.response, DataBody)
+            or 'Content-Encoding' in response.headers):
+        return response
+    body = await response.get_data()
+    if not should_compress(response.mimetype, len(body)):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding:
+        body = await run_io(compress, body, encoding)
+        response.set_data(body)
+        mark_encoded(response, encoding, body)
+    return response
+
+
+@app.route('/', methods=['GET'])
+async def index():
+    if 'user_name' not in session:
+        session['user_name'] = perra.new_guest_name()
+
+    page = await run_io(perra.build_index_page, request.args.get('chat_id'),
+                        session['user_name'], request.host)
+    with metrics.phase('render'):
+        return await render_template(PAGE_TEMPLATE, **page)
+
+
+@app.route(perra.SHELL_URL, methods=['GET'])
+async def shell():
+    page = perra.build_shell_page(request.host)
+    response = Response(await render_template(PAGE_TEMPLATE, **page), mimetype='text/html')
+    response.cache_control.no_cache = True
+    return response
+
+
+@app.route('/api/session', methods=['GET'])
+async def session_api():
+    if 'user_name' not in session:
+        session['user_name'] = perra.new_guest_name()
+    perra.update_stats('visits')
+    response = jsonify({'user_name': session['user_name']})
+    response.cache_control.no_store = True
+    return response
+
+
+@app.route('/api/chats', methods=['GET'])
+async def chats_api():
+    limit = min(max(request.args.get('limit', perra.SIDEBAR_PAGE_SIZE, type=int), 1), 100)
+    chats, next_cursor = await run_io(perra.get_chats_page, limit, request.args.get('cursor'))
+    return jsonify({'chats': chats, 'next_cursor': next_cursor})
+
+
+@app.route('/set_username', methods=['POST'])
+async def set_username():
+    data = await request.get_json()
+    session['user_name'] = data.get('name', 'Гость')
+    return jsonify({'status': 'ok'})
+
+
+@app.route('/new_chat', methods=['POST'])
+async def new_chat():
+    return jsonify({'chat_id': perra.new_chat_id()})
+
+
+@app.route('/save_chat', methods=['POST'])
+async def save_chat_route():
+    data = await request.get_json()
+    if not perra.valid_chat_id(data.get('chat_id')):
+        return jsonify({'error': 'нужен chat_id'}), 400
+    await run_io(perra.mark_chat_saved, data.get('chat_id'))
+    return jsonify({'status': 'ok'})
+
+
+@app.route('/api/chat', methods=['POST'])
+async def chat_api():
+    """Старый формат ответа: вся история чата целиком"""
+    data = await request.get_json()
+    chat_id = data.get('chat_id')
+    if not perra.valid_chat_id(chat_id):
+        return jsonify({'error': 'нужен chat_id'}), 400
+    user_name = session.get('user_name', 'Гость')
+    response, _ = await run_io(perra.process_chat_message, chat_id, data.get('message', ''), user_name)
+    chat_data = await run_io(perra.load_chat, chat_id)
+    return jsonify({'response': response, 'messages': chat_data['messages']})
+
+
+@app.route('/api/v2/chat', methods=['POST'])
+async def chat_api_v2():
+    data = await request.get_json()
+    if not perra.valid_chat_id(data.get('chat_id')):
+        return jsonify({'error': 'нужен chat_id'}), 400
+    user_name = session.get('user_name', 'Гость')
+    response, new_messages = await run_io(perra.process_chat_message, data.get('chat_id'),
+                                          data.get('message', ''), user_name)
+    return jsonify({'response': response, 'messages': new_messages, 'seq': new_messages[-1]['seq']})
+
+
+@app.route('/api/v2/chat/batch', methods=['POST'])
+async def chat_batch_api():
+    items, error = perra.validate_chat_batch(await request.get_json(silent=True))
+    if error:
+        return jsonify({'error': error}), 400
+    user_name = session.get('user_name', 'Гость')
+    return jsonify({'results': await run_io(perra.process_chat_batch, items, user_name)})
+
+
+@app.route('/api/v2/chat/stream', methods=['POST'])
+async def chat_stream_api():
+    """Потоковый ответ: паузы между токенами - asyncio.sleep, а не занятый поток"""
+    data = await request.get_json(force=True, silent=True) or {}
+    message = data.get('message', '')
+    chat_id = data.get('chat_id')
+    if chat_id and not perra.valid_chat_id(chat_id):
+        return jsonify({'error': 'неверный chat_id'}), 400
+    user_name = session.get('user_name', 'Гость')
+
+    flags = perra.classify(message)
+    user_message = await run_io(perra.start_stream_turn, chat_id, message, user_name, flags)
+    reply = perra.stream_bot_response(message, user_name, perra.chat_rng(chat_id), flags)
+
+    async def generate():
+        tokens = []
+        try:
+            while True:
+                # Генератор ответа может быть медленным - токены берём в пуле потоков
+                token = await run_io(next, reply, None)
+                if token is None:
+                    break
+                tokens.append(token)
+                yield perra.sse_event('token', {'text': token})
+                if perra.STREAM_TOKEN_DELAY:
+                    await asyncio.sleep(perra.STREAM_TOKEN_DELAY)
+        finally:
+            # Ответ сохраняется и при обрыве соединения
+            done = await run_io(perra.finish_stream_turn, chat_id, user_message, tokens, user_name)
+        yield perra.sse_event('done', done)
+
+    stream = Response(generate(), mimetype='text/event-stream')
+    stream.timeout = None
+    stream.headers['Cache-Control'] = 'no-cache'
+    stream.headers['X-Accel-Buffering'] = 'no'
+    return stream
+
+
+@app.route('/api/embed/chat', methods=['POST', 'OPTIONS'])
+async def embed_chat_api():
+    if request.method == 'OPTIONS':
+        return perra.allow_cross_origin(Response('', status=204))
+    data = await request.get_json(force=True, silent=True)
+    # Чат не сохраняется, диска не касаемся - отвечаем прямо в цикле событий
+    body, status, headers = perra.embed_chat_reply(data, request.remote_addr)
+    response = jsonify(body)
+    response.status_code = status
+    response.headers.update(headers)
+    response.cache_control.no_store = True
+    return perra.allow_cross_origin(response)
+
+
+@app.route('/api/chats/<chat_id>/messages', methods=['GET'])
+async def chat_messages_api(chat_id):
+    if not perra.valid_chat_id(chat_id):
+        return jsonify({'error': 'нет такого чата'}), 404
+    limit = min(max(request.args.get('limit', perra.HISTORY_PAGE_SIZE, type=int), 1),
+                perra.HISTORY_PAGE_SIZE)
+    before = max(request.args.get('before', 0, type=int), 0) if 'before' in request.args else None
+    after = max(request.args.get('after', 0, type=int), 0)
+    etag, last_modified = await run_io(perra.history_validators, chat_id, before, after, limit)
+    if etag and perra.not_modified(request, etag, last_modified):
+        return perra.set_validators(Response('', status=304), etag, last_modified)
+    if before is not None:
+        response = jsonify(await run_io(perra.get_older_messages_page, chat_id, before or None, limit))
+    else:
+        response = jsonify(await run_io(perra.get_messages_page, chat_id, after, limit))
+    return perra.set_validators(response, etag, last_modified)
+
+
+@app.route('/static/<path:filename>')
+async def static_files(filename):
+    response = await send_from_directory(perra.STATIC_FOLDER, filename)
+    await response.make_conditional(request)
+    version = perra.ASSET_VERSIONS.get(filename)
+    if version and request.args.get('v') == version:
+        response.cache_control.public = True
+        response.cache_control.max_age = perra.ASSET_MAX_AGE
+        response.cache_control.immutable = True
+        response.cache_control.no_cache = None
+    elif filename in perra.EMBED_ASSETS:
+        response.cache_control.public = True
+        response.cache_control.max_age = perra.EMBED_MAX_AGE
+        response.cache_control.stale_while_revalidate = perra.EMBED_STALE_WHILE_REVALIDATE
+        response.cache_control.no_cache = None
+    if response.status_code == 200 and should_compress(response.mimetype, response.content_length or 0):
+        response.vary.add('Accept-Encoding')
+        encoding = choose_encoding(request.accept_encodings)
+        if encoding:
+            body = await run_io(static_cache.get, safe_join(perra.STATIC_FOLDER, filename), encoding)
+            response.set_data(body)
+            mark_encoded(response, encoding, body)
+    return response
+
+
+@app.route('/sw.js')
+async def service_worker():
+    response = Response(perra.SERVICE_WORKER, mimetype='application/javascript')
+    response.set_etag(perra.SERVICE_WORKER_VERSION)
+    response.cache_control.no_cache = True
+    return await response.make_conditional(request)
+
+
+@app.route('/uploads/<filename>')
+async def uploaded_file(filename):
+    return await send_from_directory(perra.app.config['UPLOAD_FOLDER'], filename)
+
+
+@app.route('/api/search', methods=['GET'])
+async def search_api():
+    if not perra.search_index:
+        return 'Not Found', 404
+    if not perra.search_allowed(request):
+        return jsonify({'error': 'нужен токен поиска'}), 403
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'нужен параметр q'}), 400
+    page = max(request.args.get('page', 1, type=int), 1)
+    limit = min(max(request.args.get('limit', perra.SEARCH_PAGE_SIZE, type=int), 1), 100)
+    return jsonify(await run_io(perra.search_chats, query, page, limit))
+
+
+@app.route('/metrics')
+async def metrics_endpoint():
+    if not metrics.ENABLED:
+        return 'Not Found', 404
+    return Response(metrics.render(perra.metrics_gauges()), mimetype='text/plain; version=0.0.4')
+
+
+@app.after_serving
+async def shutdown():
+    io_pool.shutdown(wait=True)
+    perra.stats_counters.flush()
@@ -0,0 +1 @@
+# Бенчмарки горячих путей Пэрры. Запуск: python -m benchmarks --help
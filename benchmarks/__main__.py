@@ -0,0 +1,115 @@
+# benchmarks/__main__.py - Запуск бенчмарков и сравнение с сохранённой базой
+#
+#   python -m benchmarks                         полный прогон, отчёт в bench_results.json
+#   python -m benchmarks --quick                 быстрый прогон на малых объёмах
+#   python -m benchmarks --save-baseline         сохранить результат как базу
+#   python -m benchmarks --only chat_api,index   только выбранные замеры
+#
+# Всё работает через тестовый клиент Flask, без сети, во временной папке.
+
+import os
+import sys
+import json
+import argparse
+import platform
+import datetime
+import tempfile
+import importlib
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(REPO_ROOT, 'benchmarks', 'baseline.json')
+
+BENCHMARKS = ['classifier', 'chat_api', 'index', 'stats', 'search']
+
+
+def result_key(item):
+    return f"{item['name']} {json.dumps(item['params'], sort_keys=True)}"
+
+
+def compare(results, baseline, threshold):
+    """Ищет замеры, которые стали медленнее базы больше чем на threshold"""
+    base = {result_key(item): item for item in baseline['results']}
+    regressions = []
+    for item in results:
+        old = base.get(result_key(item))
+        if not old or not old['mean_ms']:
+            continue
+        change = item['mean_ms'] / old['mean_ms'] - 1
+        item['baseline_mean_ms'] = old['mean_ms']
+        item['change'] = change
+        if change > threshold:
+            regressions.append(item)
+    return regressions
+
+
+def print_table(results):
+    print(f"{'замер':<22} {'параметры':<26} {'среднее, мс':>12} {'p95, мс':>10} {'оп/с':>12} {'к базе':>8}")
+    for item in results:
+        params = ', '.join(f'{k}={v}' for k, v in item['params'].items())
+        change = f"{item['change'] * 100:+.0f}%" if 'change' in item else ''
+        print(f"{item['name']:<22} {params:<26} {item['mean_ms']:>12.4f} {item['p95_ms']:>10.4f} "
+              f"{item['ops_per_sec']:>12.1f} {change:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Бенчмарки Пэрры')
+    parser.add_argument('--quick', action='store_true', help='малые объёмы для быстрой проверки')
+    parser.add_argument('--only', help='через запятую: ' + ', '.join(BENCHMARKS))
+    parser.add_argument('--storage', default='sqlite', choices=['sqlite', 'json', 'jsonl'])
+    parser.add_argument('--output', default='bench_results.json', help='куда записать отчёт')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='файл базы для сравнения')
+    parser.add_argument('--save-baseline', action='store_true', help='записать результат как базу')
+    parser.add_argument('--threshold', type=float, default=0.2, help='допустимое замедление (0.2 = 20%%)')
+    args = parser.parse_args()
+
+    selected = args.only.split(',') if args.only else BENCHMARKS
+    output = os.path.abspath(args.output)
+    baseline_path = os.path.abspath(args.baseline)
+
+    # app.py пишет файлы в текущую папку - уводим его во временную
+    workdir = tempfile.mkdtemp(prefix='perra-bench-')
+    os.chdir(workdir)
+    os.environ['PERRA_CHAT_STORAGE'] = args.storage
+    os.environ.setdefault('PERRA_STATS_FLUSH_INTERVAL', '3600')
+    sys.path.insert(0, REPO_ROOT)
+    app = importlib.import_module('app')
+
+    results = []
+    for name in selected:
+        module = importlib.import_module(f'benchmarks.bench_{name}')
+        print(f"▶ {name}...", file=sys.stderr)
+        results.extend(module.run(app, args.quick))
+
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'storage': args.storage,
+            'quick': args.quick,
+            'date': datetime.datetime.now().isoformat(timespec='seconds')
+        },
+        'results': results
+    }
+
+    regressions = []
+    if os.path.exists(baseline_path) and not args.save_baseline:
+        with open(baseline_path, 'r', encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.threshold)
+
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.save_baseline:
+        with open(baseline_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print_table(results)
+    print(f"\n📄 Отчёт: {output}")
+    if regressions:
+        print(f"❌ Замедлилось больше чем на {args.threshold:.0%}:")
+        for item in regressions:
+            print(f"   {result_key(item)}: {item['baseline_mean_ms']:.4f} → {item['mean_ms']:.4f} мс")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+# benchmarks/bench_chat_api.py - Задержка /api/chat в зависимости от длины чата
+
+import uuid
+
+from benchmarks.common import measure, fresh_storage, result
+
+
+def run(app, quick):
+    lengths = [10, 100, 1000] if quick else [10, 100, 1000, 10000]
+    repeat = 10 if quick else 30
+    client = app.app.test_client()
+    results = []
+    for length in lengths:
+        storage = fresh_storage(app, f'chat_api_{length}')
+        history = [
+            {'sender': 'user' if i % 2 == 0 else 'bot', 'text': f'сообщение номер {i}', 'time': '12:00'}
+            for i in range(length)
+        ]
+        for endpoint in ('/api/chat', '/api/v2/chat'):
+            chat_id = str(uuid.uuid4())
+            storage.save(chat_id, 'Гость_123', history)
+
+            def post():
+                response = client.post(endpoint, json={'message': 'реши задачу', 'chat_id': chat_id})
+                assert response.status_code == 200
+
+            summary = measure(post, repeat)
+            results.append(result(f'POST {endpoint}', {'chat_length': length}, summary))
+    return results
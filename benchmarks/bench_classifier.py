@@ -0,0 +1,39 @@
+# benchmarks/bench_classifier.py - Скорость классификатора и get_bot_response на корпусе сообщений
+
+import random
+
+import classifier
+from benchmarks.common import measure, result
+from benchmarks.corpus import make_corpus
+
+
+def run(app, quick):
+    corpus = make_corpus(2000 if quick else 20000)
+    repeat = 3 if quick else 5
+    random.seed(0)
+
+    def classify_all():
+        for message in corpus:
+            app.classify_message(message)
+
+    def respond_all():
+        for message in corpus:
+            app.get_bot_response(message, 'Гость_123')
+
+    def classify_batch():
+        classifier.classify_batch(corpus)
+
+    results = []
+    for name, func in (('classify_message', classify_all), ('classify_batch', classify_batch),
+                       ('get_bot_response', respond_all)):
+        summary = measure(func, repeat)
+        # Пересчитываем на одно сообщение
+        per_message = {
+            'runs': summary['runs'],
+            'mean_ms': summary['mean_ms'] / len(corpus),
+            'p50_ms': summary['p50_ms'] / len(corpus),
+            'p95_ms': summary['p95_ms'] / len(corpus),
+            'ops_per_sec': summary['ops_per_sec'] * len(corpus)
+        }
+        results.append(result(name, {'messages': len(corpus)}, per_message))
+    return results
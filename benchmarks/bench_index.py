@@ -0,0 +1,46 @@
+# benchmarks/bench_index.py - Время отрисовки главной при росте числа чатов
+
+import datetime
+import uuid
+
+from benchmarks.common import measure, fresh_storage, result
+
+
+def populate(storage, count):
+    """Быстро заполняет сводку чатов одной транзакцией: боковая панель
+    читает только её, а создавать тысячи настоящих чатов - долго"""
+    start = datetime.datetime(2026, 1, 1)
+    rows = [
+        (str(uuid.UUID(int=i)), f'Гость_{i % 900 + 100}',
+         (start + datetime.timedelta(seconds=i)).strftime('%Y-%m-%d %H:%M:%S'), i % 50)
+        for i in range(count)
+    ]
+    conn = storage.index.db.connect()
+    with conn:
+        conn.executemany(
+            'INSERT OR REPLACE INTO chats (chat_id, user_name, last_updated, message_count) VALUES (?, ?, ?, ?)',
+            rows
+        )
+
+
+def run(app, quick):
+    counts = [10, 100, 1000] if quick else [10, 1000, 10000, 100000]
+    repeat = 10 if quick else 30
+    client = app.app.test_client()
+    results = []
+    for count in counts:
+        storage = fresh_storage(app, f'index_{count}')
+        populate(storage, count)
+        current = str(uuid.uuid4())
+        storage.save(current, 'Гость_123', [
+            {'sender': 'user', 'text': 'привет', 'time': '12:00'},
+            {'sender': 'bot', 'text': 'Не дождёшься! 😜', 'time': '12:00'}
+        ])
+
+        def render():
+            response = client.get(f'/?chat_id={current}')
+            assert response.status_code == 200 and 'Не дождёшься' in response.get_data(as_text=True)
+
+        summary = measure(render, repeat)
+        results.append(result('GET /', {'saved_chats': count}, summary))
+    return results
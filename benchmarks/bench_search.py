@@ -0,0 +1,28 @@
+# benchmarks/bench_search.py - Дописывание в поисковый индекс и поиск по нему
+
+import random
+
+from benchmarks.common import measure, result
+from benchmarks.corpus import make_corpus
+from search_index import SearchIndex
+
+
+def run(app, quick):
+    chats = 200 if quick else 2000
+    per_chat = 100
+    corpus = make_corpus(5000)
+    rng = random.Random(0)
+    index = SearchIndex('bench_search.db')
+    for number in range(chats):
+        messages = [{'sender': 'user', 'text': rng.choice(corpus), 'time': '12:00', 'seq': seq}
+                    for seq in range(1, per_chat + 1)]
+        index.add(f'chat-{number}', f'Гость_{number}', messages)
+
+    turn = [{'sender': 'user', 'text': corpus[0], 'time': '12:00', 'seq': 1},
+            {'sender': 'bot', 'text': corpus[1], 'time': '12:00', 'seq': 2}]
+    results = [result('search_index.add', {'messages': chats * per_chat},
+                      measure(lambda: index.add('chat-new', 'Гость', turn), 50 if quick else 200))]
+    for query in ('привет', 'сделай домашку', 'Гость_7', 'Гость_7 привет'):
+        summary = measure(lambda: index.search(query, 20), 10 if quick else 50)
+        results.append(result('search', {'messages': chats * per_chat, 'q': query}, summary))
+    return results
@@ -0,0 +1,45 @@
+# benchmarks/bench_stats.py - update_stats под нагрузкой из нескольких потоков
+
+import time
+import threading
+
+from benchmarks.common import result
+
+
+def run(app, quick):
+    increments = 20000 if quick else 200000
+    results = []
+    for threads in (1, 4, 16):
+        app.stats_counters.flush()
+        before = app.get_stats()['chat_messages']
+        per_thread = increments // threads
+        barrier = threading.Barrier(threads + 1)
+
+        def worker():
+            barrier.wait()
+            for _ in range(per_thread):
+                app.update_stats('chat_messages')
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        for thread in workers:
+            thread.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        # Проверяем, что после сброса ни одно увеличение не потерялось
+        app.stats_counters.flush()
+        total = per_thread * threads
+        exact = app.get_stats()['chat_messages'] - before == total
+        summary = {
+            'runs': total,
+            'mean_ms': elapsed / total * 1000,
+            'p50_ms': elapsed / total * 1000,
+            'p95_ms': elapsed / total * 1000,
+            'ops_per_sec': total / elapsed if elapsed else 0.0,
+            'exact': exact
+        }
+        results.append(result('update_stats', {'threads': threads}, summary))
+    return results
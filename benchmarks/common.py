@@ -0,0 +1,48 @@
+# benchmarks/common.py - Общие помощники для замеров
+
+import os
+import time
+import statistics
+
+
+def measure(func, repeat, warmup=1):
+    """Вызывает func repeat раз и возвращает сводку по времени одного вызова"""
+    for _ in range(warmup):
+        func()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return summarize(timings)
+
+
+def summarize(timings):
+    timings = sorted(timings)
+    total = sum(timings)
+    return {
+        'runs': len(timings),
+        'mean_ms': total / len(timings) * 1000,
+        'p50_ms': statistics.median(timings) * 1000,
+        'p95_ms': timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000,
+        'ops_per_sec': len(timings) / total if total else 0.0
+    }
+
+
+def result(name, params, summary):
+    """Одна строка отчёта: имя замера, его параметры и цифры"""
+    return dict(summary, name=name, params=params)
+
+
+def fresh_storage(app, name):
+    """Подменяет хранилище чатов приложения пустым, в отдельной папке"""
+    from chat_storage import create_chat_storage, CachedChatStorage
+
+    folder = os.path.abspath(os.path.join('bench_storage', name))
+    os.makedirs(folder, exist_ok=True)
+    storage = create_chat_storage(app.CHAT_STORAGE, folder, os.path.join(folder, 'chats.db'),
+                                  app.CHATS_FSYNC_INTERVAL)
+    if app.CHAT_CACHE_SIZE:
+        storage = CachedChatStorage(storage, app.CHAT_CACHE_SIZE, app.CHAT_CACHE_BYTES)
+    app.chat_storage = storage
+    return storage
@@ -0,0 +1,40 @@
+# benchmarks/corpus.py - Набор сообщений, похожих на живой трафик
+
+import random
+
+# Реплики, которые пользователи чаще всего пишут боту
+PHRASES = [
+    'привет', 'привет, как дела?', 'здарова', 'hello there', 'хай',
+    'пока', 'до встречи', 'bye',
+    'реши задачу по математике', 'напиши сочинение про лето', 'сделай домашку',
+    'посчитай 2+2', 'расскажи анекдот', 'придумай стих', 'please write an essay',
+    'напиши код на python', 'сделай программу для калькулятора', 'write a function in js',
+    'который час?', 'сколько времени', 'what time is it',
+    'какое сегодня число', 'какой день недели', 'what is the date today',
+    'что нового в мире?', 'какие новости', 'news please',
+    'какой год сейчас', 'ты бот?', 'ты искусственный интеллект?',
+    'ну пожалуйста, реши', 'умоляю, напиши код',
+    'что', 'чё?', 'нет', 'почему', 'как?', 'зачем',
+    'ты дурак', 'тупой бот',
+    'мне сегодня скучно', 'я купил новый велосипед', 'погода отличная',
+    'i just wanted to say hi', 'lorem ipsum dolor sit amet',
+]
+
+# Слова-наполнители для длинных сообщений
+FILLER = [
+    'вообще', 'кстати', 'слушай', 'короче', 'просто', 'очень', 'сегодня', 'вчера',
+    'really', 'just', 'maybe', 'actually', 'the', 'and', 'потом', 'опять',
+]
+
+
+def make_corpus(size, seed=42):
+    """size сообщений разной длины: от одной реплики до длинного абзаца"""
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(size):
+        words = [rng.choice(PHRASES)]
+        for _ in range(rng.choice([0, 0, 0, 3, 10, 40])):
+            words.append(rng.choice(FILLER))
+        rng.shuffle(words)
+        corpus.append(' '.join(words))
+    return corpus
@@ -0,0 +1,1551 @@
+# chat_storage.py - Хранилища чатов Пэрры (JSON-файлы или SQLite)
+
+import os
+import re
+import gzip
+import json
+import sqlite3
+import time
+import datetime
+import threading
+from array import array
+from collections import OrderedDict, deque
+
+import metrics
+
+
+def now_timestamp():
+    """Текущее время в формате поля last_updated"""
+    return datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def timestamp_ago(seconds):
+    """Момент seconds секунд назад в формате last_updated (строки сравнимы)"""
+    moment = datetime.datetime.now() - datetime.timedelta(seconds=seconds)
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+
+class SqliteDatabase:
+    """Файл SQLite в режиме WAL со своим соединением на каждый поток"""
+
+    def __init__(self, path, schema):
+        self.path = path
+        self.is_new = not os.path.exists(path)
+        self._local = threading.local()
+        with self.connect() as conn:
+            conn.executescript(schema)
+
+    def connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+
+CHAT_INDEX_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS chats (
+    chat_id TEXT PRIMARY KEY,
+    user_name TEXT NOT NULL,
+    last_updated TEXT NOT NULL,
+    message_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_chats_last_updated ON chats (last_updated, chat_id);
+CREATE TABLE IF NOT EXISTS cold_chats (
+    chat_id TEXT PRIMARY KEY
+);
+'''
+
+
+def encode_cursor(chat):
+    """Курсор страницы - позиция последнего показанного чата"""
+    return f"{chat['last_updated']}|{chat['id']}"
+
+
+def decode_cursor(cursor):
+    last_updated, _, chat_id = cursor.partition('|')
+    return last_updated, chat_id
+
+
+class ChatIndex:
+    """Сводка по чатам (таблица chats), отсортированная по свежести"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def update(self, chat_id, user_name, last_updated, message_count, conn=None):
+        if conn is None:
+            conn = self.db.connect()
+            with conn:
+                return self.update(chat_id, user_name, last_updated, message_count, conn)
+        conn.execute(
+            '''INSERT OR REPLACE INTO chats (chat_id, user_name, last_updated, message_count)
+               VALUES (?, ?, ?, ?)''',
+            (chat_id, user_name, last_updated, message_count)
+        )
+
+    def bump(self, chat_id, user_name, last_updated, added, conn=None):
+        """Увеличивает счётчик сообщений чата (создаёт запись, если её нет).
+        Возвращает новое число сообщений"""
+        if conn is None:
+            conn = self.db.connect()
+            with conn:
+                return self.bump(chat_id, user_name, last_updated, added, conn)
+        return conn.execute(
+            '''INSERT INTO chats (chat_id, user_name, last_updated, message_count)
+               VALUES (?, ?, ?, ?)
+               ON CONFLICT (chat_id) DO UPDATE SET
+                   user_name = excluded.user_name,
+                   last_updated = excluded.last_updated,
+                   message_count = chats.message_count + excluded.message_count
+               RETURNING message_count''',
+            (chat_id, user_name, last_updated, added)
+        ).fetchone()[0]
+
+    def get(self, chat_id):
+        """Сводка одного чата или None"""
+        row = self.db.connect().execute(
+            'SELECT chat_id, user_name, last_updated, message_count FROM chats WHERE chat_id = ?',
+            (chat_id,)
+        ).fetchone()
+        return self._summary(row) if row else None
+
+    def touch(self, chat_id, last_updated):
+        conn = self.db.connect()
+        with conn:
+            conn.execute('UPDATE chats SET last_updated = ? WHERE chat_id = ?', (last_updated, chat_id))
+
+    def list(self, limit=None, cursor=None):
+        """Страница непустых чатов после курсора. Возвращает (чаты, следующий курсор)"""
+        query = 'SELECT chat_id, user_name, last_updated, message_count FROM chats WHERE message_count > 0'
+        params = []
+        if cursor:
+            query += ' AND (last_updated, chat_id) < (?, ?)'
+            params.extend(decode_cursor(cursor))
+        query += ' ORDER BY last_updated DESC, chat_id DESC'
+        if limit:
+            # Берём на одну запись больше, чтобы понять, есть ли следующая страница
+            query += ' LIMIT ?'
+            params.append(limit + 1)
+        chats = [self._summary(row) for row in self.db.connect().execute(query, params)]
+        next_cursor = None
+        if limit and len(chats) > limit:
+            chats = chats[:limit]
+            next_cursor = encode_cursor(chats[-1])
+        return chats, next_cursor
+
+    # Мусор: пустой чат старше empty_before или любой чат без записей с idle_before
+    STALE_CONDITION = '((message_count = 0 AND last_updated < ?) OR last_updated < ?)'
+
+    def stale(self, empty_before, idle_before, limit):
+        """ID чатов-мусора, не больше limit. None - условие выключено"""
+        return [row[0] for row in self.db.connect().execute(
+            f'SELECT chat_id FROM chats WHERE {self.STALE_CONDITION} LIMIT ?',
+            (empty_before or '', idle_before or '', limit)
+        )]
+
+    def remove_if_stale(self, chat_id, empty_before, idle_before, conn=None):
+        """Удаляет запись чата, если он всё ещё мусор. Возвращает True, если удалил"""
+        if conn is None:
+            conn = self.db.connect()
+            with conn:
+                return self.remove_if_stale(chat_id, empty_before, idle_before, conn)
+        cursor = conn.execute(
+            f'DELETE FROM chats WHERE chat_id = ? AND {self.STALE_CONDITION}',
+            (chat_id, empty_before or '', idle_before or '')
+        )
+        if cursor.rowcount == 0:
+            return False
+        conn.execute('DELETE FROM cold_chats WHERE chat_id = ?', (chat_id,))
+        return True
+
+    def freeze_candidates(self, before, limit):
+        """ID непустых чатов без записей с before, ещё не лежащих в холодном слое"""
+        return [row[0] for row in self.db.connect().execute(
+            '''SELECT chat_id FROM chats
+               WHERE last_updated < ? AND message_count > 0
+                 AND chat_id NOT IN (SELECT chat_id FROM cold_chats)
+               LIMIT ?''',
+            (before, limit)
+        )]
+
+    def set_cold(self, chat_id, cold):
+        conn = self.db.connect()
+        with conn:
+            if cold:
+                conn.execute('INSERT OR IGNORE INTO cold_chats (chat_id) VALUES (?)', (chat_id,))
+            else:
+                conn.execute('DELETE FROM cold_chats WHERE chat_id = ?', (chat_id,))
+
+    @staticmethod
+    def _summary(row):
+        return {
+            'id': row['chat_id'],
+            'user_name': row['user_name'],
+            'last_updated': row['last_updated'],
+            'message_count': row['message_count']
+        }
+
+
+def assign_batch_seqs(batch, last_seq):
+    """Раздаёт дозаписям пачки номера их последних сообщений"""
+    for entry in reversed(batch):
+        entry.last_seq = last_seq
+        last_seq -= len(entry.messages)
+
+
+def number_messages(messages, first_seq):
+    """Копии сообщений с порядковыми номерами (seq начинается с 1)"""
+    return [dict(message, seq=seq) for seq, message in enumerate(messages, first_seq)]
+
+
+def slice_before(messages, before, limit):
+    """Хвост списка сообщений перед номером before, с полями seq"""
+    end = len(messages) if before is None else max(0, min(before - 1, len(messages)))
+    start = max(0, end - limit)
+    return number_messages(messages[start:end], start + 1)
+
+
+def write_temp(path, data):
+    """Пишет байты во временный файл рядом с path, возвращает его путь"""
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    return tmp_path
+
+
+# Формат файла чата, версия 2: колонки вместо списка сообщений и без отступов.
+#   {"v": 2, "chat_id": ..., "user_name": ..., "last_updated": ...,
+#    "senders": ["user", "bot"], "sender": [0, 1, ...], "text": [...], "time": [...]}
+# Версия 1 (без "v") - {"chat_id", "user_name", "messages": [{"sender", "text", "time"}],
+# "last_updated"} с indent=2; она по-прежнему читается.
+CHAT_FORMAT_VERSION = 2
+
+
+def encode_chat(chat_data):
+    """Чат в компактном формате версии 2"""
+    messages = chat_data['messages']
+    senders = []
+    codes = {}
+    sender_column = []
+    for message in messages:
+        sender = message['sender']
+        code = codes.get(sender)
+        if code is None:
+            code = codes[sender] = len(senders)
+            senders.append(sender)
+        sender_column.append(code)
+    return json.dumps({
+        'v': CHAT_FORMAT_VERSION,
+        'chat_id': chat_data['chat_id'],
+        'user_name': chat_data['user_name'],
+        'last_updated': chat_data['last_updated'],
+        'senders': senders,
+        'sender': sender_column,
+        'text': [message['text'] for message in messages],
+        'time': [message['time'] for message in messages]
+    }, ensure_ascii=False, separators=(',', ':'))
+
+
+def decode_chat(text):
+    """Чат из файла любой версии"""
+    data = json.loads(text)
+    if 'v' not in data:
+        return data
+    if data['v'] != CHAT_FORMAT_VERSION:
+        raise ValueError(f"Неизвестная версия формата чата: {data['v']}")
+    senders = data['senders']
+    return {
+        'chat_id': data['chat_id'],
+        'user_name': data['user_name'],
+        'messages': [{'sender': senders[code], 'text': text, 'time': time}
+                     for code, text, time in zip(data['sender'], data['text'], data['time'])],
+        'last_updated': data['last_updated']
+    }
+
+
+def atomic_write_bytes(path, data):
+    """Пишет файл целиком через временный файл и rename - читатели никогда
+    не увидят наполовину записанный файл. Возвращает число записанных байт"""
+    os.replace(write_temp(path, data), path)
+    return len(data)
+
+
+def atomic_write_text(path, text):
+    return atomic_write_bytes(path, text.encode('utf-8'))
+
+
+def create_file_once(path, data):
+    """Атомарно создаёт файл, только если его ещё нет (link не перезаписывает).
+    Возвращает False, если файл уже был"""
+    tmp_path = write_temp(path, data)
+    try:
+        os.link(tmp_path, path)
+        return True
+    except FileExistsError:
+        return False
+    finally:
+        os.remove(tmp_path)
+
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+# ID чата в файловых хранилищах: без точек и разделителей пути
+CHAT_FILE_ID_RE = re.compile(r'[0-9A-Za-z_-]+')
+
+
+def shard_dir(folder, chat_id):
+    """Папка чата saved_chats/ab/cd - по первым символам uuid, чтобы в одной
+    папке не копились сотни тысяч файлов"""
+    if not CHAT_FILE_ID_RE.fullmatch(chat_id):
+        # Из такого ID вышел бы путь за пределами папки чатов
+        raise ValueError(f'недопустимый ID чата: {chat_id!r}')
+    return os.path.join(folder, chat_id[:2], chat_id[2:4])
+
+
+def chat_id_from_filename(filename):
+    return filename.split('.', 1)[0]
+
+
+def iter_chat_files(folder, suffixes):
+    """Пути всех файлов чатов с окончаниями suffixes - и в шардах, и в корне"""
+    for root, _, files in os.walk(folder):
+        for filename in files:
+            if filename.endswith(suffixes):
+                yield os.path.join(root, filename)
+
+
+def shard_flat_files(folder, suffixes):
+    """Разносит файлы чатов из корня folder (старая плоская раскладка) по
+    папкам шардов. Безопасно повторять и запускать из нескольких процессов.
+    Возвращает число перенесённых файлов"""
+    with os.scandir(folder) as entries:
+        names = [entry.name for entry in entries if entry.is_file() and entry.name.endswith(suffixes)]
+    moved = 0
+    for filename in names:
+        source = os.path.join(folder, filename)
+        target_dir = shard_dir(folder, chat_id_from_filename(filename))
+        os.makedirs(target_dir, exist_ok=True)
+        try:
+            # link не перезаписывает: если в шарде уже есть файл, он новее
+            os.link(source, os.path.join(target_dir, filename))
+        except FileExistsError:
+            print(f"⚠️ {filename} уже есть в {target_dir}, старый файл оставлен в корне")
+            continue
+        except FileNotFoundError:
+            continue    # перенёс другой процесс
+        remove_file(source)
+        moved += 1
+    return moved
+
+
+def file_stamp(path):
+    """Метка версии файла; rename при атомарной записи меняет inode"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+class StripedLocks:
+    """Таблица блокировок: чат попадает на одну из stripes блокировок по хэшу.
+    Разные чаты почти никогда не ждут друг друга, а таблица не растёт"""
+
+    def __init__(self, stripes=64):
+        self._locks = [threading.RLock() for _ in range(stripes)]
+
+    def lock_for(self, chat_id):
+        return self._locks[hash(chat_id) % len(self._locks)]
+
+
+class PendingAppend:
+    """Сообщения, ждущие записи в чат"""
+    __slots__ = ('user_name', 'messages', 'last_seq', 'stamps', 'error', 'done')
+
+    def __init__(self, user_name, messages):
+        self.user_name = user_name
+        self.messages = messages
+        self.last_seq = None
+        self.stamps = (None, None)
+        self.error = None
+        self.done = False
+
+
+class ChatStorage:
+    """Общий интерфейс хранилища чатов.
+
+    Запись в один чат идёт под его блокировкой из StripedLocks. Дозаписи,
+    которые пришли, пока чат занят, копятся в очереди и уходят на диск одной
+    записью у того, кто первым получит блокировку.
+    """
+
+    def __init__(self):
+        self._chat_locks = StripedLocks()
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+
+    def chat_lock(self, chat_id):
+        return self._chat_locks.lock_for(chat_id)
+
+    def load(self, chat_id):
+        """Возвращает чат целиком или None"""
+        raise NotImplementedError
+
+    def save(self, chat_id, user_name, messages):
+        """Сохраняет чат целиком"""
+        raise NotImplementedError
+
+    def append(self, chat_id, user_name, new_messages):
+        """Дописывает сообщения в конец чата (создаёт чат, если его нет).
+        Возвращает номер (seq) последнего сообщения"""
+        return self.append_versioned(chat_id, user_name, new_messages)[0]
+
+    def append_versioned(self, chat_id, user_name, new_messages):
+        """Как append, но возвращает (seq, метка версии до записи, метка после).
+        Метки сняты там же, где запись, - между ними чужих записей нет.
+        Метка до записи None, если её нельзя было снять вместе с записью"""
+        entry = PendingAppend(user_name, list(new_messages))
+        with self._pending_lock:
+            self._pending.setdefault(chat_id, []).append(entry)
+        with self.chat_lock(chat_id):
+            if not entry.done:
+                # Забираем всё, что накопилось для этого чата, включая чужие дозаписи
+                with self._pending_lock:
+                    batch = self._pending.pop(chat_id)
+                try:
+                    stamps = self._append_batch(chat_id, batch)
+                    for pending in batch:
+                        pending.stamps = stamps
+                except Exception as e:
+                    for pending in batch:
+                        pending.error = e
+                    raise
+                finally:
+                    for pending in batch:
+                        pending.done = True
+        if entry.error is not None:
+            raise entry.error
+        return (entry.last_seq,) + entry.stamps
+
+    def _append_batch(self, chat_id, batch):
+        """Пишет пачку дозаписей одной операцией и проставляет каждой last_seq.
+        Вызывается под блокировкой чата. Возвращает метки версии чата до и
+        после записи, снятые под той же блокировкой для всех процессов"""
+        raise NotImplementedError
+
+    def messages_after(self, chat_id, after=0, limit=None):
+        """Сообщения с номерами больше after, у каждого есть поле seq"""
+        chat_data = self.load(chat_id)
+        if not chat_data:
+            return []
+        end = after + limit if limit else None
+        return number_messages(chat_data['messages'][after:end], after + 1)
+
+    def messages_before(self, chat_id, before=None, limit=50):
+        """Последние limit сообщений с номерами меньше before (None - конец чата)"""
+        chat_data = self.load(chat_id)
+        if not chat_data:
+            return []
+        return slice_before(chat_data['messages'], before, limit)
+
+    def touch(self, chat_id):
+        """Обновляет last_updated. Возвращает False, если чата нет"""
+        raise NotImplementedError
+
+    def version_stamp(self, chat_id):
+        """Дешёвая метка версии чата: меняется при любой записи, в том числе
+        из другого процесса. None - чата нет"""
+        raise NotImplementedError
+
+    def chat_summary(self, chat_id):
+        """Сводка чата из индекса (без чтения сообщений) или None"""
+        return self.index.get(chat_id)
+
+    def list_chats(self, limit=None, cursor=None):
+        """Страница сводок непустых чатов (id, user_name, last_updated,
+        message_count), сначала новые. Возвращает (чаты, курсор следующей страницы)"""
+        raise NotImplementedError
+
+    def collect_garbage(self, empty_ttl=None, idle_ttl=None, limit=1000, on_remove=None):
+        """Удаляет пустые чаты старше empty_ttl секунд и чаты, в которые
+        не писали дольше idle_ttl секунд (None или 0 - не удалять).
+        За раз - не больше limit чатов; on_remove(chat_id) вызывается для
+        каждого удалённого. Возвращает число удалённых"""
+        empty_before = timestamp_ago(empty_ttl) if empty_ttl else None
+        idle_before = timestamp_ago(idle_ttl) if idle_ttl else None
+        if not empty_before and not idle_before:
+            return 0
+        removed = 0
+        for chat_id in self.index.stale(empty_before, idle_before, limit):
+            # Под блокировкой ещё раз проверяем: в чат могли успеть написать
+            with self.chat_lock(chat_id):
+                if self._remove_if_stale(chat_id, empty_before, idle_before):
+                    removed += 1
+                    if on_remove:
+                        on_remove(chat_id)
+        return removed
+
+    def _remove_if_stale(self, chat_id, empty_before, idle_before):
+        """Удаляет чат, если он всё ещё мусор. Вызывается под блокировкой чата"""
+        raise NotImplementedError
+
+    def freeze_idle(self, idle_ttl, limit=1000):
+        """Переносит чаты без записей дольше idle_ttl секунд в холодный слой.
+        Возвращает число перенесённых. Без холодного слоя ничего не делает"""
+        return 0
+
+
+class FileChatStorage(ChatStorage):
+    """Общее для хранилищ «файл на чат»: папки шардов, индекс и холодный слой.
+
+    Файл чата лежит в saved_chats/ab/cd/<uuid><suffix>. Чат, в который не
+    писали дольше заданного срока, сжимается gzip в соседний <файл>.gz и
+    при первом обращении тихо возвращается обратно. Холодные чаты
+    перечислены в таблице cold_chats индекса.
+    """
+
+    suffix = None           # окончание файла чата
+    file_suffixes = ()      # окончания всех файлов хранилища
+    index_schema = CHAT_INDEX_SCHEMA
+
+    def __init__(self, folder):
+        super().__init__()
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+        db = SqliteDatabase(os.path.join(folder, 'index.db'), self.index_schema)
+        self.index = ChatIndex(db)
+        # Файлы из старой плоской раскладки переезжают в шарды
+        shard_flat_files(folder, self.file_suffixes)
+        if db.is_new:
+            self.rebuild_index()
+
+    def _path(self, chat_id):
+        return os.path.join(shard_dir(self.folder, chat_id), chat_id + self.suffix)
+
+    def _transaction(self):
+        """Соединение индекса для with: BEGIN IMMEDIATE сразу берёт блокировку
+        записи. Это и блокировка файлов чатов для всех процессов: чтение и
+        запись файла внутри транзакции не пересекаются с чужими"""
+        conn = self.index.db.connect()
+        conn.execute('BEGIN IMMEDIATE')
+        return conn
+
+    def _cold_path(self, chat_id):
+        return self._path(chat_id) + '.gz'
+
+    def _chat_files(self, chat_id):
+        return [self._path(chat_id), self._cold_path(chat_id)]
+
+    def _load_file(self, chat_id):
+        """Чат из обычного файла или None"""
+        raise NotImplementedError
+
+    def _parse(self, chat_id, text):
+        """Чат из содержимого файла (для холодного слоя)"""
+        raise NotImplementedError
+
+    def _forget(self, chat_id):
+        """Файл чата удалён или сжат - сбросить то, что о нём помнится в памяти"""
+
+    def load(self, chat_id):
+        self._thaw(chat_id)
+        return self._load_file(chat_id)
+
+    def _peek(self, chat_id):
+        """Чат без возврата из холодного слоя"""
+        chat_data = self._load_file(chat_id)
+        if chat_data is None and os.path.exists(self._cold_path(chat_id)):
+            with open(self._cold_path(chat_id), 'rb') as f:
+                chat_data = self._parse(chat_id, gzip.decompress(f.read()).decode('utf-8'))
+        return chat_data
+
+    def rebuild_index(self):
+        """Полный проход по папкам - только когда индекса ещё нет"""
+        seen = set()
+        for path in iter_chat_files(self.folder, self.file_suffixes):
+            chat_id = chat_id_from_filename(os.path.basename(path))
+            if chat_id in seen:
+                continue
+            seen.add(chat_id)
+            chat_data = self._peek(chat_id)
+            if chat_data is None:
+                continue
+            self.index.update(chat_id, chat_data['user_name'],
+                              chat_data['last_updated'], len(chat_data['messages']))
+            if not os.path.exists(self._path(chat_id)) and os.path.exists(self._cold_path(chat_id)):
+                self.index.set_cold(chat_id, True)
+
+    def _thaw(self, chat_id):
+        """Возвращает чат из холодного слоя, если он там. Обычный случай -
+        файл на месте - стоит одного stat"""
+        path = self._path(chat_id)
+        if os.path.exists(path):
+            return
+        cold = self._cold_path(chat_id)
+        if not os.path.exists(cold):
+            return
+        with self.chat_lock(chat_id):
+            try:
+                with open(cold, 'rb') as f:
+                    packed = f.read()
+            except FileNotFoundError:
+                return      # вернул другой процесс
+            metrics.count_io('saved_chats', 'read', len(packed))
+            data = gzip.decompress(packed)
+            # Файл мог уже появиться (вернул другой процесс) - тогда он главнее
+            if create_file_once(path, data):
+                metrics.count_io('saved_chats', 'write', len(data))
+            remove_file(cold)
+            self.index.set_cold(chat_id, False)
+
+    def freeze_idle(self, idle_ttl, limit=1000):
+        if not idle_ttl:
+            return 0
+        frozen = 0
+        for chat_id in self.index.freeze_candidates(timestamp_ago(idle_ttl), limit):
+            with self.chat_lock(chat_id):
+                if self._freeze(chat_id):
+                    frozen += 1
+        return frozen
+
+    def _freeze(self, chat_id):
+        path = self._path(chat_id)
+        cold = self._cold_path(chat_id)
+        stamp = file_stamp(path)
+        if stamp is None:
+            if os.path.exists(cold):
+                self.index.set_cold(chat_id, True)
+            return False
+        with open(path, 'rb') as f:
+            data = f.read()
+        metrics.count_io('saved_chats', 'read', len(data))
+        written = atomic_write_bytes(cold, gzip.compress(data, mtime=0))
+        metrics.count_io('saved_chats', 'write', written)
+        if file_stamp(path) != stamp:
+            # Пока сжимали, в чат написал другой процесс - чат остаётся горячим
+            remove_file(cold)
+            return False
+        remove_file(path)
+        self._forget(chat_id)
+        self.index.set_cold(chat_id, True)
+        return True
+
+    def list_chats(self, limit=None, cursor=None):
+        return self.index.list(limit, cursor)
+
+    def _remove_if_stale(self, chat_id, empty_before, idle_before):
+        if not self.index.remove_if_stale(chat_id, empty_before, idle_before):
+            return False
+        for path in self._chat_files(chat_id):
+            remove_file(path)
+        self._forget(chat_id)
+        return True
+
+
+class JsonChatStorage(FileChatStorage):
+    """Каждый чат - отдельный файл saved_chats/ab/cd/<uuid>.json"""
+
+    suffix = '.json'
+    file_suffixes = ('.json', '.json.gz')
+
+    def _write(self, conn, chat_data):
+        """Вызывается под блокировкой чата в транзакции индекса"""
+        path = self._path(chat_data['chat_id'])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        written = atomic_write_text(path, encode_chat(chat_data))
+        metrics.count_io('saved_chats', 'write', written)
+        self.index.update(chat_data['chat_id'], chat_data['user_name'],
+                          chat_data['last_updated'], len(chat_data['messages']), conn)
+
+    def _load_file(self, chat_id):
+        filename = self._path(chat_id)
+        if os.path.exists(filename):
+            with open(filename, 'r', encoding='utf-8') as f:
+                metrics.count_io('saved_chats', 'read', os.fstat(f.fileno()).st_size)
+                return decode_chat(f.read())
+        return None
+
+    def _parse(self, chat_id, text):
+        return decode_chat(text)
+
+    def save(self, chat_id, user_name, messages):
+        with self.chat_lock(chat_id):
+            # Иначе старая сжатая копия вернулась бы поверх новой
+            self._thaw(chat_id)
+            with self._transaction() as conn:
+                self._write(conn, {
+                    'chat_id': chat_id,
+                    'user_name': user_name,
+                    'messages': messages,
+                    'last_updated': now_timestamp()
+                })
+
+    def _append_batch(self, chat_id, batch):
+        self._thaw(chat_id)
+        # Чтение и перезапись файла - в одной транзакции, иначе дозапись
+        # другого процесса между ними потерялась бы
+        with self._transaction() as conn:
+            before = self.version_stamp(chat_id)
+            chat_data = self._load_file(chat_id)
+            messages = chat_data['messages'] if chat_data else []
+            for entry in batch:
+                messages.extend(entry.messages)
+            self._write(conn, {
+                'chat_id': chat_id,
+                'user_name': batch[-1].user_name,
+                'messages': messages,
+                'last_updated': now_timestamp()
+            })
+            after = self.version_stamp(chat_id)
+        assign_batch_seqs(batch, len(messages))
+        return before, after
+
+    def touch(self, chat_id):
+        with self.chat_lock(chat_id):
+            self._thaw(chat_id)
+            with self._transaction() as conn:
+                chat_data = self._load_file(chat_id)
+                if not chat_data:
+                    return False
+                chat_data['last_updated'] = now_timestamp()
+                self._write(conn, chat_data)
+        return True
+
+    def version_stamp(self, chat_id):
+        return file_stamp(self._path(chat_id))
+
+
+# Размер журнала, до которого досчитан message_count в chats: пишутся в одной
+# транзакции индекса, поэтому расхождение значит, что журнал менялся мимо неё
+JOURNAL_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS journals (
+    chat_id TEXT PRIMARY KEY,
+    size INTEGER NOT NULL
+);
+'''
+
+
+class JsonlChatStorage(FileChatStorage):
+    """Каждый чат - журнал saved_chats/ab/cd/<uuid>.jsonl, в который только дописывают.
+
+    Первая строка - заголовок {"meta": {...}} с chat_id, user_name и
+    last_updated. Дальше идут сообщения {"sender", "text", "time"} и редкие
+    записи {"meta": {...}} от touch - последняя из них главная. Дозапись
+    сообщений meta не пишет: свежие user_name и last_updated лежат в индексе,
+    файл - запасной источник, когда индекса нет. Сжатие переписывает журнал,
+    сворачивая все meta в заголовок, раз в compact_every таких записей.
+
+    Любое изменение журнала идёт в транзакции индекса BEGIN IMMEDIATE - это
+    блокировка журнала для всех процессов. Поэтому номер сообщения из индекса
+    всегда совпадает с его местом в файле.
+    """
+
+    suffix = '.jsonl'
+    # Старые чаты в .json переводятся в журнал при первой записи
+    file_suffixes = ('.jsonl', '.json', '.jsonl.gz')
+    index_schema = CHAT_INDEX_SCHEMA + JOURNAL_SCHEMA
+
+    def __init__(self, folder, fsync_interval=1.0, compact_every=64):
+        self.compact_every = compact_every
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        self._meta_counts = {}
+        self._dirty = set()
+        super().__init__(folder)
+        if fsync_interval:
+            # fsync пачкой раз в fsync_interval секунд вместо fsync на каждую запись
+            threading.Thread(target=self._fsync_loop, name='jsonl-fsync', daemon=True).start()
+
+    def _legacy_path(self, chat_id):
+        return os.path.join(shard_dir(self.folder, chat_id), f'{chat_id}.json')
+
+    def _chat_files(self, chat_id):
+        return super()._chat_files(chat_id) + [self._legacy_path(chat_id)]
+
+    def _forget(self, chat_id):
+        with self._lock:
+            self._meta_counts.pop(chat_id, None)
+            self._dirty.discard(self._path(chat_id))
+
+    @staticmethod
+    def _record(data):
+        return json.dumps(data, ensure_ascii=False) + '\n'
+
+    def _write_records(self, conn, chat_id, header, records):
+        """Один вызов write на запись; заголовок пишется только при создании файла.
+        Вызывается под блокировкой чата в транзакции индекса"""
+        path = self._path(chat_id)
+        flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT
+        try:
+            try:
+                fd = os.open(path, flags | os.O_EXCL, 0o644)
+            except FileNotFoundError:
+                # Первый чат в этой папке шарда
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                fd = os.open(path, flags | os.O_EXCL, 0o644)
+            payload = self._record({'meta': header}) + ''.join(records)
+        except FileExistsError:
+            fd = os.open(path, flags)
+            payload = ''.join(records)
+        data = payload.encode('utf-8')
+        try:
+            size = os.fstat(fd).st_size
+            self._check_count(conn, chat_id, size)
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+        self._set_size(conn, chat_id, size + len(data))
+        metrics.count_io('saved_chats', 'write', len(data))
+        if self.fsync_interval == 0:
+            self._fsync_path(path)
+        if self.fsync_interval:
+            with self._lock:
+                self._dirty.add(path)
+
+    @staticmethod
+    def _set_size(conn, chat_id, size):
+        conn.execute('INSERT OR REPLACE INTO journals (chat_id, size) VALUES (?, ?)', (chat_id, size))
+
+    def _check_count(self, conn, chat_id, size):
+        """Сверяет message_count с журналом размером size. Если журнал менялся
+        мимо индекса (процесс упал между записью и фиксацией, индекс собран
+        заново), сообщения пересчитываются по файлу"""
+        row = conn.execute(
+            '''SELECT chats.message_count, journals.size FROM chats
+               LEFT JOIN journals ON journals.chat_id = chats.chat_id
+               WHERE chats.chat_id = ?''', (chat_id,)
+        ).fetchone()
+        if row is not None and row[1] == size:
+            return
+        chat_data = self._fold(chat_id, self._read_lines(chat_id) if size else ())
+        if row is not None:
+            conn.execute('UPDATE chats SET message_count = ? WHERE chat_id = ?',
+                         (len(chat_data['messages']), chat_id))
+        elif chat_data['messages']:
+            self.index.update(chat_id, chat_data['user_name'], chat_data['last_updated'],
+                              len(chat_data['messages']), conn)
+
+    def _fsync_loop(self):
+        while True:
+            time.sleep(self.fsync_interval)
+            self.sync()
+
+    def sync(self):
+        """Сбрасывает на диск все журналы, изменённые с прошлого раза"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        for path in dirty:
+            self._fsync_path(path)
+
+    @staticmethod
+    def _fsync_path(path):
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            return
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _read_lines(self, chat_id):
+        """Построчно читает журнал, как есть"""
+        with open(self._path(chat_id), 'r', encoding='utf-8') as f:
+            metrics.count_io('saved_chats', 'read', os.fstat(f.fileno()).st_size)
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def iter_messages(self, chat_id):
+        """Потоково отдаёт сообщения чата, не собирая весь журнал в память"""
+        for record in self._read_lines(chat_id):
+            if 'meta' not in record:
+                yield record
+
+    def tail(self, chat_id, limit, size=None):
+        """Последние limit сообщений: журнал читается с конца блоками.
+        size - ожидаемый размер журнала; если он другой, возвращает None"""
+        path = self._path(chat_id)
+        if not os.path.exists(path):
+            return []
+        lines = []
+        with open(path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            position = f.tell()
+            if size is not None and position != size:
+                return None
+            remainder = b''
+            while position > 0 and len(lines) < limit:
+                step = min(8192, position)
+                position -= step
+                f.seek(position)
+                chunk = f.read(step) + remainder
+                metrics.count_io('saved_chats', 'read', step)
+                parts = chunk.split(b'\n')
+                remainder = parts.pop(0)
+                for part in reversed(parts):
+                    if part.strip():
+                        record = json.loads(part)
+                        if 'meta' not in record:
+                            lines.append(record)
+            if position == 0 and remainder.strip() and len(lines) < limit:
+                record = json.loads(remainder)
+                if 'meta' not in record:
+                    lines.append(record)
+        return lines[:limit][::-1]
+
+    def _load_file(self, chat_id):
+        if not os.path.exists(self._path(chat_id)):
+            return self._load_legacy(chat_id)
+        chat_data = self._fold(chat_id, self._read_lines(chat_id))
+        summary = self.index.get(chat_id)
+        if summary:
+            # Дозаписи обновляют метаданные только в индексе
+            chat_data['user_name'] = summary['user_name']
+            chat_data['last_updated'] = summary['last_updated']
+        return chat_data
+
+    def _parse(self, chat_id, text):
+        return self._fold(chat_id, (json.loads(line) for line in text.splitlines() if line.strip()))
+
+    @staticmethod
+    def _fold(chat_id, records):
+        """Собирает чат из записей журнала: meta сворачиваются, сообщения - по порядку"""
+        meta = {}
+        messages = []
+        for record in records:
+            if 'meta' in record:
+                meta.update(record['meta'])
+            else:
+                messages.append(record)
+        return {
+            'chat_id': chat_id,
+            'user_name': meta.get('user_name'),
+            'messages': messages,
+            'last_updated': meta.get('last_updated')
+        }
+
+    def _load_legacy(self, chat_id):
+        """Чаты, сохранённые до перехода на журналы"""
+        filename = self._legacy_path(chat_id)
+        if os.path.exists(filename):
+            with open(filename, 'r', encoding='utf-8') as f:
+                metrics.count_io('saved_chats', 'read', os.fstat(f.fileno()).st_size)
+                return decode_chat(f.read())
+        return None
+
+    def _compact(self, conn, chat_id, meta, messages):
+        """Переписывает журнал: один заголовок со свёрнутыми meta и сообщения.
+        Вызывается под блокировкой чата в транзакции индекса"""
+        header = {'chat_id': chat_id, 'user_name': meta.get('user_name'),
+                  'last_updated': meta.get('last_updated')}
+        text = self._record({'meta': header}) + ''.join(self._record(m) for m in messages)
+        path = self._path(chat_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        written = atomic_write_text(path, text)
+        self._set_size(conn, chat_id, written)
+        metrics.count_io('saved_chats', 'write', written)
+        with self._lock:
+            self._meta_counts[chat_id] = 0
+
+    def _note_meta(self, chat_id):
+        """Считает meta-записи touch и изредка запускает сжатие журнала"""
+        with self._lock:
+            count = self._meta_counts.get(chat_id, 0) + 1
+            self._meta_counts[chat_id] = count
+        if count >= self.compact_every:
+            self.compact(chat_id)
+
+    def _freeze(self, chat_id):
+        if not os.path.exists(self._path(chat_id)):
+            legacy = self._load_legacy(chat_id)
+            if legacy:
+                # Старый .json сначала переводим в журнал, не трогая last_updated
+                with self._transaction() as conn:
+                    self._compact(conn, chat_id, legacy, legacy['messages'])
+                remove_file(self._legacy_path(chat_id))
+        return super()._freeze(chat_id)
+
+    def compact(self, chat_id):
+        with self.chat_lock(chat_id):
+            self._thaw(chat_id)
+            # Журнал читается и переписывается в одной транзакции - дозапись
+            # другого процесса не потеряется между чтением и rename
+            with self._transaction() as conn:
+                chat_data = self._load_file(chat_id)
+                if chat_data:
+                    self._compact(conn, chat_id, chat_data, chat_data['messages'])
+
+    def save(self, chat_id, user_name, messages):
+        last_updated = now_timestamp()
+        with self.chat_lock(chat_id):
+            self._thaw(chat_id)
+            with self._transaction() as conn:
+                self._compact(conn, chat_id, {'user_name': user_name, 'last_updated': last_updated},
+                              messages)
+                self.index.update(chat_id, user_name, last_updated, len(messages), conn)
+            legacy = self._legacy_path(chat_id)
+            if os.path.exists(legacy):
+                os.remove(legacy)
+
+    def _append_batch(self, chat_id, batch):
+        self._thaw(chat_id)
+        new_messages = [message for entry in batch for message in entry.messages]
+        user_name = batch[-1].user_name
+        if not os.path.exists(self._path(chat_id)) and os.path.exists(self._legacy_path(chat_id)):
+            # Старый JSON-чат один раз переводим в журнал
+            legacy = self._load_legacy(chat_id)
+            messages = legacy['messages'] + new_messages
+            self.save(chat_id, user_name, messages)
+            assign_batch_seqs(batch, len(messages))
+            return None, self.version_stamp(chat_id)
+        last_updated = now_timestamp()
+        header = {'chat_id': chat_id, 'user_name': user_name, 'last_updated': last_updated}
+        records = [self._record(message) for message in new_messages]
+        with self._transaction() as conn:
+            before = self.version_stamp(chat_id)
+            self._write_records(conn, chat_id, header, records)
+            last_seq = self.index.bump(chat_id, user_name, last_updated, len(new_messages), conn)
+            after = self.version_stamp(chat_id)
+        assign_batch_seqs(batch, last_seq)
+        return before, after
+
+    def messages_after(self, chat_id, after=0, limit=None):
+        self._thaw(chat_id)
+        if not os.path.exists(self._path(chat_id)):
+            return super().messages_after(chat_id, after, limit)
+        result = []
+        for seq, message in enumerate(self.iter_messages(chat_id), 1):
+            if seq <= after:
+                continue
+            result.append(dict(message, seq=seq))
+            if limit and len(result) >= limit:
+                break
+        return result
+
+    def messages_before(self, chat_id, before=None, limit=50):
+        self._thaw(chat_id)
+        if not os.path.exists(self._path(chat_id)):
+            return super().messages_before(chat_id, before, limit)
+        if before is None:
+            # Конец чата: журнал читается с хвоста, номер берём из индекса. Если
+            # размер журнала не тот, что записан рядом с номером, - в него
+            # как раз пишут, и нумеруем честным проходом
+            row = self.index.db.connect().execute(
+                '''SELECT chats.message_count, journals.size FROM chats
+                   JOIN journals ON journals.chat_id = chats.chat_id
+                   WHERE chats.chat_id = ?''', (chat_id,)).fetchone()
+            messages = self.tail(chat_id, limit, row[1]) if row else None
+            if messages is not None:
+                return number_messages(messages, row[0] - len(messages) + 1)
+        window = deque(maxlen=limit)
+        for seq, message in enumerate(self.iter_messages(chat_id), 1):
+            if before is not None and seq >= before:
+                break
+            window.append(dict(message, seq=seq))
+        return list(window)
+
+    def touch(self, chat_id):
+        with self.chat_lock(chat_id):
+            return self._touch(chat_id)
+
+    def version_stamp(self, chat_id):
+        return file_stamp(self._path(chat_id)) or file_stamp(self._legacy_path(chat_id))
+
+    def _touch(self, chat_id):
+        self._thaw(chat_id)
+        if not os.path.exists(self._path(chat_id)):
+            legacy = self._load_legacy(chat_id)
+            if not legacy:
+                return False
+            self.save(chat_id, legacy['user_name'], legacy['messages'])
+            return True
+        last_updated = now_timestamp()
+        meta = {'last_updated': last_updated}
+        with self._transaction() as conn:
+            self._write_records(conn, chat_id, dict(meta, chat_id=chat_id), [self._record({'meta': meta})])
+            conn.execute('UPDATE chats SET last_updated = ? WHERE chat_id = ?', (last_updated, chat_id))
+        self._note_meta(chat_id)
+        return True
+
+    def _remove_if_stale(self, chat_id, empty_before, idle_before):
+        if not super()._remove_if_stale(chat_id, empty_before, idle_before):
+            return False
+        conn = self.index.db.connect()
+        with conn:
+            conn.execute('DELETE FROM journals WHERE chat_id = ?', (chat_id,))
+        return True
+
+
+SQLITE_SCHEMA = CHAT_INDEX_SCHEMA + '''
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    sender TEXT NOT NULL,
+    text TEXT NOT NULL,
+    time TEXT NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_chat_id ON messages (chat_id, seq);
+'''
+
+
+class SqliteChatStorage(ChatStorage):
+    """Чаты в одной базе SQLite (WAL), сообщения только дописываются"""
+
+    def __init__(self, path):
+        super().__init__()
+        self.db = SqliteDatabase(path, SQLITE_SCHEMA)
+        self.is_new = self.db.is_new
+        self.index = ChatIndex(self.db)
+
+    def _connect(self):
+        return self.db.connect()
+
+    def _insert_messages(self, conn, chat_id, messages, first_seq):
+        conn.executemany(
+            'INSERT INTO messages (chat_id, seq, sender, text, time) VALUES (?, ?, ?, ?, ?)',
+            [(chat_id, seq, m['sender'], m['text'], m['time'])
+             for seq, m in enumerate(messages, first_seq)]
+        )
+
+    def _stored_count(self, conn, chat_id):
+        row = conn.execute(
+            'SELECT message_count FROM chats WHERE chat_id = ?', (chat_id,)
+        ).fetchone()
+        return row['message_count'] if row else 0
+
+    def load(self, chat_id):
+        conn = self._connect()
+        row = conn.execute(
+            'SELECT chat_id, user_name, last_updated FROM chats WHERE chat_id = ?', (chat_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        messages = [
+            {'sender': m['sender'], 'text': m['text'], 'time': m['time']}
+            for m in conn.execute(
+                'SELECT sender, text, time FROM messages WHERE chat_id = ? ORDER BY seq', (chat_id,)
+            )
+        ]
+        return {
+            'chat_id': row['chat_id'],
+            'user_name': row['user_name'],
+            'messages': messages,
+            'last_updated': row['last_updated']
+        }
+
+    def save(self, chat_id, user_name, messages):
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            stored = self._stored_count(conn, chat_id)
+            if stored > len(messages):
+                # История стала короче - переписываем её заново
+                conn.execute('DELETE FROM messages WHERE chat_id = ?', (chat_id,))
+                conn.execute('UPDATE chats SET message_count = 0 WHERE chat_id = ?', (chat_id,))
+                stored = 0
+            # Вызывающий код только наращивает историю, поэтому дописываем хвост
+            self._insert_messages(conn, chat_id, messages[stored:], stored + 1)
+            self.index.bump(chat_id, user_name, now_timestamp(), len(messages) - stored, conn)
+
+    def _append_batch(self, chat_id, batch):
+        new_messages = [message for entry in batch for message in entry.messages]
+        conn = self._connect()
+        with conn:
+            # Номер читаем и пишем в одной транзакции с блокировкой на запись
+            conn.execute('BEGIN IMMEDIATE')
+            before = self._stamp(conn, chat_id)
+            stored = self._stored_count(conn, chat_id)
+            self._insert_messages(conn, chat_id, new_messages, stored + 1)
+            last_seq = self.index.bump(chat_id, batch[-1].user_name, now_timestamp(),
+                                       len(new_messages), conn)
+            after = self._stamp(conn, chat_id)
+        assign_batch_seqs(batch, last_seq)
+        return before, after
+
+    def messages_after(self, chat_id, after=0, limit=None):
+        query = '''SELECT seq, sender, text, time FROM messages
+                   WHERE chat_id = ? AND seq > ? ORDER BY seq'''
+        params = [chat_id, after]
+        if limit:
+            query += ' LIMIT ?'
+            params.append(limit)
+        return [
+            {'sender': m['sender'], 'text': m['text'], 'time': m['time'], 'seq': m['seq']}
+            for m in self._connect().execute(query, params)
+        ]
+
+    def messages_before(self, chat_id, before=None, limit=50):
+        query = '''SELECT seq, sender, text, time FROM messages
+                   WHERE chat_id = ? AND seq < ? ORDER BY seq DESC LIMIT ?'''
+        rows = self._connect().execute(query, (chat_id, before or 2 ** 62, limit)).fetchall()
+        return [
+            {'sender': m['sender'], 'text': m['text'], 'time': m['time'], 'seq': m['seq']}
+            for m in reversed(rows)
+        ]
+
+    def touch(self, chat_id):
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute(
+                'UPDATE chats SET last_updated = ? WHERE chat_id = ?', (now_timestamp(), chat_id)
+            )
+        return cursor.rowcount > 0
+
+    def list_chats(self, limit=None, cursor=None):
+        return self.index.list(limit, cursor)
+
+    def _remove_if_stale(self, chat_id, empty_before, idle_before):
+        conn = self._connect()
+        with conn:
+            # Другие процессы пишут без наших блокировок - проверка и удаление в одной транзакции
+            conn.execute('BEGIN IMMEDIATE')
+            if not self.index.remove_if_stale(chat_id, empty_before, idle_before, conn):
+                return False
+            conn.execute('DELETE FROM messages WHERE chat_id = ?', (chat_id,))
+        return True
+
+    def version_stamp(self, chat_id):
+        return self._stamp(self._connect(), chat_id)
+
+    @staticmethod
+    def _stamp(conn, chat_id):
+        row = conn.execute(
+            'SELECT message_count, last_updated, user_name FROM chats WHERE chat_id = ?', (chat_id,)
+        ).fetchone()
+        return tuple(row) if row else None
+
+    def import_chat(self, chat_data):
+        """Переносит готовый чат вместе с его last_updated"""
+        conn = self._connect()
+        with conn:
+            conn.execute('DELETE FROM messages WHERE chat_id = ?', (chat_data['chat_id'],))
+            conn.execute('DELETE FROM chats WHERE chat_id = ?', (chat_data['chat_id'],))
+            self._insert_messages(conn, chat_data['chat_id'], chat_data['messages'], 1)
+            self.index.bump(chat_data['chat_id'], chat_data['user_name'],
+                            chat_data.get('last_updated') or now_timestamp(),
+                            len(chat_data['messages']), conn)
+
+# Время сообщения 'HH:MM' хранится в кэше как минуты от полуночи;
+# строки заготовлены заранее и общие для всех сообщений
+TIME_STRINGS = tuple(f'{minute // 60:02d}:{minute % 60:02d}' for minute in range(24 * 60))
+IRREGULAR_TIME = 0xFFFF
+
+
+def pack_time(value):
+    """Минуты от полуночи для 'HH:MM' или IRREGULAR_TIME для всего остального"""
+    if len(value) == 5 and value[2] == ':' and value[:2].isdigit() and value[3:].isdigit():
+        minute = int(value[:2]) * 60 + int(value[3:])
+        if minute < len(TIME_STRINGS) and TIME_STRINGS[minute] == value:
+            return minute
+    return IRREGULAR_TIME
+
+
+class MessageColumns:
+    """Сообщения чата в колонках вместо словаря на каждое сообщение: код
+    отправителя (байт), время (два байта) и тексты одной строкой UTF-8 с
+    концами сообщений в array('I'). Короткое сообщение занимает пару
+    десятков байт вместо нескольких сотен.
+
+    Колонки только растут, а count меняется последним - читатель, взявший
+    count, видит согласованные данные без блокировки.
+    """
+
+    __slots__ = ('senders', 'sender', 'time', 'odd_times', 'text', 'text_end', 'count')
+
+    def __init__(self, messages=()):
+        self.senders = []               # код -> имя отправителя
+        self.sender = array('B')
+        self.time = array('H')
+        self.odd_times = {}             # номер -> время не в формате 'HH:MM'
+        self.text = bytearray()         # тексты подряд в UTF-8
+        self.text_end = array('I')      # конец текста каждого сообщения в self.text
+        self.count = 0
+        self.extend(messages)
+
+    def extend(self, messages):
+        """Дописывает сообщения. Вызывать под блокировкой владельца"""
+        index = self.count
+        for message in messages:
+            sender = message['sender']
+            if sender in self.senders:
+                code = self.senders.index(sender)
+            else:
+                code = len(self.senders)
+                self.senders.append(sender)
+            time = message['time']
+            packed = pack_time(time)
+            if packed == IRREGULAR_TIME:
+                self.odd_times[index] = time
+            self.sender.append(code)
+            self.time.append(packed)
+            self.text += message['text'].encode('utf-8')
+            self.text_end.append(len(self.text))
+            index += 1
+        self.count = index
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def nbytes(self):
+        """Примерный размер в памяти"""
+        return 256 + len(self.text) + 7 * self.count + 64 * len(self.odd_times)
+
+    def to_dicts(self, start=0, end=None, first_seq=None):
+        """Сообщения [start:end] в виде, который ждёт фронтенд; first_seq -
+        добавить поле seq, начиная с этого номера"""
+        count = self.count
+        end = count if end is None else max(0, min(end, count))
+        start = max(0, min(start, end))
+        senders = self.senders
+        odd_times = self.odd_times
+        text = self.text
+        offset = self.text_end[start - 1] if start else 0
+        messages = []
+        for index, code, packed, next_offset in zip(range(start, end), self.sender[start:end],
+                                                     self.time[start:end], self.text_end[start:end]):
+            message = {
+                'sender': senders[code],
+                'text': text[offset:next_offset].decode('utf-8'),
+                'time': odd_times[index] if packed == IRREGULAR_TIME else TIME_STRINGS[packed]
+            }
+            offset = next_offset
+            if first_seq is not None:
+                message['seq'] = first_seq + index - start
+            messages.append(message)
+        return messages
+
+
+class CachedChat:
+    """Чат в кэше: метаданные и сообщения в колонках"""
+
+    __slots__ = ('chat_id', 'user_name', 'last_updated', 'messages')
+
+    def __init__(self, chat_data):
+        self.chat_id = chat_data['chat_id']
+        self.user_name = chat_data['user_name']
+        self.last_updated = chat_data['last_updated']
+        self.messages = MessageColumns(chat_data['messages'])
+
+    def to_dict(self):
+        return {
+            'chat_id': self.chat_id,
+            'user_name': self.user_name,
+            'messages': self.messages.to_dicts(),
+            'last_updated': self.last_updated
+        }
+
+
+class CachedChatStorage:
+    """LRU-кэш горячих чатов перед любым хранилищем.
+
+    Запись идёт сквозь кэш в хранилище. Перед выдачей из кэша сверяется
+    version_stamp (stat файла или строка в таблице chats) - так замечаются
+    записи других воркеров, а сам чат с диска не читается.
+    """
+
+    def __init__(self, storage, max_chats=10000, max_bytes=64 * 1024 * 1024):
+        self.storage = storage
+        self.max_chats = max_chats
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()   # chat_id -> (CachedChat, метка версии, байты)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __getattr__(self, name):
+        # Всё, чего нет в кэше (index, tail, compact...), - прямо в хранилище
+        return getattr(self.storage, name)
+
+    def cache_stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'chats': len(self._entries),
+            'bytes': self._bytes
+        }
+
+    def _put(self, chat_id, chat, stamp):
+        with self._lock:
+            self._store(chat_id, chat, stamp)
+
+    def _store(self, chat_id, chat, stamp):
+        """Кладёт чат в кэш и вытесняет лишнее. Вызывается под self._lock"""
+        self._drop(chat_id)
+        size = chat.messages.nbytes
+        if size > self.max_bytes:
+            return
+        self._entries[chat_id] = (chat, stamp, size)
+        self._bytes += size
+        while len(self._entries) > self.max_chats or self._bytes > self.max_bytes:
+            _, (_, _, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self.evictions += 1
+
+    def _drop(self, chat_id):
+        entry = self._entries.pop(chat_id, None)
+        if entry:
+            self._bytes -= entry[2]
+
+    def _get_valid(self, chat_id):
+        """Чат из кэша, если он ещё совпадает с хранилищем. Попадание
+        считается здесь же, под блокировкой"""
+        with self._lock:
+            entry = self._entries.get(chat_id)
+        if entry is None:
+            return None
+        if self.storage.version_stamp(chat_id) != entry[1]:
+            with self._lock:
+                if self._entries.get(chat_id) is entry:
+                    self._drop(chat_id)
+                    self.invalidations += 1
+            return None
+        with self._lock:
+            if chat_id in self._entries:
+                self._entries.move_to_end(chat_id)
+            self.hits += 1
+        return entry[0]
+
+    def load(self, chat_id):
+        chat = self._get_valid(chat_id)
+        if chat is not None:
+            return chat.to_dict()
+        with self._lock:
+            self.misses += 1
+        stamp = self.storage.version_stamp(chat_id)
+        chat_data = self.storage.load(chat_id)
+        if chat_data is None:
+            return None
+        self._put(chat_id, CachedChat(chat_data), stamp)
+        return chat_data
+
+    def messages_after(self, chat_id, after=0, limit=None):
+        chat = self._get_valid(chat_id)
+        if chat is None:
+            return self.storage.messages_after(chat_id, after, limit)
+        end = after + limit if limit else None
+        return chat.messages.to_dicts(after, end, after + 1)
+
+    def messages_before(self, chat_id, before=None, limit=50):
+        chat = self._get_valid(chat_id)
+        if chat is None:
+            return self.storage.messages_before(chat_id, before, limit)
+        count = len(chat.messages)
+        end = count if before is None else max(0, min(before - 1, count))
+        start = max(0, end - limit)
+        return chat.messages.to_dicts(start, end, start + 1)
+
+    def save(self, chat_id, user_name, messages):
+        with self._lock:
+            self._drop(chat_id)
+        self.storage.save(chat_id, user_name, messages)
+
+    def append(self, chat_id, user_name, new_messages):
+        return self.append_versioned(chat_id, user_name, new_messages)[0]
+
+    def append_versioned(self, chat_id, user_name, new_messages):
+        last_seq, before, after = self.storage.append_versioned(chat_id, user_name, new_messages)
+        with self._lock:
+            entry = self._entries.get(chat_id)
+            if entry is not None:
+                chat, stamp, _ = entry
+                if (before is not None and stamp == before
+                        and len(chat.messages) == last_seq - len(new_messages)):
+                    # Кэш совпадал с версией прямо перед записью - дописываем
+                    # в него те же сообщения и ставим метку сразу после неё
+                    chat.messages.extend(new_messages)
+                    chat.user_name = user_name
+                    chat.last_updated = now_timestamp()
+                    self._store(chat_id, chat, after)
+                else:
+                    self._drop(chat_id)
+        return last_seq, before, after
+
+    def touch(self, chat_id):
+        with self._lock:
+            self._drop(chat_id)
+        return self.storage.touch(chat_id)
+
+    def list_chats(self, limit=None, cursor=None):
+        return self.storage.list_chats(limit, cursor)
+
+
+def migrate_json_to_sqlite(json_folder, storage):
+    """Разовый перенос saved_chats/*.json в SQLite. Возвращает число чатов"""
+    imported = 0
+    if not os.path.isdir(json_folder):
+        return imported
+    for path in sorted(iter_chat_files(json_folder, ('.json', '.json.gz'))):
+        filename = os.path.basename(path)
+        try:
+            opener = gzip.open if filename.endswith('.gz') else open
+            with opener(path, 'rt', encoding='utf-8') as f:
+                chat_data = decode_chat(f.read())
+        except (OSError, ValueError):
+            print(f"⚠️ Пропускаю повреждённый файл {filename}")
+            continue
+        storage.import_chat(chat_data)
+        imported += 1
+    return imported
+
+
+def convert_chat_files(folder):
+    """Переписывает JSON-чаты старого формата (и в шардах, и сжатые) в
+    формат версии 2. Файл, изменившийся во время перевода, пропускается -
+    его перепишет следующий запуск или первая же запись сервера.
+    Возвращает (переведено, уже в новом формате)"""
+    converted = current = 0
+    for path in iter_chat_files(folder, ('.json', '.json.gz')):
+        packed = path.endswith('.gz')
+        stamp = file_stamp(path)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            chat_data = json.loads(gzip.decompress(data) if packed else data)
+        except (OSError, ValueError):
+            print(f"⚠️ Пропускаю повреждённый файл {path}")
+            continue
+        if 'v' in chat_data:
+            current += 1
+            continue
+        data = encode_chat(chat_data).encode('utf-8')
+        tmp_path = write_temp(path, gzip.compress(data, mtime=0) if packed else data)
+        if file_stamp(path) != stamp:
+            os.remove(tmp_path)
+            continue
+        os.replace(tmp_path, path)
+        converted += 1
+    return converted, current
+
+
+def create_chat_storage(kind, folder, db_path, fsync_interval=1.0):
+    """Создаёт хранилище по имени: 'json', 'jsonl' или 'sqlite'"""
+    if kind == 'json':
+        return JsonChatStorage(folder)
+    if kind == 'jsonl':
+        return JsonlChatStorage(folder, fsync_interval=fsync_interval)
+    if kind == 'sqlite':
+        storage = SqliteChatStorage(db_path)
+        if storage.is_new:
+            # Первый запуск на SQLite: забираем уже сохранённые JSON-чаты
+            migrate_json_to_sqlite(folder, storage)
+        return storage
+    raise ValueError(f"Неизвестное хранилище чатов: {kind}")
@@ -0,0 +1,295 @@
+# classifier.py - Определение категорий сообщений для ответов Пэрры
+#
+# Здесь только разбор текста, без случайных ответов: то же самое
+# используется и сайтом (app.py), и офлайн-разбором логов (manage.py classify).
+
+import os
+import bisect
+import multiprocessing
+from collections import deque
+
+# Приветствия
+GREETINGS = ['привет', 'здравствуй', 'хай', 'hello', 'ку', 'здарова', 'дороу', 'здорово', 'прив']
+
+# Прощания
+GOODBYE_WORDS = ['пока', 'до свидания', 'прощай', 'bye', 'bb', 'до встречи', 'удачи', 'счастливо']
+
+# Слова-команды
+COMMAND_WORDS = ['реши', 'выполни', 'сделай', 'напиши', 'посчитай', 'открой', 'закрой', 
+                 'принеси', 'подними', 'создай', 'пиши', 'отправляй', 'жду', 'расскажи', 
+                 'покажи', 'скажи', 'ответь', 'сгенерируй', 'придумай']
+
+# Слова для вопросов о времени и дате
+TIME_WORDS = ['время', 'часов', 'час', 'который час', 'сколько времени', 'time']
+DATE_WORDS = ['дата', 'число', 'какое сегодня', 'день недели', 'месяц', 'год', 'date', 'день']
+
+# Слова для вопросов о новостях
+NEWS_WORDS = ['новости', 'новость', 'что нового', 'что в мире', 'что случилось', 'news', 
+              'события', 'произошло', 'случилось', 'что там', 'что интересного']
+
+# Слова, указывающие на просьбу написать код
+CODE_WORDS = ['код', 'программу', 'скрипт', 'функцию', 'класс', 'метод', 'алгоритм', 
+              'program', 'code', 'script', 'function']
+
+# Оскорбления
+BAD_WORDS = ['дурак', 'тупой', 'лох', 'идиот', 'козел', 'гад', 'тварь', 'сука', 'блять', 
+             'нахер', 'нафиг', 'пидор', 'дебил', 'мудак', 'хер', 'хуй', 'пиздец']
+
+# Хвастовство/игнорирование
+IGNORE_PHRASES = ['бот', 'робот', 'искусственный интеллект', 'ии', 'нейросеть']
+
+# Просьбы написать код целиком
+CODE_PHRASES = ['напиши код', 'сделай код', 'напиши программу', 'сделай программу',
+                'код на', 'программу на']
+
+# Вопросы о годе
+YEAR_PHRASES = ['какой год', 'год какой', 'какой сейчас год', 'год сейчас', 'который год']
+
+# Уговоры
+PLEASE_PHRASES = ['пожалуйста', 'ну пожалуйста', 'прошу', 'умоляю']
+
+# Короткие вопросы (сообщение должно совпадать целиком)
+WHAT_WORDS = ['что', 'чо', 'шо', 'че', 'чё', 'что?', 'чо?', 'шо?', 'че?', 'чё?']
+NO_WORDS = ['нет', 'нет.', 'не', 'не.']
+WHY_WORDS = ['почему', 'почему?', 'поч', 'почему так', 'почему нет']
+HOW_WORDS = ['как', 'как?', 'как так', 'как это', 'каким образом']
+WHY_NEED_WORDS = ['зачем', 'зачем?', 'для чего', 'с какой целью']
+
+# Категории сообщений (битовые флаги)
+CAT_GREETING = 1 << 0
+CAT_GOODBYE = 1 << 1
+CAT_COMMAND = 1 << 2
+CAT_BAD = 1 << 3
+CAT_BOT = 1 << 4
+CAT_TIME = 1 << 5
+CAT_DATE = 1 << 6
+CAT_NEWS = 1 << 7
+CAT_CODE = 1 << 8
+CAT_CODE_PHRASE = 1 << 9
+CAT_YEAR = 1 << 10
+CAT_PLEASE = 1 << 11
+CAT_WHAT = 1 << 12
+CAT_NO = 1 << 13
+CAT_WHY = 1 << 14
+CAT_HOW = 1 << 15
+CAT_WHY_NEED = 1 << 16
+
+# Категории, которые ищутся как подстроки в тексте
+KEYWORD_CATEGORIES = [
+    (CAT_GREETING, GREETINGS),
+    (CAT_GOODBYE, GOODBYE_WORDS),
+    (CAT_COMMAND, COMMAND_WORDS),
+    (CAT_BAD, BAD_WORDS),
+    (CAT_BOT, IGNORE_PHRASES),
+    (CAT_TIME, TIME_WORDS),
+    (CAT_DATE, DATE_WORDS),
+    (CAT_NEWS, NEWS_WORDS),
+    (CAT_CODE, CODE_WORDS),
+    (CAT_CODE_PHRASE, CODE_PHRASES),
+    (CAT_YEAR, YEAR_PHRASES),
+    (CAT_PLEASE, PLEASE_PHRASES),
+]
+
+# Категории, для которых сообщение должно совпадать с фразой целиком
+EXACT_CATEGORIES = [
+    (CAT_WHAT, WHAT_WORDS),
+    (CAT_NO, NO_WORDS),
+    (CAT_WHY, WHY_WORDS),
+    (CAT_HOW, HOW_WORDS),
+    (CAT_WHY_NEED, WHY_NEED_WORDS),
+]
+
+class KeywordMatcher:
+    """Автомат Ахо–Корасик: все категории за один проход по тексту"""
+
+    def __init__(self, categories):
+        self.goto = [{}]
+        self.output = [0]
+        for flag, words in categories:
+            for word in words:
+                state = 0
+                for char in word:
+                    next_state = self.goto[state].get(char)
+                    if next_state is None:
+                        next_state = len(self.goto)
+                        self.goto.append({})
+                        self.output.append(0)
+                        self.goto[state][char] = next_state
+                    state = next_state
+                self.output[state] |= flag
+
+        # Суффиксные ссылки строим обходом в ширину
+        self.fail = [0] * len(self.goto)
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                self.output[next_state] |= self.output[self.fail[next_state]]
+
+    def match(self, text):
+        """Возвращает битовую маску всех категорий, найденных в тексте"""
+        goto, fail, output = self.goto, self.fail, self.output
+        state = 0
+        found = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            found |= output[state]
+        return found
+
+# Собираем словари один раз при импорте
+KEYWORD_MATCHER = KeywordMatcher(KEYWORD_CATEGORIES)
+EXACT_PHRASES = {}
+for _flag, _phrases in EXACT_CATEGORIES:
+    for _phrase in _phrases:
+        EXACT_PHRASES[_phrase] = EXACT_PHRASES.get(_phrase, 0) | _flag
+
+def classify_message(message_text):
+    """Определяет категории сообщения и возвращает их битовую маску"""
+    text = message_text.lower().strip()
+    return KEYWORD_MATCHER.match(text) | EXACT_PHRASES.get(text, 0)
+
+
+# Ветки ответа в get_bot_response, в порядке проверки
+def response_branch(flags):
+    """Какая ветка ответа сработает для сообщения с такими категориями.
+    Случайный выбор фразы внутри ветки сюда не входит"""
+    has_command = flags & CAT_COMMAND
+    if flags & CAT_BAD:
+        return 'bad'
+    if flags & CAT_BOT and not has_command and not flags & (CAT_CODE | CAT_NEWS):
+        return 'bot'
+    if flags & CAT_TIME and not has_command:
+        return 'time'
+    if flags & CAT_DATE and not has_command:
+        return 'date'
+    if flags & CAT_NEWS and not has_command:
+        return 'news'
+    if flags & (CAT_CODE | CAT_CODE_PHRASE) and not has_command:
+        return 'code'
+    if flags & CAT_GOODBYE and not has_command:
+        return 'goodbye'
+    if flags & CAT_YEAR:
+        return 'year'
+    if flags & CAT_HOW:
+        return 'how'
+    if flags & CAT_WHY_NEED:
+        return 'why_need'
+    if flags & CAT_WHY:
+        return 'why'
+    if flags & CAT_PLEASE and (has_command or flags & CAT_CODE):
+        return 'please'
+    if flags & CAT_WHAT:
+        return 'what'
+    if flags & CAT_GREETING and not has_command:
+        return 'greeting'
+    if has_command:
+        return 'refusal'
+    if flags & CAT_NO:
+        return 'no'
+    return 'casual'
+
+# Названия флагов для отчётов
+CATEGORY_NAMES = [
+    (CAT_GREETING, 'greeting'), (CAT_GOODBYE, 'goodbye'), (CAT_COMMAND, 'command'),
+    (CAT_BAD, 'bad'), (CAT_BOT, 'bot'), (CAT_TIME, 'time'), (CAT_DATE, 'date'),
+    (CAT_NEWS, 'news'), (CAT_CODE, 'code'), (CAT_CODE_PHRASE, 'code_phrase'),
+    (CAT_YEAR, 'year'), (CAT_PLEASE, 'please'), (CAT_WHAT, 'what'), (CAT_NO, 'no'),
+    (CAT_WHY, 'why'), (CAT_HOW, 'how'), (CAT_WHY_NEED, 'why_need'),
+]
+
+def category_names(flags):
+    return [name for flag, name in CATEGORY_NAMES if flags & flag]
+
+# --- Пакетный разбор для офлайн-анализа ---
+#
+# Одинаковые сообщения (а в логах их большинство) разбираются один раз.
+# Уникальные склеиваются через \0 в одну строку, и каждое слово ищется по ней
+# str.find - поиск идёт в C, а Python только раскладывает найденные позиции
+# по сообщениям. После находки поиск слова продолжается со следующего
+# сообщения. Слова не содержат \0, поэтому совпадение не переходит границу.
+
+SEPARATOR = '\0'
+
+def classify_batch(messages):
+    """Битовые маски категорий для списка сообщений, как у classify_message"""
+    unique = {}
+    for message in messages:
+        if message not in unique:
+            unique[message] = message.lower().strip()
+    texts = [text for text in unique.values() if SEPARATOR not in text]
+    starts = []
+    position = 0
+    for text in texts:
+        starts.append(position)
+        position += len(text) + 1
+    joined = SEPARATOR.join(texts)
+
+    found = [0] * len(texts)
+    last = len(texts) - 1
+    find = joined.find
+    for flag, words in KEYWORD_CATEGORIES:
+        for word in words:
+            position = find(word)
+            while position != -1:
+                index = bisect.bisect_right(starts, position) - 1
+                found[index] |= flag
+                if index == last:
+                    break
+                position = find(word, starts[index + 1])
+
+    flags_by_text = dict(zip(texts, found))
+    result = {}
+    for message, text in unique.items():
+        if text in flags_by_text:
+            result[message] = flags_by_text[text] | EXACT_PHRASES.get(text, 0)
+        else:
+            # Редкий случай: в самом сообщении есть \0
+            result[message] = classify_message(message)
+    return [result[message] for message in messages]
+
+def _classify_chunk(messages):
+    return [(flags, response_branch(flags)) for flags in classify_batch(messages)]
+
+def _chunks(messages, chunk_size):
+    chunk = []
+    for message in messages:
+        chunk.append(message)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _with_messages(chunk, results):
+    for message, (flags, branch) in zip(chunk, results):
+        yield message, flags, branch
+
+def classify_bulk(messages, processes=None, chunk_size=10000):
+    """Разбирает любое количество сообщений (список или поток).
+    Отдаёт тройки (сообщение, флаги, ветка ответа) в исходном порядке.
+    Пачки по chunk_size сообщений раздаются пулу процессов (по умолчанию
+    по числу ядер); processes=1 - без пула"""
+    chunks = _chunks(messages, chunk_size)
+    processes = processes or os.cpu_count() or 1
+    if processes == 1:
+        for chunk in chunks:
+            yield from _with_messages(chunk, _classify_chunk(chunk))
+        return
+    with multiprocessing.Pool(processes) as pool:
+        # В работе держим немного пачек, чтобы не читать весь поток в память
+        in_flight = deque()
+        for chunk in chunks:
+            in_flight.append((chunk, pool.apply_async(_classify_chunk, (chunk,))))
+            if len(in_flight) > 2 * processes:
+                chunk, result = in_flight.popleft()
+                yield from _with_messages(chunk, result.get())
+        while in_flight:
+            chunk, result = in_flight.popleft()
+            yield from _with_messages(chunk, result.get())
@@ -0,0 +1,80 @@
+# compression.py - Сжатие ответов Пэрры (gzip, brotli) и кэш сжатой статики
+#
+# brotli - необязательная зависимость (pip install brotli). Без неё
+# ответы сжимаются только gzip.
+
+import os
+import gzip
+import threading
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Мельче этого сжимать нет смысла: заголовки и так больше выигрыша
+COMPRESS_MIN_SIZE = int(os.environ.get('PERRA_COMPRESS_MIN_SIZE', '1024'))
+
+COMPRESSIBLE_TYPES = {
+    'text/html', 'text/css', 'text/plain', 'text/javascript', 'application/javascript',
+    'application/json', 'application/manifest+json', 'image/svg+xml',
+}
+
+# Поддерживаемые кодировки в порядке предпочтения
+ENCODINGS = ['br', 'gzip'] if brotli else ['gzip']
+
+
+def choose_encoding(accept_encodings):
+    """Лучшая кодировка из заголовка Accept-Encoding (объект werkzeug) или None"""
+    return accept_encodings.best_match(ENCODINGS)
+
+
+def should_compress(mimetype, size):
+    return mimetype in COMPRESSIBLE_TYPES and size >= COMPRESS_MIN_SIZE
+
+
+def compress(data, encoding, best=False):
+    """Сжимает байты. best=True - максимальное сжатие (для статики, делается один раз)"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=11 if best else 5)
+    return gzip.compress(data, compresslevel=9 if best else 6, mtime=0)
+
+
+def weaken_etag(response):
+    """Сжатое представление - другие байты, поэтому сильный ETag становится
+    слабым: If-None-Match сравнивает слабо и по-прежнему отдаёт 304"""
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+
+
+def mark_encoded(response, encoding, body):
+    response.headers['Content-Encoding'] = encoding
+    response.headers['Content-Length'] = str(len(body))
+    response.vary.add('Accept-Encoding')
+    weaken_etag(response)
+
+
+class PrecompressedCache:
+    """Сжатые версии файлов статики: сжимаются один раз при первом запросе
+    и пересжимаются, только если файл изменился"""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, path, encoding):
+        st = os.stat(path)
+        key = (path, encoding)
+        stamp = (st.st_mtime_ns, st.st_size)
+        entry = self._entries.get(key)
+        if entry and entry[0] == stamp:
+            return entry[1]
+        with open(path, 'rb') as f:
+            body = compress(f.read(), encoding, best=True)
+        with self._lock:
+            self._entries[key] = (stamp, body)
+        return body
+
+
+static_cache = PrecompressedCache()
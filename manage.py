@@ -0,0 +1,168 @@
+# manage.py - Служебные команды Пэрры
+
+import argparse
+import json
+import os
+import sys
+from collections import Counter
+
+from chat_storage import (SqliteChatStorage, JsonChatStorage, JsonlChatStorage, migrate_json_to_sqlite,
+                          create_chat_storage, shard_flat_files, convert_chat_files)
+from classifier import classify_bulk, category_names
+from search_index import SearchIndex
+
+
+def search_enabled():
+    """Включён ли поиск - так же, как его определяет app.py"""
+    return os.environ.get('PERRA_SEARCH', '') not in ('', '0')
+
+
+def cmd_migrate_sqlite(args):
+    """Переносит saved_chats/*.json в базу SQLite"""
+    storage = SqliteChatStorage(args.db)
+    imported = migrate_json_to_sqlite(args.folder, storage)
+    print(f"✅ Перенесено чатов: {imported} ({args.folder} → {args.db})")
+
+
+def cmd_gc_chats(args):
+    """Разовая уборка пустых и заброшенных чатов (например, из cron)"""
+    storage = create_chat_storage(args.storage, args.folder, args.db)
+    # Удалённые чаты убираем и из поиска, иначе они там останутся
+    index = SearchIndex(args.search_db) if args.search_db else None
+    removed = 0
+    while True:
+        batch = storage.collect_garbage(args.empty_ttl, args.idle_ttl, limit=1000,
+                                        on_remove=index.remove_chat if index else None)
+        removed += batch
+        if batch < 1000:
+            break
+    print(f"✅ Удалено чатов: {removed}")
+
+
+def cmd_shard_chats(args):
+    """Разносит файлы чатов из плоской папки по папкам шардов ab/cd"""
+    suffixes = JsonChatStorage.file_suffixes + JsonlChatStorage.file_suffixes
+    moved = shard_flat_files(args.folder, suffixes)
+    print(f"✅ Перенесено файлов: {moved}")
+
+
+def cmd_freeze_chats(args):
+    """Сжимает в холодный слой чаты, в которые давно не писали"""
+    storage = create_chat_storage(args.storage, args.folder, args.db)
+    frozen = 0
+    while True:
+        batch = storage.freeze_idle(args.idle_ttl, limit=1000)
+        frozen += batch
+        if batch < 1000:
+            break
+    print(f"✅ Сжато чатов: {frozen}")
+
+
+def cmd_convert_chats(args):
+    """Переводит JSON-чаты из старого формата с отступами в компактный"""
+    converted, current = convert_chat_files(args.folder)
+    print(f"✅ Переведено чатов: {converted}, уже в новом формате: {current}")
+
+
+def cmd_index_chats(args):
+    """Строит поисковый индекс по всем уже сохранённым чатам"""
+    storage = create_chat_storage(args.storage, args.folder, args.db)
+    index = SearchIndex(args.search_db)
+    chats, _ = storage.list_chats()
+    for number, chat in enumerate(chats, 1):
+        chat_data = storage.load(chat['id'])
+        if chat_data:
+            index.reindex_chat(chat_data)
+        if number % 1000 == 0:
+            print(f"   {number} / {len(chats)}", file=sys.stderr)
+    print(f"✅ Проиндексировано чатов: {len(chats)}")
+
+
+def read_messages(f, field):
+    """Сообщения из файла: по строке на сообщение или JSONL с полем field"""
+    for line in f:
+        line = line.rstrip('\n')
+        if field:
+            if line.strip():
+                yield json.loads(line).get(field, '')
+        else:
+            yield line
+
+
+def cmd_classify(args):
+    """Офлайн-разбор логов: категории и ветка ответа для каждого сообщения"""
+    source = sys.stdin if args.input == '-' else open(args.input, 'r', encoding='utf-8')
+    output = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8')
+    branches = Counter()
+    with source, output:
+        messages = read_messages(source, args.field)
+        for message, flags, branch in classify_bulk(messages, args.processes, args.chunk_size):
+            branches[branch] += 1
+            output.write(json.dumps({'message': message, 'flags': flags,
+                                     'categories': category_names(flags), 'branch': branch},
+                                    ensure_ascii=False) + '\n')
+    total = sum(branches.values())
+    print(f"✅ Разобрано сообщений: {total}", file=sys.stderr)
+    for branch, count in branches.most_common():
+        print(f"   {branch:<10} {count:>10}  {count / total:6.1%}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Служебные команды Пэрры')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    migrate = commands.add_parser('migrate-sqlite', help='перенести JSON-чаты в SQLite')
+    migrate.add_argument('--folder', default='saved_chats', help='папка с JSON-чатами')
+    migrate.add_argument('--db', default=os.environ.get('PERRA_CHATS_DB', 'chats.db'), help='файл базы')
+    migrate.set_defaults(func=cmd_migrate_sqlite)
+
+    gc = commands.add_parser('gc-chats', help='удалить пустые и заброшенные чаты')
+    gc.add_argument('--storage', default=os.environ.get('PERRA_CHAT_STORAGE', 'sqlite'),
+                    choices=['sqlite', 'json', 'jsonl'])
+    gc.add_argument('--folder', default='saved_chats', help='папка с чатами')
+    gc.add_argument('--db', default=os.environ.get('PERRA_CHATS_DB', 'chats.db'), help='файл базы')
+    gc.add_argument('--empty-ttl', type=float, default=3600, help='пустые чаты старше стольких секунд')
+    gc.add_argument('--idle-ttl', type=float, default=0, help='чаты без записей дольше стольких секунд (0 - не трогать)')
+    gc.add_argument('--search-db',
+                    default=os.environ.get('PERRA_SEARCH_DB', 'search.db') if search_enabled() else None,
+                    help='поисковый индекс, из которого убрать удалённые чаты (по умолчанию - при PERRA_SEARCH=1)')
+    gc.set_defaults(func=cmd_gc_chats)
+
+    shard = commands.add_parser('shard-chats', help='разложить чаты из плоской папки по шардам')
+    shard.add_argument('--folder', default='saved_chats', help='папка с чатами')
+    shard.set_defaults(func=cmd_shard_chats)
+
+    freeze = commands.add_parser('freeze-chats', help='сжать давно не используемые чаты')
+    freeze.add_argument('--storage', default='jsonl', choices=['json', 'jsonl'])
+    freeze.add_argument('--folder', default='saved_chats', help='папка с чатами')
+    freeze.add_argument('--idle-ttl', type=float, default=30 * 24 * 60 * 60,
+                        help='чаты без записей дольше стольких секунд')
+    freeze.set_defaults(func=cmd_freeze_chats, db=None)
+
+    convert = commands.add_parser('convert-chats', help='перевести JSON-чаты в компактный формат')
+    convert.add_argument('--folder', default='saved_chats', help='папка с чатами')
+    convert.set_defaults(func=cmd_convert_chats)
+
+    index = commands.add_parser('index-chats', help='построить поисковый индекс по всем чатам')
+    index.add_argument('--storage', default=os.environ.get('PERRA_CHAT_STORAGE', 'sqlite'),
+                       choices=['sqlite', 'json', 'jsonl'])
+    index.add_argument('--folder', default='saved_chats', help='папка с чатами')
+    index.add_argument('--db', default=os.environ.get('PERRA_CHATS_DB', 'chats.db'), help='файл базы чатов')
+    index.add_argument('--search-db', default=os.environ.get('PERRA_SEARCH_DB', 'search.db'),
+                       help='файл поискового индекса')
+    index.set_defaults(func=cmd_index_chats)
+
+    classify = commands.add_parser('classify', help='разобрать лог сообщений офлайн')
+    classify.add_argument('input', help='файл с сообщениями (- для stdin)')
+    classify.add_argument('--field', help='сообщения в JSONL: имя поля с текстом')
+    classify.add_argument('--output', default='-', help='куда писать JSONL с результатами')
+    classify.add_argument('--processes', type=int, help='процессов в пуле (по умолчанию по числу ядер)')
+    classify.add_argument('--chunk-size', type=int, default=10000, help='сообщений в пачке')
+    classify.set_defaults(func=cmd_classify)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+# metrics.py - Замеры Пэрры: время запросов и их фаз, байты ввода-вывода
+#
+# Выключено по умолчанию. Включается переменной PERRA_METRICS=1, тогда
+# app.py отдаёт всё собранное на /metrics в текстовом формате Prometheus.
+# Данные живут в памяти своего процесса: при нескольких воркерах gunicorn
+# Prometheus видит тот воркер, который ответил на запрос.
+#
+# PERRA_PROFILE_EVERY=N дополнительно снимает cProfile с каждого N-го
+# запроса и кладёт его в папку PERRA_PROFILE_DIR (по умолчанию profiles/).
+
+import os
+import time
+import bisect
+import cProfile
+import threading
+from contextlib import contextmanager, nullcontext
+
+ENABLED = os.environ.get('PERRA_METRICS', '') not in ('', '0')
+PROFILE_EVERY = int(os.environ.get('PERRA_PROFILE_EVERY', '0'))
+PROFILE_DIR = os.environ.get('PERRA_PROFILE_DIR', 'profiles')
+
+# Границы корзин гистограмм, в секундах
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Гистограмма длительностей с фиксированными корзинами"""
+
+    __slots__ = ('counts', 'total', 'count', 'lock')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self.lock:
+            self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+            self.total += seconds
+            self.count += 1
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.counts), self.total, self.count
+
+
+_lock = threading.Lock()
+_requests = {}      # (method, route, status) -> Histogram
+_phases = {}        # phase -> Histogram
+_io_bytes = {}      # (file, direction) -> байты
+
+
+def _histogram(table, key):
+    histogram = table.get(key)
+    if histogram is None:
+        with _lock:
+            histogram = table.setdefault(key, Histogram())
+    return histogram
+
+
+def observe_request(method, route, status, seconds):
+    """Длительность обработки запроса целиком"""
+    _histogram(_requests, (method, route, status)).observe(seconds)
+
+
+def observe_phase(name, seconds):
+    _histogram(_phases, name).observe(seconds)
+
+
+@contextmanager
+def _timed_phase(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_phase(name, time.perf_counter() - start)
+
+
+_NOOP = nullcontext()
+
+
+def phase(name):
+    """Замер фазы: with metrics.phase('load_chat'): ...
+    Когда замеры выключены, это пустой контекст без накладных расходов"""
+    if ENABLED:
+        return _timed_phase(name)
+    return _NOOP
+
+
+def count_io(file, direction, size):
+    """Учитывает прочитанные (direction='read') или записанные байты"""
+    if ENABLED and size:
+        key = (file, direction)
+        with _lock:
+            _io_bytes[key] = _io_bytes.get(key, 0) + size
+
+
+def _labels(**labels):
+    return ','.join(f'{key}="{value}"' for key, value in labels.items())
+
+
+def _render_histogram(lines, name, labels, histogram):
+    counts, total, count = histogram.snapshot()
+    cumulative = 0
+    for bound, bucket_count in zip(BUCKETS, counts):
+        cumulative += bucket_count
+        lines.append(f'{name}_bucket{{{_labels(**labels, le=bound)}}} {cumulative}')
+    lines.append(f'{name}_bucket{{{_labels(**labels, le="+Inf")}}} {count}')
+    lines.append(f'{name}_sum{{{_labels(**labels)}}} {total:.6f}')
+    lines.append(f'{name}_count{{{_labels(**labels)}}} {count}')
+
+
+def render(gauges=None):
+    """Всё собранное в текстовом формате Prometheus.
+    gauges - дополнительные значения {имя: число} от вызывающего"""
+    lines = [
+        '# HELP perra_request_duration_seconds Время обработки запроса',
+        '# TYPE perra_request_duration_seconds histogram'
+    ]
+    for (method, route, status), histogram in sorted(_requests.items()):
+        _render_histogram(lines, 'perra_request_duration_seconds',
+                          {'method': method, 'route': route, 'status': status}, histogram)
+
+    lines += [
+        '# HELP perra_phase_duration_seconds Время отдельных фаз обработки',
+        '# TYPE perra_phase_duration_seconds histogram'
+    ]
+    for name, histogram in sorted(_phases.items()):
+        _render_histogram(lines, 'perra_phase_duration_seconds', {'phase': name}, histogram)
+
+    lines += [
+        '# HELP perra_io_bytes_total Байты, прочитанные и записанные в файлы',
+        '# TYPE perra_io_bytes_total counter'
+    ]
+    with _lock:
+        io_bytes = sorted(_io_bytes.items())
+    for (file, direction), size in io_bytes:
+        lines.append(f'perra_io_bytes_total{{{_labels(file=file, direction=direction)}}} {size}')
+
+    for name, value in (gauges or {}).items():
+        lines.append(f'# TYPE {name} gauge')
+        lines.append(f'{name} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+class RequestProfiler:
+    """Снимает cProfile с каждого every-го запроса.
+
+    Профилировщик в процессе может работать только один, поэтому если
+    предыдущий снимок ещё идёт в другом потоке, запрос просто пропускается.
+    """
+
+    def __init__(self, every, folder):
+        self.every = every
+        self.folder = folder
+        self._requests = 0
+        self._lock = threading.Lock()
+        self._busy = threading.Lock()
+
+    def start(self):
+        """Возвращает запущенный профилировщик или None, если этот запрос не выбран"""
+        with self._lock:
+            self._requests += 1
+            number = self._requests
+        if number % self.every or not self._busy.acquire(blocking=False):
+            return None
+        profile = cProfile.Profile()
+        profile.number = number
+        try:
+            profile.enable()
+        except ValueError:
+            # Уже работает другой профилировщик (например, отладчик)
+            self._busy.release()
+            return None
+        return profile
+
+    def stop(self, profile, route):
+        profile.disable()
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            name = route.strip('/').replace('/', '_').replace('<', '').replace('>', '') or 'index'
+            profile.dump_stats(os.path.join(self.folder, f'{name}-{profile.number}.prof'))
+        finally:
+            self._busy.release()
+
+
+profiler = RequestProfiler(PROFILE_EVERY, PROFILE_DIR) if ENABLED and PROFILE_EVERY > 0 else None
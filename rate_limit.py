@@ -0,0 +1,39 @@
+# rate_limit.py - Ограничение частоты запросов по ключу (обычно IP клиента)
+#
+# Алгоритм token bucket: у каждого ключа ведро на burst жетонов, которое
+# пополняется со скоростью rate жетонов в секунду. Ведра хранятся в памяти
+# процесса, поэтому при нескольких воркерах лимит действует на каждый отдельно.
+
+import time
+import threading
+from collections import OrderedDict
+
+
+class RateLimiter:
+    """Token bucket на ключ. Помнит не больше max_keys ключей: самые давние
+    вытесняются, и их ведро при следующем запросе начинается полным"""
+
+    def __init__(self, rate, burst, max_keys=10000):
+        if rate <= 0 or burst < 1:
+            raise ValueError(f'Лимит должен быть положительным: rate={rate}, burst={burst}')
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()   # ключ -> (жетоны, время последнего запроса)
+        self._lock = threading.Lock()
+
+    def acquire(self, key):
+        """Возвращает 0, если запрос разрешён, иначе через сколько секунд повторить"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, stamp = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - stamp) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / self.rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
@@ -0,0 +1,331 @@
+# search_index.py - Полнотекстовый поиск по сохранённым чатам
+#
+# Обратный индекс - таблица FTS5 в отдельной базе SQLite (search.db). В неё
+# попадают не сами слова, а их основы: текст приводится к нижнему регистру,
+# ё становится е, а от русских и английских слов отрезаются типичные
+# окончания. Запрос разбирается так же и ищет основы по префиксу, поэтому
+# «котами» находит «кот», «кота» и «коту». Исходный текст лежит рядом в
+# обычной таблице - из него собираются отрывки с подсветкой. Имя собеседника
+# индексируется в своей таблице FTS5 один раз на чат, а не в каждом
+# сообщении: иначе поиск по имени перебирал бы все сообщения всех гостей.
+#
+# Индекс дописывается на каждое новое сообщение. Чаты, сохранённые до
+# включения поиска, индексируются командой python manage.py index-chats.
+
+import re
+import json
+from html import escape
+
+import metrics
+from chat_storage import SqliteDatabase
+
+SEARCH_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS search_chats (
+    id INTEGER PRIMARY KEY,
+    chat_id TEXT NOT NULL UNIQUE,
+    user_name TEXT NOT NULL,
+    names TEXT NOT NULL,
+    message_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS search_messages (
+    id INTEGER PRIMARY KEY,
+    chat INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    sender TEXT NOT NULL,
+    time TEXT NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_search_messages_chat ON search_messages (chat);
+CREATE VIRTUAL TABLE IF NOT EXISTS search_terms USING fts5(terms, tokenize='unicode61');
+CREATE VIRTUAL TABLE IF NOT EXISTS search_names USING fts5(names, tokenize='unicode61');
+'''
+
+WORD_RE = re.compile(r'[0-9a-zа-яё]+', re.IGNORECASE)
+
+# Окончания, которые отрезаются от слова, длинные раньше коротких.
+# Это не полноценный стеммер, а лёгкая обрезка: основа не короче MIN_STEM
+RU_REFLEXIVE = ('ся', 'сь')
+RU_ENDINGS = sorted((
+    'ами', 'ями', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ешь', 'ишь', 'ете', 'ите', 'ать', 'ять',
+    'ить', 'еть', 'ость', 'ов', 'ев', 'ей', 'ой', 'ий', 'ый', 'ая', 'яя', 'ое', 'ее', 'ую', 'юю',
+    'ом', 'ем', 'ам', 'ям', 'ах', 'ях', 'ых', 'их', 'ет', 'ит', 'ут', 'ют', 'ат', 'ят', 'ла', 'ло',
+    'ли', 'ть', 'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й', 'л'
+), key=len, reverse=True)
+EN_ENDINGS = ('ing', 'ies', 'es', 'ed', 'ly', 's')
+MIN_STEM = 3
+
+MAX_QUERY_TERMS = 10
+SNIPPET_WORDS = 16
+# bm25 считается по всем совпадениям, и на частых словах это сотни тысяч
+# строк. Поэтому ранжируются только RANK_WINDOW самых свежих совпадений:
+# найти границу окна по rowid FTS5 умеет быстро
+RANK_WINDOW = 5000
+# Вклад в счёт каждого слова запроса, найденного в имени собеседника
+# (bm25 совпадения в тексте обычно от 1 до 10)
+NAME_WEIGHT = 0.5
+
+
+def stem(word):
+    """Основа слова (word - уже в нижнем регистре)"""
+    word = word.replace('ё', 'е')
+    if word.isdigit():
+        return word
+    if 'а' <= word[0] <= 'я':
+        for ending in RU_REFLEXIVE:
+            if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+                word = word[:-len(ending)]
+                break
+        endings = RU_ENDINGS
+    else:
+        endings = EN_ENDINGS
+    for ending in endings:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+def stems(text):
+    return [stem(word.lower()) for word in WORD_RE.findall(text)]
+
+
+def term_expression(term):
+    """Слово - по префиксу, число - точно. Основы состоят только из букв
+    и цифр, так что кавычки безопасны"""
+    return f'"{term}"' if term.isdigit() else f'"{term}"*'
+
+
+def term_matches(term, word_stem):
+    return word_stem == term if term.isdigit() else word_stem.startswith(term)
+
+
+def query_terms(query):
+    return list(dict.fromkeys(stems(query)))[:MAX_QUERY_TERMS]
+
+
+def match_query(terms, operator='AND'):
+    """Выражение MATCH для FTS5 из основ запроса"""
+    return f' {operator} '.join(term_expression(term) for term in terms)
+
+
+def make_snippet(text, terms, words=SNIPPET_WORDS):
+    """Отрывок текста вокруг первого совпадения, совпадения - в <mark>.
+    Возвращает безопасный HTML"""
+    tokens = list(WORD_RE.finditer(text))
+    hits = [i for i, token in enumerate(tokens)
+            if any(term_matches(term, stem(token.group().lower())) for term in terms)]
+    first = hits[0] if hits else 0
+    start = max(0, first - words // 3)
+    end = min(len(tokens), start + words)
+    begin = tokens[start].start() if tokens and start > 0 else 0
+    finish = tokens[end - 1].end() if tokens and end < len(tokens) else len(text)
+    parts = ['…'] if begin > 0 else []
+    position = begin
+    for i in hits:
+        if start <= i < end:
+            token = tokens[i]
+            parts.append(escape(text[position:token.start()]))
+            parts.append(f'<mark>{escape(token.group())}</mark>')
+            position = token.end()
+    parts.append(escape(text[position:finish]))
+    if finish < len(text):
+        parts.append('…')
+    return ''.join(parts)
+
+
+def plain_cursor(conn):
+    """Курсор с кортежами вместо sqlite3.Row - для длинных выборок"""
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    return cursor
+
+
+class SearchIndex:
+    """Обратный индекс сообщений всех чатов. Текст сообщений индексируется
+    построчно, а имя собеседника - один раз на чат"""
+
+    def __init__(self, path):
+        self.db = SqliteDatabase(path, SEARCH_SCHEMA)
+
+    def _chat_row(self, conn, chat_id, user_name, added):
+        """Номер чата в индексе; заводит чат и обновляет имя при нужде"""
+        names = ' '.join(stems(user_name))
+        cursor = conn.execute('INSERT OR IGNORE INTO search_chats (chat_id, user_name, names) VALUES (?, ?, ?)',
+                              (chat_id, user_name, names))
+        if cursor.rowcount:
+            chat = cursor.lastrowid
+            conn.execute('INSERT INTO search_names (rowid, names) VALUES (?, ?)', (chat, names))
+        else:
+            chat, old_name = conn.execute('SELECT id, user_name FROM search_chats WHERE chat_id = ?',
+                                          (chat_id,)).fetchone()
+            if old_name != user_name:
+                conn.execute('UPDATE search_chats SET user_name = ?, names = ? WHERE id = ?',
+                             (user_name, names, chat))
+                conn.execute('UPDATE search_names SET names = ? WHERE rowid = ?', (names, chat))
+        conn.execute('UPDATE search_chats SET message_count = message_count + ? WHERE id = ?',
+                     (added, chat))
+        return chat
+
+    def add(self, chat_id, user_name, messages):
+        """Индексирует новые сообщения (с полем seq)"""
+        conn = self.db.connect()
+        with metrics.phase('search_index'), conn:
+            chat = self._chat_row(conn, chat_id, user_name or '', len(messages))
+            for message in messages:
+                cursor = conn.execute(
+                    '''INSERT INTO search_messages (chat, seq, sender, time, text)
+                       VALUES (?, ?, ?, ?, ?)''',
+                    (chat, message['seq'], message['sender'], message['time'], message['text'])
+                )
+                conn.execute('INSERT INTO search_terms (rowid, terms) VALUES (?, ?)',
+                             (cursor.lastrowid, ' '.join(stems(message['text']))))
+
+    def remove_chat(self, chat_id, conn=None):
+        if conn is None:
+            conn = self.db.connect()
+            with conn:
+                return self.remove_chat(chat_id, conn)
+        row = conn.execute('SELECT id FROM search_chats WHERE chat_id = ?', (chat_id,)).fetchone()
+        if row is None:
+            return
+        conn.execute('DELETE FROM search_terms WHERE rowid IN (SELECT id FROM search_messages WHERE chat = ?)',
+                     (row[0],))
+        conn.execute('DELETE FROM search_messages WHERE chat = ?', (row[0],))
+        conn.execute('DELETE FROM search_names WHERE rowid = ?', (row[0],))
+        conn.execute('DELETE FROM search_chats WHERE id = ?', (row[0],))
+
+    def reindex_chat(self, chat_data):
+        """Заново индексирует чат целиком"""
+        messages = [dict(message, seq=seq) for seq, message in enumerate(chat_data['messages'], 1)]
+        self.remove_chat(chat_data['chat_id'])
+        self.add(chat_data['chat_id'], chat_data['user_name'], messages)
+
+    def _text_hits(self, conn, terms, limit=-1, offset=0):
+        """[(сообщение, bm25)] лучшие сначала - сообщения, где в тексте есть
+        все слова запроса, среди RANK_WINDOW самых свежих таких сообщений"""
+        expression = match_query(terms)
+        window = conn.execute(
+            '''SELECT rowid FROM search_terms WHERE search_terms MATCH ?
+               ORDER BY rowid DESC LIMIT 1 OFFSET ?''',
+            (expression, RANK_WINDOW - 1)
+        ).fetchone()
+        return plain_cursor(conn).execute(
+            '''SELECT rowid, bm25(search_terms) AS score FROM search_terms
+               WHERE search_terms MATCH ? AND rowid >= ?
+               ORDER BY score, rowid DESC LIMIT ? OFFSET ?''',
+            (expression, window[0] if window else 0, limit, offset)
+        ).fetchall()
+
+    def _name_groups(self, conn, terms):
+        """Чаты, в имени которых есть хоть одно слово запроса, сгруппированные
+        по словам, которых в имени нет: {(остальные слова): {чат: (счёт, сообщений)}}"""
+        groups = {}
+        rests = {}
+        rows = plain_cursor(conn).execute(
+            '''SELECT c.id, c.names, c.message_count
+               FROM search_names n JOIN search_chats c ON c.id = n.rowid
+               WHERE search_names MATCH ?''',
+            (match_query(terms, 'OR'),)
+        )
+        for chat, names, message_count in rows:
+            # У многих чатов одно и то же имя - разбираем каждое один раз
+            rest = rests.get(names)
+            if rest is None:
+                name_stems = names.split()
+                rest = rests[names] = tuple(
+                    term for term in terms
+                    if not any(term_matches(term, name_stem) for name_stem in name_stems))
+            score = -NAME_WEIGHT * (len(terms) - len(rest))
+            groups.setdefault(rest, {})[chat] = (score, message_count)
+        return groups
+
+    def _newest_in_chats(self, conn, chats):
+        """RANK_WINDOW самых свежих сообщений чатов: [(сообщение, чат)]"""
+        total = sum(message_count for _, message_count in chats.values())
+        everything = conn.execute('SELECT max(id) FROM search_messages').fetchone()[0] or 0
+        if total <= RANK_WINDOW or total < RANK_WINDOW * everything / total:
+            # Чатов мало - читаем их сообщения по индексу
+            return plain_cursor(conn).execute(
+                '''SELECT id, chat FROM search_messages WHERE chat IN (SELECT value FROM json_each(?))
+                   ORDER BY id DESC LIMIT ?''',
+                (json.dumps(list(chats)), RANK_WINDOW)
+            ).fetchall()
+        # Чатов много - идём по всем сообщениям с конца, пока не наберём окно
+        found = []
+        for message, chat in plain_cursor(conn).execute('SELECT id, chat FROM search_messages ORDER BY id DESC'):
+            if chat in chats:
+                found.append((message, chat))
+                if len(found) == RANK_WINDOW:
+                    break
+        return found
+
+    def _matching_in_chats(self, conn, terms, chats):
+        """Сообщения чатов, где в тексте есть все слова terms: [(сообщение, чат)].
+        В небольших чатах ищутся все такие сообщения, иначе - среди
+        RANK_WINDOW самых свежих совпадений terms"""
+        expression = match_query(terms)
+        total = sum(message_count for _, message_count in chats.values())
+        if total <= RANK_WINDOW:
+            # Пересекаем сообщения чатов со списком совпадений - без bm25 он читается быстро
+            in_chats = dict(plain_cursor(conn).execute(
+                'SELECT id, chat FROM search_messages WHERE chat IN (SELECT value FROM json_each(?))',
+                (json.dumps(list(chats)),)
+            ).fetchall())
+            if not in_chats:
+                return []
+            matching = plain_cursor(conn).execute(
+                'SELECT rowid FROM search_terms WHERE search_terms MATCH ? AND rowid >= ?',
+                (expression, min(in_chats)))
+            return [(message, in_chats[message]) for message, in matching if message in in_chats]
+        found = plain_cursor(conn).execute(
+            '''SELECT m.id, m.chat FROM (SELECT rowid FROM search_terms WHERE search_terms MATCH ?
+                                          ORDER BY rowid DESC LIMIT ?) AS t
+               JOIN search_messages m ON m.id = t.rowid''',
+            (expression, RANK_WINDOW)
+        )
+        return [(message, chat) for message, chat in found if chat in chats]
+
+    def search(self, query, limit=20, offset=0):
+        """Сообщения, подходящие под запрос, лучшие сначала. Каждое слово
+        запроса должно найтись в тексте сообщения или в имени собеседника.
+        Текстовые совпадения ранжируются bm25 среди RANK_WINDOW самых свежих,
+        каждое слово, найденное в имени, добавляет NAME_WEIGHT.
+        Возвращает (результаты, есть ли ещё)"""
+        terms = query_terms(query)
+        if not terms or offset >= RANK_WINDOW:
+            return [], False
+        limit = min(limit, RANK_WINDOW - offset)
+        conn = self.db.connect()
+        with metrics.phase('search'):
+            groups = self._name_groups(conn, terms)
+            if not groups:
+                # В именах совпадений нет - bm25 и страница прямо в SQLite
+                ranked = self._text_hits(conn, terms, limit + 1, offset)
+                page, has_more = ranked[:limit], len(ranked) > limit
+            else:
+                scores = dict(self._text_hits(conn, terms))
+                for rest, chats in groups.items():
+                    if rest:
+                        found = self._matching_in_chats(conn, rest, chats)
+                    else:
+                        found = self._newest_in_chats(conn, chats)
+                    for message, chat in found:
+                        scores[message] = scores.get(message, 0) + chats[chat][0]
+                # При равном счёте - свежие раньше
+                ranked = sorted(scores.items(), key=lambda item: (item[1], -item[0]))[:RANK_WINDOW]
+                page, has_more = ranked[offset:offset + limit], len(ranked) > offset + limit
+            rows = {row['id']: row for row in conn.execute(
+                '''SELECT m.id, c.chat_id, m.seq, c.user_name, m.sender, m.time, m.text
+                   FROM search_messages m JOIN search_chats c ON c.id = m.chat
+                   WHERE m.id IN (SELECT value FROM json_each(?))''',
+                (json.dumps([message for message, _ in page]),)
+            )}
+        results = [{
+            'chat_id': rows[message]['chat_id'],
+            'seq': rows[message]['seq'],
+            'user_name': rows[message]['user_name'],
+            'sender': rows[message]['sender'],
+            'time': rows[message]['time'],
+            'snippet': make_snippet(rows[message]['text'], terms),
+            'score': round(-score, 4)
+        } for message, score in page if message in rows]
+        return results, has_more
@@ -0,0 +1,121 @@
+// embed-widget.js - Окно чата Пэрры для чужих сайтов. Загружается из embed.js.
+(function () {
+    const embed = window.PerraEmbed;
+    let chatWindow = null;
+    let messagesDiv = null;
+    let input = null;
+
+    function currentTime() {
+        return new Date().toLocaleTimeString('ru-RU', { hour: '2-digit', minute: '2-digit' });
+    }
+
+    function addMessage(text, sender, time) {
+        const div = document.createElement('div');
+        div.className = `perra-message perra-${sender}-message`;
+        const body = document.createElement('span');
+        body.textContent = text;
+        const stamp = document.createElement('div');
+        stamp.className = 'perra-timestamp';
+        stamp.textContent = time;
+        div.append(body, stamp);
+        messagesDiv.appendChild(div);
+        messagesDiv.scrollTop = messagesDiv.scrollHeight;
+        return div;
+    }
+
+    async function send() {
+        const message = input.value.trim();
+        if (!message) return;
+        const time = currentTime();
+        addMessage(message, 'user', time);
+        input.value = '';
+
+        const typing = document.createElement('div');
+        typing.className = 'perra-typing';
+        typing.textContent = 'Пэрра печатает...';
+        messagesDiv.appendChild(typing);
+        messagesDiv.scrollTop = messagesDiv.scrollHeight;
+
+        let reply;
+        try {
+            // text/plain - чтобы браузер не делал лишний preflight-запрос
+            const response = await fetch(embed.base + '/api/embed/chat', {
+                method: 'POST',
+                headers: { 'Content-Type': 'text/plain' },
+                body: JSON.stringify({ message: message })
+            });
+            if (response.status === 429) {
+                reply = 'Притормози! Я не успеваю тебя игнорировать 😤';
+            } else {
+                reply = (await response.json()).response;
+            }
+        } catch (error) {
+            reply = 'Ошибка связи. Но я всё равно ничего не сделаю! 😜';
+        }
+        typing.remove();
+        addMessage(reply, 'bot', time);
+    }
+
+    function makeDraggable(header) {
+        let offsetX = 0;
+        let offsetY = 0;
+        let dragging = false;
+        header.addEventListener('mousedown', e => {
+            dragging = true;
+            offsetX = e.clientX - chatWindow.offsetLeft;
+            offsetY = e.clientY - chatWindow.offsetTop;
+        });
+        document.addEventListener('mousemove', e => {
+            if (!dragging) return;
+            e.preventDefault();
+            chatWindow.style.left = (e.clientX - offsetX) + 'px';
+            chatWindow.style.top = (e.clientY - offsetY) + 'px';
+            chatWindow.style.right = 'auto';
+            chatWindow.style.bottom = 'auto';
+        });
+        document.addEventListener('mouseup', () => { dragging = false; });
+    }
+
+    function build(container) {
+        chatWindow = document.createElement('div');
+        chatWindow.className = 'perra-chat-window';
+
+        const header = document.createElement('div');
+        header.className = 'perra-chat-header';
+        const title = document.createElement('span');
+        title.textContent = 'Чат с Пэррой 🤖';
+        const close = document.createElement('button');
+        close.className = 'perra-chat-close';
+        close.textContent = '✕';
+        close.addEventListener('click', () => toggle(container));
+        header.append(title, close);
+
+        messagesDiv = document.createElement('div');
+        messagesDiv.className = 'perra-chat-messages';
+
+        const inputRow = document.createElement('div');
+        inputRow.className = 'perra-chat-input';
+        input = document.createElement('input');
+        input.type = 'text';
+        input.placeholder = 'Напиши сообщение...';
+        input.addEventListener('keypress', e => { if (e.key === 'Enter') send(); });
+        const button = document.createElement('button');
+        button.textContent = '➤';
+        button.addEventListener('click', send);
+        inputRow.append(input, button);
+
+        chatWindow.append(header, messagesDiv, inputRow);
+        container.appendChild(chatWindow);
+        addMessage('Привет! Я Пэрра - бот с характером! Команды не выполняю, домашку не решаю. Что хотел? 😎',
+                   'bot', 'только что');
+        makeDraggable(header);
+    }
+
+    function toggle(container) {
+        if (!chatWindow) build(container);
+        chatWindow.style.display = chatWindow.style.display === 'flex' ? 'none' : 'flex';
+        if (chatWindow.style.display === 'flex') input.focus();
+    }
+
+    embed.widget = { toggle: toggle };
+})();
@@ -0,0 +1,48 @@
+// embed.js - Загрузчик виджета Пэрры для чужих сайтов.
+// Рисует только кнопку; окно чата, его стили и код грузятся при первом нажатии.
+(function () {
+    if (window.PerraEmbed) return;
+    const script = document.currentScript;
+    const base = new URL(script.src, location.href).origin;
+    const embed = window.PerraEmbed = { base: base, widget: null };
+    let loading = null;
+
+    function loadWidget() {
+        if (!loading) {
+            loading = new Promise((resolve, reject) => {
+                const css = document.createElement('link');
+                css.rel = 'stylesheet';
+                css.href = base + '/static/embed-widget.css';
+                document.head.appendChild(css);
+                const js = document.createElement('script');
+                js.src = base + '/static/embed-widget.js';
+                js.async = true;
+                js.onload = () => resolve(embed.widget);
+                js.onerror = () => { loading = null; reject(); };
+                document.head.appendChild(js);
+            });
+        }
+        return loading;
+    }
+
+    function mount() {
+        const container = document.createElement('div');
+        container.id = 'perra-chat-container';
+        container.style.cssText = 'position: fixed; bottom: 20px; right: 20px; z-index: 9999;';
+        const button = document.createElement('div');
+        button.className = 'perra-chat-button';
+        button.style.cssText = 'width: 60px; height: 60px; border-radius: 50%; cursor: pointer; display: flex; ' +
+            'align-items: center; justify-content: center; font-size: 30px; border: 2px solid white; ' +
+            'background: linear-gradient(145deg, #38bdf8, #0284c7); box-shadow: 0 5px 20px rgba(2, 132, 199, 0.5);';
+        button.textContent = '🤖';
+        button.addEventListener('click', () => loadWidget().then(widget => widget.toggle(container)));
+        container.appendChild(button);
+        document.body.appendChild(container);
+    }
+
+    if (document.readyState === 'loading') {
+        document.addEventListener('DOMContentLoaded', mount);
+    } else {
+        mount();
+    }
+})();
@@ -0,0 +1,276 @@
+// PWA Service Worker Registration
+if ('serviceWorker' in navigator) {
+    window.addEventListener('load', () => {
+        navigator.serviceWorker.register('/sw.js')
+            .then(reg => console.log('✅ PWA ready!'))
+            .catch(err => console.log('❌ PWA error:', err));
+        // Старый worker из /static/sw.js больше не нужен
+        navigator.serviceWorker.getRegistrations().then(registrations => registrations
+            .filter(reg => reg.active && reg.active.scriptURL.endsWith('/static/sw.js'))
+            .forEach(reg => reg.unregister()));
+        caches.delete('perra-cache-v1');
+    });
+}
+
+function setUserName() {
+    const name = document.getElementById('userName').value.trim();
+    if (name) {
+        fetch('/set_username', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ name: name })
+        }).then(() => {
+            showNotification('✅ Имя сохранено!');
+        });
+    }
+}
+
+async function sendMessage() {
+    const input = document.getElementById('messageInput');
+    const message = input.value.trim();
+    if (!message) return;
+
+    const messagesDiv = document.getElementById('chatMessages');
+    const currentTime = new Date().toLocaleTimeString('ru-RU', { hour: '2-digit', minute: '2-digit' });
+
+    const userDiv = messageElement({ sender: 'user', text: message, time: currentTime });
+    messagesDiv.appendChild(userDiv);
+    input.value = '';
+
+    const typing = document.createElement('div');
+    typing.className = 'typing-indicator';
+    typing.id = 'typingIndicator';
+    typing.textContent = 'Пэрра печатает...';
+    messagesDiv.appendChild(typing);
+    messagesDiv.scrollTop = messagesDiv.scrollHeight;
+
+    try {
+        const response = await fetch('/api/v2/chat/stream', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ 
+                message: message,
+                chat_id: currentChatId
+            })
+        });
+
+        // Ответ приходит по словам - дописываем их в сообщение по мере прихода
+        let botDiv = null;
+        let botText = null;
+        let data = null;
+        await readEventStream(response, (event, payload) => {
+            if (event === 'token') {
+                if (!botText) {
+                    document.getElementById('typingIndicator')?.remove();
+                    botDiv = messageElement({ sender: 'bot', text: '', time: currentTime });
+                    botText = botDiv.firstChild;
+                    messagesDiv.appendChild(botDiv);
+                }
+                botText.textContent += payload.text;
+                messagesDiv.scrollTop = messagesDiv.scrollHeight;
+            } else if (event === 'done') {
+                data = payload;
+            }
+        });
+        document.getElementById('typingIndicator')?.remove();
+
+        // Если в чат писали из другой вкладки - догружаем пропущенное
+        const [userMsg, botMsg] = data.messages;
+        if (userMsg.seq - 1 !== lastSeq || botMsg.seq !== userMsg.seq + 1) {
+            await resyncMessages();
+        } else {
+            userDiv.dataset.seq = userMsg.seq;
+            botDiv.dataset.seq = botMsg.seq;
+            lastSeq = data.seq;
+        }
+
+    } catch (error) {
+        document.getElementById('typingIndicator')?.remove();
+        messagesDiv.innerHTML += `<div class="message bot-message">Ошибка связи. Но я всё равно ничего не сделаю! 😜<div style="font-size: 10px; color: #94a3b8; margin-top: 5px;">${currentTime}</div></div>`;
+    }
+}
+
+async function readEventStream(response, onEvent) {
+    // Разбор server-sent events из тела fetch-ответа
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const chunk = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            let event = 'message';
+            let data = '';
+            chunk.split('\n').forEach(line => {
+                if (line.startsWith('event: ')) event = line.slice(7);
+                else if (line.startsWith('data: ')) data += line.slice(6);
+            });
+            onEvent(event, JSON.parse(data));
+        }
+    }
+}
+
+async function resyncMessages() {
+    // Убираем ещё не сохранённые сообщения и дописываем всё после lastSeq в порядке сервера.
+    // Если пропущено больше страницы, историю не листаем - рисуем хвост чата заново
+    const messagesDiv = document.getElementById('chatMessages');
+    messagesDiv.querySelectorAll('.message:not([data-seq])').forEach(div => div.remove());
+    const response = await fetch(`/api/chats/${currentChatId}/messages?after=${lastSeq}`);
+    const data = await response.json();
+    if (data.next_after !== null) {
+        await renderTail();
+        return;
+    }
+    data.messages.forEach(msg => {
+        messagesDiv.appendChild(messageElement(msg));
+        lastSeq = msg.seq;
+    });
+    messagesDiv.scrollTop = messagesDiv.scrollHeight;
+}
+
+async function renderTail() {
+    const response = await fetch(`/api/chats/${currentChatId}/messages?before=0`);
+    const data = await response.json();
+    const messagesDiv = document.getElementById('chatMessages');
+    messagesDiv.querySelectorAll('.message').forEach(div => div.remove());
+    data.messages.forEach(msg => messagesDiv.appendChild(messageElement(msg)));
+    lastSeq = data.messages.length ? data.messages[data.messages.length - 1].seq : 0;
+    historyBefore = data.next_before;
+    messagesDiv.scrollTop = messagesDiv.scrollHeight;
+}
+
+function messageElement(msg) {
+    const div = document.createElement('div');
+    div.className = `message ${msg.sender === 'user' ? 'user-message' : 'bot-message'}`;
+    if (msg.seq) div.dataset.seq = msg.seq;
+    const text = document.createElement('span');
+    text.textContent = msg.text;
+    const time = document.createElement('div');
+    time.style.cssText = 'font-size: 10px; color: #94a3b8; margin-top: 5px;';
+    time.textContent = msg.time;
+    div.append(text, time);
+    return div;
+}
+
+// Старая история подгружается, когда чат прокручивают к началу
+let loadingHistory = false;
+
+async function loadOlderMessages() {
+    if (historyBefore === null || loadingHistory) return;
+    loadingHistory = true;
+    try {
+        const response = await fetch(`/api/chats/${currentChatId}/messages?before=${historyBefore}&limit=50`);
+        const data = await response.json();
+        const messagesDiv = document.getElementById('chatMessages');
+        const fromBottom = messagesDiv.scrollHeight - messagesDiv.scrollTop;
+        const older = document.createDocumentFragment();
+        data.messages.forEach(msg => older.appendChild(messageElement(msg)));
+        messagesDiv.prepend(older);
+        // Не даём содержимому прыгнуть под пальцем
+        messagesDiv.scrollTop = messagesDiv.scrollHeight - fromBottom;
+        historyBefore = data.next_before;
+    } finally {
+        loadingHistory = false;
+    }
+}
+
+document.addEventListener('DOMContentLoaded', () => {
+    if (!currentChatId) bootShell();
+    const messagesDiv = document.getElementById('chatMessages');
+    messagesDiv.scrollTop = messagesDiv.scrollHeight;
+    messagesDiv.addEventListener('scroll', () => {
+        if (messagesDiv.scrollTop < 100) loadOlderMessages();
+    });
+});
+
+function newChat() {
+    fetch('/new_chat', {
+        method: 'POST'
+    }).then(response => response.json())
+      .then(data => {
+          window.location.href = `/?chat_id=${data.chat_id}`;
+      });
+}
+
+function loadChat(chatId) {
+    window.location.href = `/?chat_id=${chatId}`;
+}
+
+async function loadMoreChats() {
+    const button = document.getElementById('moreChatsBtn');
+    const response = await fetch(`/api/chats?cursor=${encodeURIComponent(button.dataset.cursor)}`);
+    showChats(await response.json());
+}
+
+function showChats(data) {
+    // Дописывает страницу чатов в боковую панель и обновляет кнопку «Показать ещё»
+    const chatList = document.getElementById('chatList');
+    data.chats.forEach(chat => {
+        chatList.innerHTML += `<div class="chat-item" onclick="loadChat('${chat.id}')"><div class="chat-name">${escapeHtml(chat.user_name)}</div><div class="chat-date">${chat.last_updated}</div><div class="chat-count">${chat.message_count} сообщений</div></div>`;
+    });
+
+    let button = document.getElementById('moreChatsBtn');
+    if (data.next_cursor) {
+        if (!button) {
+            button = document.createElement('button');
+            button.className = 'more-chats-btn';
+            button.id = 'moreChatsBtn';
+            button.textContent = 'Показать ещё';
+            button.onclick = loadMoreChats;
+            chatList.after(button);
+        }
+        button.dataset.cursor = data.next_cursor;
+    } else if (button) {
+        button.remove();
+    }
+}
+
+const CHAT_ID_RE = /^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$/;
+
+async function bootShell() {
+    // Страница пришла оболочкой из service worker: имя, список чатов и
+    // сам чат берём из API. Новый чат, как и на сервере, живёт только в странице
+    const requested = new URLSearchParams(location.search).get('chat_id') || '';
+    currentChatId = CHAT_ID_RE.test(requested) ? requested : crypto.randomUUID();
+    const [session, chats] = await Promise.all([
+        fetch('/api/session').then(response => response.json()),
+        fetch('/api/chats').then(response => response.json()),
+        renderTail()
+    ]);
+    document.getElementById('userName').value = session.user_name;
+    showChats(chats);
+}
+
+function saveCurrentChat() {
+    fetch('/save_chat', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ chat_id: currentChatId })
+    }).then(() => {
+        showNotification('✅ Чат сохранён!');
+        setTimeout(() => location.reload(), 1000);
+    });
+}
+
+function copyEmbedCode() {
+    const codeElement = document.getElementById('embedCode');
+    navigator.clipboard.writeText(codeElement.textContent).then(() => {
+        alert('✅ Код скопирован!');
+    });
+}
+
+function escapeHtml(unsafe) {
+    return unsafe.replace(/&/g, "&amp;").replace(/</g, "&lt;").replace(/>/g, "&gt;");
+}
+
+function showNotification(text) {
+    const div = document.createElement('div');
+    div.className = 'flash flash-success';
+    div.textContent = text;
+    document.querySelector('.container').insertBefore(div, document.querySelector('.main-content'));
+    setTimeout(() => div.remove(), 3000);
+}
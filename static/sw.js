@@ -1,19 +1,11 @@
-const CACHE_NAME = 'perra-cache-v1';
-const urlsToCache = [
-  '/',
-  '/static/1000162143-fotor-bg-remover-2026030214294.png'
-];
+// Старый service worker жил здесь и отдавал всё из кэша perra-cache-v1.
+// Теперь он собирается приложением и отдаётся с /sw.js, а этот файл
+// только убирает за собой: чистит старый кэш и снимает регистрацию.
+self.addEventListener('install', () => self.skipWaiting());
 
-self.addEventListener('install', event => {
-  event.waitUntil(
-    caches.open(CACHE_NAME)
-      .then(cache => cache.addAll(urlsToCache))
-  );
-});
-
-self.addEventListener('fetch', event => {
-  event.respondWith(
-    caches.match(event.request)
-      .then(response => response || fetch(event.request))
-  );
+self.addEventListener('activate', event => {
+    event.waitUntil(
+        caches.delete('perra-cache-v1')
+            .then(() => self.registration.unregister())
+    );
 });
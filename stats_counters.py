@@ -0,0 +1,143 @@
+# stats_counters.py - Счётчики статистики Пэрры без файлового I/O на запросе
+
+import os
+import json
+import time
+import atexit
+import sqlite3
+import threading
+from contextlib import closing
+
+import metrics
+
+STATS_KEYS = ('visits', 'refusals', 'chat_messages', 'saved_chats')
+
+STATS_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS stats (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL DEFAULT 0
+);
+'''
+
+
+class StatsCounters:
+    """Счётчики в памяти процесса с периодическим сбросом в SQLite.
+
+    Каждый поток увеличивает только свой словарь (шард), поэтому на запросе
+    нет ни блокировок, ни обращений к диску. Фоновый поток складывает
+    накопленные приросты и одной транзакцией добавляет их в таблицу stats -
+    так счёт остаётся точным и при нескольких воркерах gunicorn. Шарды
+    завершившихся потоков после сброса выбрасываются: при потоке на запрос
+    их число не растёт со временем.
+    """
+
+    def __init__(self, db_path, json_path=None, flush_interval=5.0):
+        self.db_path = db_path
+        self.json_path = json_path
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pid = None
+        is_new = not os.path.exists(db_path)
+        with closing(self._connect()) as conn, conn:
+            conn.executescript(STATS_SCHEMA)
+            conn.executemany('INSERT OR IGNORE INTO stats (key, value) VALUES (?, 0)',
+                             [(key,) for key in STATS_KEYS])
+            if is_new and json_path and os.path.exists(json_path):
+                # Переносим старые значения из stats.json
+                with open(json_path, 'r') as f:
+                    metrics.count_io('stats.json', 'read', os.fstat(f.fileno()).st_size)
+                    old_stats = json.load(f)
+                conn.executemany('UPDATE stats SET value = ? WHERE key = ?',
+                                 [(value, key) for key, value in old_stats.items()])
+        self._totals = self._read_totals()
+        atexit.register(self.flush)
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def _read_totals(self):
+        with closing(self._connect()) as conn:
+            return dict(conn.execute('SELECT key, value FROM stats'))
+
+    def _start(self):
+        """Запускает фоновый сброс в текущем процессе (в том числе после fork)"""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._local = threading.local()
+            # Тройки (поток, шард, сколько из шарда уже сброшено)
+            self._shards = []
+            thread = threading.Thread(target=self._flush_loop, name='stats-flusher', daemon=True)
+            thread.start()
+
+    def _shard(self):
+        if self._pid != os.getpid():
+            self._start()
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = dict.fromkeys(STATS_KEYS, 0)
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard, dict.fromkeys(STATS_KEYS, 0)))
+            self._local.shard = shard
+        return shard
+
+    def incr(self, key, increment=1):
+        """Увеличивает счётчик (только в памяти)"""
+        self._shard()[key] += increment
+
+    def _take_pending(self):
+        """Собирает приросты со всех шардов с прошлого сброса и выбрасывает
+        шарды завершившихся потоков"""
+        pending = dict.fromkeys(STATS_KEYS, 0)
+        alive = []
+        # Шард меняет только его поток, поэтому запоминаем, сколько уже учтено,
+        # а не обнуляем значения. Живость проверяем до чтения: мёртвый поток
+        # шард уже не тронет, и его можно учесть целиком и забыть
+        for thread, shard, flushed in self._shards:
+            is_alive = thread.is_alive()
+            for key in STATS_KEYS:
+                value = shard[key]
+                pending[key] += value - flushed[key]
+                flushed[key] = value
+            if is_alive:
+                alive.append((thread, shard, flushed))
+        self._shards = alive
+        return pending
+
+    def flush(self):
+        """Сбрасывает накопленное в базу и обновляет stats.json"""
+        if self._pid != os.getpid():
+            return
+        with self._lock:
+            pending = self._take_pending()
+            changed = [(value, key) for key, value in pending.items() if value]
+            if changed:
+                with closing(self._connect()) as conn, conn:
+                    conn.executemany('UPDATE stats SET value = value + ? WHERE key = ?', changed)
+            self._totals = self._read_totals()
+            if self.json_path and changed:
+                # Снимок для старых читателей stats.json, запись атомарная
+                data = json.dumps(self._totals).encode('utf-8')
+                tmp_path = f'{self.json_path}.{os.getpid()}.tmp'
+                with open(tmp_path, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, self.json_path)
+                metrics.count_io('stats.json', 'write', len(data))
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print(f"⚠️ Не удалось сохранить статистику: {e}")
+
+    def snapshot(self):
+        """Текущие значения: сохранённые в базе плюс ещё не сброшенные в этом процессе"""
+        stats = dict(self._totals)
+        if self._pid == os.getpid():
+            for _, shard, flushed in self._shards:
+                for key in STATS_KEYS:
+                    stats[key] = stats.get(key, 0) + shard[key] - flushed[key]
+        return stats
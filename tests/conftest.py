@@ -0,0 +1,41 @@
+# tests/conftest.py - Общие настройки тестов
+#
+# Запуск: python -m pytest -q
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# app.py при импорте создаёт базы и папки в текущем каталоге -
+# тесты работают во временном, чтобы не трогать данные сайта. Pytest в
+# конце возвращает прежний каталог, поэтому базы - по полным путям
+WORKDIR = tempfile.mkdtemp(prefix='perra-tests-')
+os.chdir(WORKDIR)
+for name, filename in [('PERRA_STATS_DB', 'stats.db'), ('PERRA_CHATS_DB', 'chats.db'),
+                       ('PERRA_SEARCH_DB', 'search.db')]:
+    os.environ.setdefault(name, os.path.join(WORKDIR, filename))
+
+# Без фоновых потоков уборки и сброса статистики, без пауз в потоке ответа
+os.environ.setdefault('PERRA_CHAT_GC_INTERVAL', '0')
+os.environ.setdefault('PERRA_STATS_FLUSH_INTERVAL', '3600')
+os.environ.setdefault('PERRA_STREAM_TOKEN_DELAY', '0')
+os.environ.setdefault('PERRA_SEARCH', '1')
+
+
+@pytest.fixture
+def client():
+    import app
+    return app.app.test_client()
+
+
+@pytest.fixture(scope='session', autouse=True)
+def flush_stats():
+    yield
+    # Сбрасываем статистику, пока мы ещё во временном каталоге (там stats.json)
+    if 'app' in sys.modules:
+        sys.modules['app'].stats_counters.flush()
@@ -0,0 +1,49 @@
+# tests/test_batch_api.py - Пакетный API: проверка тела и порядок ответов
+
+import uuid
+
+import pytest
+
+import app
+
+BATCH_URL = '/api/v2/chat/batch'
+
+
+@pytest.mark.parametrize('body', [
+    None,
+    [],
+    {'items': []},
+    {'items': 'привет'},
+    {'items': ['привет']},
+    {'items': [{'message': 'привет'}]},
+    {'items': [{'chat_id': 42, 'message': 'привет'}]},
+    {'items': [{'chat_id': '../../etc/passwd', 'message': 'привет'}]},
+    {'items': [{'chat_id': str(uuid.uuid4()), 'message': ['привет']}]},
+])
+def test_rejects_malformed_bodies(client, body):
+    response = client.post(BATCH_URL, json=body)
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+def test_rejects_too_many_items(client, monkeypatch):
+    monkeypatch.setattr(app, 'BATCH_MAX_ITEMS', 3)
+    chat_id = str(uuid.uuid4())
+    response = client.post(BATCH_URL, json={'items': [{'chat_id': chat_id, 'message': 'привет'}] * 4})
+    assert response.status_code == 400
+    # Отклонённая пачка ничего не записала
+    assert app.chat_storage.chat_summary(chat_id) is None
+
+
+def test_results_follow_item_order(client):
+    first, second = str(uuid.uuid4()), str(uuid.uuid4())
+    items = [{'chat_id': first, 'message': 'раз'}, {'chat_id': second, 'message': 'два'},
+             {'chat_id': first, 'message': 'три'}]
+    before = app.get_stats()['chat_messages']
+    results = client.post(BATCH_URL, json={'items': items}).get_json()['results']
+    assert [result['chat_id'] for result in results] == [first, second, first]
+    assert [result['messages'][0]['text'] for result in results] == ['раз', 'два', 'три']
+    assert [result['seq'] for result in results] == [2, 2, 4]
+    assert app.get_stats()['chat_messages'] == before + 3
+    texts = [message['text'] for message in app.chat_storage.messages_after(first, 0, None)]
+    assert texts == ['раз', results[0]['response'], 'три', results[2]['response']]
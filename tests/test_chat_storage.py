@@ -0,0 +1,284 @@
+# tests/test_chat_storage.py - Хранилища чатов: параллельные дозаписи и форматы файлов
+
+import gzip
+import json
+import multiprocessing
+import os
+import threading
+import uuid
+
+import pytest
+
+from chat_storage import (CachedChatStorage, JsonChatStorage, JsonlChatStorage, create_chat_storage,
+                          encode_chat, decode_chat, convert_chat_files)
+
+BACKENDS = ['sqlite', 'json', 'jsonl']
+THREADS = 8
+TURNS = 25
+
+
+@pytest.fixture(params=BACKENDS + ['cached'])
+def storage(request, tmp_path):
+    kind = 'sqlite' if request.param == 'cached' else request.param
+    storage = create_chat_storage(kind, str(tmp_path / 'saved_chats'), str(tmp_path / 'chats.db'))
+    return CachedChatStorage(storage) if request.param == 'cached' else storage
+
+
+def turn(writer, number):
+    return [{'sender': 'user', 'text': f'{writer}:{number}', 'time': '12:00'},
+            {'sender': 'bot', 'text': f'{writer}:{number}:ответ', 'time': '12:00'}]
+
+
+def test_concurrent_appends_lose_nothing(storage):
+    chat_ids = [str(uuid.uuid4()), str(uuid.uuid4())]
+    seqs = {chat_id: [] for chat_id in chat_ids}
+    errors = []
+    start = threading.Barrier(THREADS)
+
+    def writer(number):
+        try:
+            start.wait()
+            for i in range(TURNS):
+                chat_id = chat_ids[i % 2]
+                seqs[chat_id].append(storage.append(chat_id, 'Гость', turn(number, i)))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=writer, args=(number,)) for number in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+
+    for chat_id in chat_ids:
+        messages = storage.load(chat_id)['messages']
+        expected = sum(1 for i in range(TURNS) if chat_ids[i % 2] == chat_id) * THREADS * 2
+        assert len(messages) == expected
+        # Каждая пара записана целиком и подряд, номера не повторяются
+        assert sorted(seqs[chat_id]) == list(range(2, expected + 1, 2))
+        for user, bot in zip(messages[::2], messages[1::2]):
+            assert bot['text'] == user['text'] + ':ответ'
+        # Сообщения одного писателя идут в том порядке, в каком он их писал
+        for number in range(THREADS):
+            own = [m['text'] for m in messages[::2] if m['text'].startswith(f'{number}:')]
+            assert own == sorted(own, key=lambda text: int(text.split(':')[1]))
+        page = storage.messages_after(chat_id, 0, None)
+        assert [m['seq'] for m in page] == list(range(1, expected + 1))
+
+
+def sample_chat(chat_id):
+    return {
+        'chat_id': chat_id,
+        'user_name': 'Гость_42',
+        'messages': [
+            {'sender': 'user', 'text': 'привет, "кавычки" и\nперенос', 'time': '12:00'},
+            {'sender': 'bot', 'text': 'Здарова! 😎', 'time': '12:01'},
+            {'sender': 'user', 'text': '', 'time': '7:5'},
+        ],
+        'last_updated': '2026-01-02 03:04:05'
+    }
+
+
+def test_compact_format_round_trip():
+    chat = sample_chat(str(uuid.uuid4()))
+    encoded = encode_chat(chat)
+    assert json.loads(encoded)['v'] == 2
+    assert decode_chat(encoded) == chat
+    # Старый формат с отступами читается как есть
+    assert decode_chat(json.dumps(chat, ensure_ascii=False, indent=2)) == chat
+
+
+def write_legacy(folder, chat):
+    """Чат так, как его писал сайт до хранилищ: плоская папка, JSON с отступами"""
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, chat['chat_id'] + '.json'), 'w', encoding='utf-8') as f:
+        json.dump(chat, f, ensure_ascii=False, indent=2)
+
+
+@pytest.mark.parametrize('kind', BACKENDS)
+def test_legacy_files_are_readable(tmp_path, kind):
+    folder = str(tmp_path / 'saved_chats')
+    chat = sample_chat(str(uuid.uuid4()))
+    write_legacy(folder, chat)
+    storage = create_chat_storage(kind, folder, str(tmp_path / 'chats.db'))
+    assert storage.load(chat['chat_id'])['messages'] == chat['messages']
+    assert storage.list_chats()[0][0]['id'] == chat['chat_id']
+    seq = storage.append(chat['chat_id'], 'Гость_42', turn(0, 0))
+    assert seq == len(chat['messages']) + 2
+    assert storage.load(chat['chat_id'])['messages'] == chat['messages'] + turn(0, 0)
+
+
+def test_convert_chat_files(tmp_path):
+    folder = str(tmp_path / 'saved_chats')
+    chat = sample_chat(str(uuid.uuid4()))
+    write_legacy(folder, chat)
+    JsonChatStorage(folder)     # раскладывает файлы по шардам
+    assert convert_chat_files(folder) == (1, 0)
+    assert convert_chat_files(folder) == (0, 1)
+    assert JsonChatStorage(folder).load(chat['chat_id']) == chat
+
+
+@pytest.mark.parametrize('storage_class', [JsonChatStorage, JsonlChatStorage])
+def test_cold_tier_round_trip(tmp_path, storage_class):
+    folder = str(tmp_path / 'saved_chats')
+    storage = storage_class(folder)
+    chat_id = str(uuid.uuid4())
+    storage.append(chat_id, 'Гость_42', turn(0, 0))
+    before = storage.load(chat_id)
+
+    # Отрицательный срок - все чаты считаются давно забытыми
+    assert storage.freeze_idle(-60) == 1
+    path = storage._path(chat_id)
+    assert not os.path.exists(path) and os.path.exists(path + '.gz')
+    with gzip.open(path + '.gz', 'rb') as f:
+        assert f.read()
+
+    # Холодный чат виден в списке и после перестройки индекса
+    os.remove(os.path.join(folder, 'index.db'))
+    reopened = storage_class(folder)
+    assert reopened.chat_summary(chat_id)['message_count'] == 2
+
+    # Первое обращение возвращает чат в обычный файл, дозапись продолжает номера
+    assert reopened.load(chat_id) == before
+    assert os.path.exists(path) and not os.path.exists(path + '.gz')
+    assert reopened.append(chat_id, 'Гость_42', turn(0, 1)) == 4
+    assert reopened.load(chat_id)['messages'] == before['messages'] + turn(0, 1)
+
+
+def test_jsonl_appends_write_only_messages(tmp_path, monkeypatch):
+    storage = JsonlChatStorage(str(tmp_path / 'saved_chats'), fsync_interval=None)
+    chat_id = str(uuid.uuid4())
+    compactions = []
+    monkeypatch.setattr(storage, 'compact', compactions.append)
+    monkeypatch.setattr('chat_storage.now_timestamp', lambda: '2026-01-01 00:00:00')
+    storage.append(chat_id, 'Гость', turn(0, 0))
+    for i in range(1, 200):
+        monkeypatch.setattr('chat_storage.now_timestamp', lambda: f'2026-01-01 00:{i // 60:02d}:{i % 60:02d}')
+        storage.append(chat_id, 'Гость_2', turn(0, i))
+
+    # Журнал - заголовок и сообщения, без meta на каждую дозапись и без сжатий
+    with open(storage._path(chat_id), encoding='utf-8') as f:
+        records = [json.loads(line) for line in f]
+    assert sum('meta' in record for record in records) == 1
+    assert len(records) == 1 + 400
+    assert not compactions
+
+    # Свежие метаданные берутся из индекса
+    chat = storage.load(chat_id)
+    assert chat['user_name'] == 'Гость_2'
+    assert chat['last_updated'] == '2026-01-01 00:03:19'
+    assert storage.touch(chat_id)
+    assert storage.load(chat_id)['last_updated'] == '2026-01-01 00:03:19'
+
+
+def append_from_process(kind, folder, db_path, chat_id, writer, results):
+    storage = create_chat_storage(kind, folder, db_path, fsync_interval=None)
+    for i in range(TURNS):
+        results.put((storage.append(chat_id, 'Гость', turn(writer, i)), f'{writer}:{i}'))
+
+
+@pytest.mark.parametrize('kind', BACKENDS)
+def test_seqs_match_positions_across_processes(tmp_path, kind):
+    folder, db_path = str(tmp_path / 'saved_chats'), str(tmp_path / 'chats.db')
+    chat_id = str(uuid.uuid4())
+    create_chat_storage(kind, folder, db_path, fsync_interval=None).append(chat_id, 'Гость', turn('x', 0))
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    processes = [context.Process(target=append_from_process,
+                                 args=(kind, folder, db_path, chat_id, writer, results))
+                 for writer in range(4)]
+    for process in processes:
+        process.start()
+    returned = [results.get(timeout=60) for _ in range(4 * TURNS)]
+    for process in processes:
+        process.join()
+
+    storage = create_chat_storage(kind, folder, db_path, fsync_interval=None)
+    by_seq = {m['seq']: m['text'] for m in storage.messages_after(chat_id, 0, None)}
+    assert len(by_seq) == 2 + 4 * TURNS * 2
+    # Номер, который вернула дозапись, - место её ответа бота в чате
+    for seq, text in returned:
+        assert by_seq[seq] == text + ':ответ'
+    assert [m['seq'] for m in storage.messages_before(chat_id, None, 5)] == list(range(len(by_seq) - 4,
+                                                                                      len(by_seq) + 1))
+
+
+def test_jsonl_recounts_after_a_torn_append(tmp_path):
+    storage = JsonlChatStorage(str(tmp_path / 'saved_chats'), fsync_interval=None)
+    chat_id = str(uuid.uuid4())
+    storage.append(chat_id, 'Гость', turn(0, 0))
+    # Процесс упал после записи в журнал, но до фиксации номера в индексе
+    with open(storage._path(chat_id), 'a', encoding='utf-8') as f:
+        f.writelines(json.dumps(m, ensure_ascii=False) + '\n' for m in turn(0, 1))
+
+    assert [m['seq'] for m in storage.messages_before(chat_id, None, 2)] == [3, 4]
+    assert storage.messages_before(chat_id, None, 1)[0]['text'] == '0:1:ответ'
+    assert storage.append(chat_id, 'Гость', turn(0, 2)) == 6
+    assert storage.chat_summary(chat_id)['message_count'] == 6
+    assert [m['text'] for m in storage.messages_before(chat_id, None, 2)] == ['0:2', '0:2:ответ']
+
+
+@pytest.mark.parametrize('kind', BACKENDS)
+def test_cache_misses_writes_between_append_and_stamp(tmp_path, kind):
+    folder, db_path = str(tmp_path / 'saved_chats'), str(tmp_path / 'chats.db')
+    storage = create_chat_storage(kind, folder, db_path, fsync_interval=None)
+    other = create_chat_storage(kind, folder, db_path, fsync_interval=None)   # второй воркер
+    cached = CachedChatStorage(storage)
+    chat_id = str(uuid.uuid4())
+    cached.append(chat_id, 'Гость', turn('a', 1)[:1])
+    cached.load(chat_id)
+
+    write = storage._append_batch
+
+    def write_then_race(*args):
+        stamps = write(*args)
+        # Другой воркер пишет сразу после нашей записи, до того как кэш обновится
+        other.append(chat_id, 'Гость', turn('b', 1)[:1])
+        return stamps
+
+    storage._append_batch = write_then_race
+    cached.append(chat_id, 'Гость', turn('a', 2)[:1])
+    storage._append_batch = write
+
+    expected = ['a:1', 'a:2', 'b:1']
+    assert [m['text'] for m in other.load(chat_id)['messages']] == expected
+    assert [m['text'] for m in cached.load(chat_id)['messages']] == expected
+    assert [m['text'] for m in cached.messages_after(chat_id, 0, None)] == expected
+
+
+def test_cache_extends_on_local_appends(tmp_path):
+    cached = CachedChatStorage(create_chat_storage('sqlite', str(tmp_path), str(tmp_path / 'chats.db')))
+    chat_id = str(uuid.uuid4())
+    cached.append(chat_id, 'Гость', turn(0, 0))
+    cached.load(chat_id)
+    for i in range(1, 5):
+        cached.append(chat_id, 'Гость', turn(0, i))
+    stats = cached.cache_stats()
+    assert [m['text'] for m in cached.load(chat_id)['messages']][-2:] == ['0:4', '0:4:ответ']
+    assert cached.cache_stats()['hits'] == stats['hits'] + 1
+    assert stats['invalidations'] == 0 and stats['misses'] == 1
+
+
+def test_collect_garbage_removes_only_stale_chats(storage, monkeypatch):
+    monkeypatch.setattr('chat_storage.now_timestamp', lambda: '2000-01-01 00:00:00')
+    old_empty, old_full = str(uuid.uuid4()), str(uuid.uuid4())
+    storage.save(old_empty, 'Гость', [])
+    storage.append(old_full, 'Гость', turn('x', 0))
+    monkeypatch.undo()
+    fresh_empty, fresh_full = str(uuid.uuid4()), str(uuid.uuid4())
+    storage.save(fresh_empty, 'Гость', [])
+    storage.append(fresh_full, 'Гость', turn('x', 0))
+
+    removed = []
+    assert storage.collect_garbage(empty_ttl=60, on_remove=removed.append) == 1
+    assert removed == [old_empty]
+    assert storage.load(old_empty) is None and storage.chat_summary(old_empty) is None
+    assert storage.load(fresh_empty) is not None and storage.load(old_full) is not None
+
+    # Срок простоя убирает и чаты с сообщениями
+    assert storage.collect_garbage(idle_ttl=60, on_remove=removed.append) == 1
+    assert removed == [old_empty, old_full]
+    assert storage.load(old_full) is None
+    assert [chat['id'] for chat in storage.list_chats()[0]] == [fresh_full]
+    assert storage.collect_garbage() == 0
@@ -0,0 +1,71 @@
+# tests/test_chats_api.py - Боковая панель: страницы чатов по курсору
+
+import itertools
+import uuid
+
+import pytest
+
+import app
+
+
+# Каждый вызов фикстуры - в свой час, чтобы новые чаты были свежее прежних
+HOURS = itertools.count(10)
+
+
+@pytest.fixture
+def chats(monkeypatch):
+    """Пять чатов с разными last_updated; возвращает их от нового к старому"""
+    hour = next(HOURS)
+    ids = []
+    for minute in range(5):
+        chat_id = str(uuid.uuid4())
+        monkeypatch.setattr('chat_storage.now_timestamp', lambda: f'2099-01-01 {hour}:0{minute}:00')
+        app.chat_storage.append(chat_id, f'Гость_{minute}', [{'sender': 'user', 'text': 'привет', 'time': '12:00'}])
+        ids.append(chat_id)
+    return ids[::-1]
+
+
+def test_cursor_pages_cover_every_chat_once(client, chats):
+    seen = []
+    cursor = None
+    while True:
+        query = {'limit': 2} if cursor is None else {'limit': 2, 'cursor': cursor}
+        page = client.get('/api/chats', query_string=query).get_json()
+        assert len(page['chats']) <= 2
+        seen += [chat['id'] for chat in page['chats']]
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+    assert seen[:5] == chats
+    assert len(seen) == len(set(seen))
+    assert seen == [chat['id'] for chat in app.chat_storage.list_chats()[0]]
+
+
+def test_page_size_is_clamped(client, chats):
+    for limit, size in ((-1, 1), (0, 1), (3, 3), (1000, min(100, len(app.chat_storage.list_chats()[0])))):
+        assert len(client.get('/api/chats', query_string={'limit': limit}).get_json()['chats']) == size
+
+
+def test_summary_follows_appends(client, chats):
+    newest = client.get('/api/chats', query_string={'limit': 1}).get_json()['chats'][0]
+    assert newest['id'] == chats[0]
+    assert newest['user_name'] == 'Гость_4' and newest['message_count'] == 1
+    assert newest['last_updated'].endswith(':04:00')
+
+
+def test_index_renders_only_the_first_page(client, chats):
+    page = client.get('/').get_data(as_text=True)
+    total = len(app.chat_storage.list_chats()[0])
+    assert page.count('class="chat-item"') == min(total, app.SIDEBAR_PAGE_SIZE)
+    assert page.index(chats[0]) < page.index(chats[1])
+    assert ('id="moreChatsBtn"' in page) == (total > app.SIDEBAR_PAGE_SIZE)
+
+
+def test_chat_appears_with_its_first_message(client):
+    chat_id = client.post('/new_chat').get_json()['chat_id']
+    assert app.chat_storage.chat_summary(chat_id) is None
+    # «Сохранить» пустой чат не создаёт его
+    client.post('/save_chat', json={'chat_id': chat_id})
+    assert app.chat_storage.chat_summary(chat_id) is None
+    client.post('/api/v2/chat', json={'chat_id': chat_id, 'message': 'привет'})
+    assert app.chat_storage.chat_summary(chat_id)['message_count'] == 2
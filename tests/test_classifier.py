@@ -0,0 +1,155 @@
+# tests/test_classifier.py - Классификатор и таблицы ответов совпадают со старыми проверками
+
+import uuid
+import random
+
+import pytest
+
+import app
+from benchmarks.corpus import make_corpus
+from classifier import (GREETINGS, GOODBYE_WORDS, COMMAND_WORDS, BAD_WORDS, IGNORE_PHRASES, TIME_WORDS,
+                        DATE_WORDS, NEWS_WORDS, CODE_WORDS, CODE_PHRASES, YEAR_PHRASES, PLEASE_PHRASES,
+                        WHAT_WORDS, NO_WORDS, WHY_WORDS, HOW_WORDS, WHY_NEED_WORDS,
+                        classify_message, classify_batch, classify_bulk)
+
+# Сообщения, на которых ветки легко перепутать
+EDGE_MESSAGES = [
+    '', '   ', 'что', 'ЧТО?', ' нет. ', 'почему нет', 'как это', 'зачем?',
+    'привет, напиши код', 'ну пожалуйста, сделай программу', 'бот, какие новости?',
+    'который час? какое сегодня число?', 'ты дурак, реши задачу', 'пока, бот',
+    'ёжик', 'hello bb', 'какой сейчас год', 'код на python', 'прощай и удачи',
+]
+
+
+def reference_bot_response(message_text, user_name, rng):
+    """get_bot_response до компилированного классификатора и таблиц ответов:
+    по проверке any() на каждый список и новый список приветствий на вызов"""
+    text = message_text.lower().strip()
+    is_greeting = any(word in text for word in GREETINGS)
+    is_goodbye = any(word in text for word in GOODBYE_WORDS)
+    has_command = any(word in text for word in COMMAND_WORDS)
+    has_bad_word = any(word in text for word in BAD_WORDS)
+    has_bot_word = any(word in text for word in IGNORE_PHRASES)
+    wants_time = any(word in text for word in TIME_WORDS)
+    wants_date = any(word in text for word in DATE_WORDS)
+    wants_news = any(word in text for word in NEWS_WORDS)
+    wants_code = any(word in text for word in CODE_WORDS)
+    wants_code_phrase = any(phrase in text for phrase in CODE_PHRASES)
+    is_what = text in WHAT_WORDS
+    is_no = text in NO_WORDS
+    is_why = text in WHY_WORDS
+    is_year = any(phrase in text for phrase in YEAR_PHRASES)
+    is_how = text in HOW_WORDS
+    is_why_need = text in WHY_NEED_WORDS
+    is_please = any(phrase in text for phrase in PLEASE_PHRASES)
+
+    if has_bad_word:
+        return rng.choice(app.BAD_RESPONSES)
+    elif has_bot_word and not has_command and not wants_code and not wants_news:
+        return rng.choice(app.BOT_RESPONSES)
+    elif wants_time and not has_command:
+        response = rng.choice(app.TIME_RESPONSES)
+        return response.format(time=app.get_current_time()) if '{time}' in response else response
+    elif wants_date and not has_command:
+        return rng.choice(app.DATE_RESPONSES).format(date=app.get_current_date())
+    elif wants_news and not has_command:
+        if rng.random() < 0.3:
+            return (f"📢 Срочно в номер:\n• Бот ничего не делает\n• На улице {rng.randint(-20, 30)}°C\n"
+                    f"• {user_name} зря старается!")
+        return rng.choice(app.NEWS_RESPONSES)
+    elif (wants_code or wants_code_phrase) and not has_command:
+        return rng.choice(app.CODE_REFUSAL_PHRASES)
+    elif is_goodbye and not has_command:
+        return rng.choice(app.GOODBYE_RESPONSES).replace('{user_name}', user_name)
+    elif is_year:
+        return rng.choice(app.YEAR_RESPONSES)
+    elif is_how:
+        return rng.choice(app.HOW_RESPONSES)
+    elif is_why_need:
+        return rng.choice(app.WHY_NEED_RESPONSES)
+    elif is_why:
+        return rng.choice(app.WHY_RESPONSES)
+    elif is_please and (has_command or wants_code):
+        return rng.choice(app.PLEASE_RESPONSES)
+    elif is_what:
+        return rng.choice(app.WHAT_RESPONSES)
+    elif is_greeting and not has_command:
+        return rng.choice([
+            f"Привет, {user_name}! Что хотел? 😎",
+            f"Здарова, {user_name}! Чего надо?",
+            f"Хай, {user_name}! Слушаю тебя...",
+            f"Приветствую, {user_name}! С чем пожаловал?",
+            f"О, {user_name}! Я тут, слушаю.",
+            f"{user_name}! Рад тебя слышать! Или не рад... Посмотрим."
+        ])
+    elif has_command:
+        return rng.choice(app.REFUSAL_PHRASES)
+    elif is_no:
+        return rng.choice(app.NO_RESPONSES)
+    elif rng.random() < 0.3:
+        response = rng.choice(app.CASUAL_RESPONSES)
+        return f"{user_name}, {response.lower() if response[0].islower() else response}"
+    else:
+        return rng.choice(app.CASUAL_RESPONSES)
+
+
+@pytest.fixture
+def corpus():
+    return EDGE_MESSAGES + make_corpus(5000, seed=7)
+
+
+@pytest.fixture(autouse=True)
+def fixed_clock(monkeypatch):
+    # Иначе ответы про время могут разойтись на границе минуты
+    monkeypatch.setattr(app, 'get_current_time', lambda: '12:34')
+    monkeypatch.setattr(app, 'get_current_date', lambda: 'среда, 1 апреля 2026 года')
+
+
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_replies_match_reference(corpus, seed):
+    rng, reference_rng = random.Random(seed), random.Random(seed)
+    for message in corpus:
+        expected = reference_bot_response(message, 'Гость_123', reference_rng)
+        assert app.get_bot_response(message, 'Гость_123', rng) == expected, message
+
+
+def test_chat_seed_replays_conversation(monkeypatch):
+    monkeypatch.setattr(app, 'RESPONSE_SEED', 'test')
+    monkeypatch.setattr(app, 'chat_rngs', type(app.chat_rngs)())
+    messages = make_corpus(50, seed=1)
+    first = [app.get_bot_response(message, 'Гость', app.chat_rng('a')) for message in messages]
+    app.chat_rngs.clear()
+    assert [app.get_bot_response(message, 'Гость', app.chat_rng('a')) for message in messages] == first
+
+
+def test_batch_matches_single(corpus):
+    assert classify_batch(corpus) == [classify_message(message) for message in corpus]
+
+
+def test_bulk_keeps_order(corpus):
+    results = list(classify_bulk(corpus, processes=2, chunk_size=500))
+    assert [message for message, _, _ in results] == corpus
+    assert [flags for _, flags, _ in results] == [classify_message(message) for message in corpus]
+
+
+@pytest.mark.parametrize('endpoint, body', [
+    ('/api/chat', {'message': 'напиши код'}),
+    ('/api/v2/chat', {'message': 'напиши код'}),
+    ('/api/v2/chat/stream', {'message': 'напиши код'}),
+    ('/api/v2/chat/batch', {'items': [{'message': 'напиши код'}, {'message': 'привет'}]}),
+    ('/api/embed/chat', {'message': 'напиши код'}),
+])
+def test_each_message_is_classified_once(client, monkeypatch, endpoint, body):
+    calls = []
+    monkeypatch.setattr(app, 'classify_message', lambda text: calls.append(text) or classify_message(text))
+    chat_id = str(uuid.uuid4())
+    if 'items' in body:
+        body = {'items': [dict(item, chat_id=chat_id) for item in body['items']]}
+    elif endpoint != '/api/embed/chat':
+        body = dict(body, chat_id=chat_id)
+    refusals = app.get_stats()['refusals']
+    response = client.post(endpoint, json=body)
+    assert response.status_code == 200
+    response.get_data()
+    assert sorted(calls) == sorted(item['message'] for item in body.get('items', [body]))
+    assert app.get_stats()['refusals'] == refusals + 1
@@ -0,0 +1,60 @@
+# tests/test_embed.py - Чат для виджета: CORS, лимит частоты, адрес клиента за прокси
+
+import uuid
+
+import pytest
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+import app
+from rate_limit import RateLimiter
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    limiter = RateLimiter(1, 2)
+    monkeypatch.setattr(app, 'embed_limiter', limiter)
+    return limiter
+
+
+def ask(client, headers=None):
+    return client.post('/api/embed/chat', data='{"message": "привет"}',
+                       content_type='text/plain', headers=headers or {})
+
+
+def test_embed_chat_answers_any_origin(client, limiter):
+    response = ask(client)
+    assert response.status_code == 200 and response.get_json()['response']
+    assert response.headers['Access-Control-Allow-Origin'] == '*'
+    assert response.cache_control.no_store
+    assert client.options('/api/embed/chat').status_code == 204
+
+
+def test_embed_chat_is_rate_limited(client, limiter):
+    assert [ask(client).status_code for _ in range(3)] == [200, 200, 429]
+    response = ask(client)
+    assert response.status_code == 429 and int(response.headers['Retry-After']) >= 1
+
+
+def test_forwarded_for_needs_a_trusted_proxy(client, limiter, monkeypatch):
+    # Без PERRA_TRUSTED_PROXIES заголовок не помогает обойти лимит
+    spoofed = [ask(client, {'X-Forwarded-For': f'10.0.0.{i}'}).status_code for i in range(3)]
+    assert spoofed == [200, 200, 429]
+
+    monkeypatch.setattr(app.app, 'wsgi_app', ProxyFix(app.app.wsgi_app, x_for=1, x_proto=1))
+    # За nginx у каждого посетителя своё ведро, хотя сокет у всех один
+    for address in ('10.0.0.1', '10.0.0.2'):
+        statuses = [ask(client, {'X-Forwarded-For': address}).status_code for _ in range(3)]
+        assert statuses == [200, 200, 429]
+
+
+def test_rate_limiter_rejects_non_positive_rates():
+    for rate, burst in ((0, 10), (-1, 10), (1, 0)):
+        with pytest.raises(ValueError):
+            RateLimiter(rate, burst)
+
+
+def test_stream_is_closed_to_other_origins(client):
+    preflight = client.options('/api/v2/chat/stream')
+    assert 'Access-Control-Allow-Origin' not in preflight.headers
+    response = client.post('/api/v2/chat/stream', json={'message': 'привет', 'chat_id': str(uuid.uuid4())})
+    assert 'Access-Control-Allow-Origin' not in response.headers
@@ -0,0 +1,87 @@
+# tests/test_history_api.py - История чата по страницам: after, before и хвост в HTML
+
+import uuid
+
+import pytest
+
+import app
+
+TURNS = 60
+
+
+@pytest.fixture
+def chat_id():
+    chat_id = str(uuid.uuid4())
+    app.chat_storage.append(chat_id, 'Гость', [
+        {'sender': sender, 'text': f'{number}:{sender}', 'time': '12:00'}
+        for number in range(TURNS) for sender in ('user', 'bot')])
+    return chat_id
+
+
+def history(client, chat_id, **params):
+    response = client.get(f'/api/chats/{chat_id}/messages', query_string=params)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_after_pages_walk_forward(client, chat_id):
+    seqs = []
+    after = 0
+    while after is not None:
+        page = history(client, chat_id, after=after, limit=7)
+        seqs += [message['seq'] for message in page['messages']]
+        after = page['next_after']
+    assert seqs == list(range(1, 2 * TURNS + 1))
+    assert history(client, chat_id, after=2 * TURNS)['messages'] == []
+
+
+def test_before_pages_walk_back(client, chat_id):
+    # before=0 - хвост чата
+    page = history(client, chat_id, before=0, limit=7)
+    seqs = [message['seq'] for message in page['messages']]
+    assert seqs == list(range(2 * TURNS - 6, 2 * TURNS + 1))
+    while page['next_before'] is not None:
+        page = history(client, chat_id, before=page['next_before'], limit=7)
+        seqs = [message['seq'] for message in page['messages']] + seqs
+    assert seqs == list(range(1, 2 * TURNS + 1))
+
+
+def test_limit_is_clamped(client, chat_id):
+    assert len(history(client, chat_id, limit=0)['messages']) == 1
+    assert len(history(client, chat_id, after=-5, limit=3)['messages']) == 3
+    assert len(history(client, chat_id, limit=10 ** 6)['messages']) == min(2 * TURNS, app.HISTORY_PAGE_SIZE)
+
+
+def test_unknown_chats(client):
+    assert client.get('/api/chats/not-a-uuid/messages').status_code == 404
+    assert history(client, str(uuid.uuid4())) == {'messages': [], 'next_after': None}
+
+
+def test_page_renders_only_the_tail(client, chat_id):
+    page = client.get('/', query_string={'chat_id': chat_id}).get_data(as_text=True)
+    first = 2 * TURNS - app.INITIAL_MESSAGES + 1
+    assert f'let historyBefore = {first};' in page
+    assert f'let lastSeq = {2 * TURNS};' in page
+    assert page.count('data-seq="') == app.INITIAL_MESSAGES
+    assert f'data-seq="{first}"' in page and f'data-seq="{first - 1}"' not in page
+
+
+def test_v2_chat_returns_only_the_new_pair(client, chat_id):
+    data = client.post('/api/v2/chat', json={'chat_id': chat_id, 'message': 'привет'}).get_json()
+    assert [message['seq'] for message in data['messages']] == [2 * TURNS + 1, 2 * TURNS + 2]
+    assert data['messages'][0]['text'] == 'привет'
+    assert data['messages'][1]['text'] == data['response']
+    assert data['seq'] == 2 * TURNS + 2
+    assert history(client, chat_id, after=2 * TURNS)['messages'] == data['messages']
+    assert client.post('/api/v2/chat', json={'message': 'привет'}).status_code == 400
+
+
+def test_cache_sees_writes_of_other_workers(client, chat_id):
+    assert isinstance(app.chat_storage, app.CachedChatStorage)
+    client.post('/api/chat', json={'chat_id': chat_id, 'message': 'привет'})
+    # Другой воркер пишет в то же хранилище мимо нашего кэша
+    other = app.create_chat_storage(app.CHAT_STORAGE, app.CHATS_FOLDER, app.CHATS_DB, None)
+    other.append(chat_id, 'Гость', [{'sender': 'user', 'text': 'из другого воркера', 'time': '12:00'}])
+    messages = client.post('/api/chat', json={'chat_id': chat_id, 'message': 'ещё'}).get_json()['messages']
+    assert [message['text'] for message in messages[-3:-1]] == ['из другого воркера', 'ещё']
+    assert len(messages) == 2 * TURNS + 5
@@ -0,0 +1,63 @@
+# tests/test_http_cache.py - Сжатие ответов и проверка актуальности (ETag, 304)
+
+import gzip
+import os
+import uuid
+
+import pytest
+
+import app
+
+GZIP = {'Accept-Encoding': 'gzip'}
+
+
+@pytest.fixture
+def chat_id():
+    chat_id = str(uuid.uuid4())
+    app.chat_storage.append(chat_id, 'Гость', [
+        {'sender': 'user', 'text': f'сообщение {number}', 'time': '12:00'} for number in range(50)])
+    return chat_id
+
+
+def test_history_revalidates_when_compressed(client, chat_id):
+    url = f'/api/chats/{chat_id}/messages'
+    response = client.get(url, headers=GZIP)
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    etag = response.headers['ETag']
+    assert etag.startswith('W/')
+    assert len(gzip.decompress(response.data)) > len(response.data)
+
+    # Слабый ETag сжатого ответа подходит и для сжатого, и для несжатого
+    for headers in (GZIP, {}):
+        revalidated = client.get(url, headers={**headers, 'If-None-Match': etag})
+        assert revalidated.status_code == 304
+        assert revalidated.data == b''
+    assert client.get(url, headers={'If-Modified-Since': response.headers['Last-Modified']}).status_code == 304
+    # Другая страница - другой ETag
+    assert client.get(url, query_string={'limit': 5}, headers={'If-None-Match': etag}).status_code == 200
+
+    app.chat_storage.append(chat_id, 'Гость', [{'sender': 'user', 'text': 'новое', 'time': '12:00'}])
+    changed = client.get(url, headers={**GZIP, 'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+
+
+def test_small_and_unaccepted_responses_stay_plain(client, chat_id):
+    assert 'Content-Encoding' not in client.get(f'/api/chats/{chat_id}/messages').headers
+    small = client.get(f'/api/chats/{chat_id}/messages', query_string={'limit': 1}, headers=GZIP)
+    assert 'Content-Encoding' not in small.headers
+
+
+def test_static_is_served_precompressed(client):
+    with open(os.path.join(app.STATIC_FOLDER, 'perra.js'), 'rb') as f:
+        source = f.read()
+    response = client.get('/static/perra.js', headers=GZIP)
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.data) == source
+    assert int(response.headers['Content-Length']) == len(response.data)
+    etag = response.headers['ETag']
+    assert etag.startswith('W/')
+    assert client.get('/static/perra.js', headers={**GZIP, 'If-None-Match': etag}).status_code == 304
+    # Сжатая версия берётся из кэша
+    assert client.get('/static/perra.js', headers=GZIP).data == response.data
@@ -0,0 +1,36 @@
+# tests/test_metrics.py - Замеры запросов и фаз на /metrics
+
+import pytest
+
+import app
+import metrics
+
+
+@pytest.fixture
+def enabled(monkeypatch):
+    monkeypatch.setattr(metrics, 'ENABLED', True)
+
+
+def phase_count(name):
+    histogram = metrics._phases.get(name)
+    return histogram.snapshot()[2] if histogram else 0
+
+
+def test_index_counts_one_render(client, enabled):
+    before = {name: phase_count(name) for name in ('render', 'render_fragments', 'load_chat')}
+    assert client.get('/').status_code == 200
+    assert phase_count('render') == before['render'] + 1
+    assert phase_count('render_fragments') == before['render_fragments'] + 1
+    assert phase_count('load_chat') == before['load_chat'] + 1
+
+
+def test_metrics_endpoint(client, enabled):
+    client.get('/')
+    text = client.get('/metrics').get_data(as_text=True)
+    assert 'perra_request_duration_seconds_count{method="GET",route="/",status="200"}' in text
+    assert 'perra_phase_duration_seconds_count{phase="render"}' in text
+    assert 'perra_stats_visits' in text
+
+
+def test_metrics_endpoint_is_off_by_default(client):
+    assert client.get('/metrics').status_code == 404
@@ -0,0 +1,78 @@
+# tests/test_search_api.py - Поиск по чатам: выдача, страницы, имена и уборка
+
+import uuid
+
+import pytest
+
+import app
+
+DAY = 24 * 60 * 60
+
+
+@pytest.fixture
+def word():
+    """Слово, которого нет больше ни в одном чате"""
+    return 'зебро' + ''.join('абвгдежзиклмнопр'[int(digit, 16)] for digit in uuid.uuid4().hex[:8])
+
+
+def search(client, query, **params):
+    response = client.get('/api/search', query_string={'q': query, **params})
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def say(client, chat_id, message):
+    assert client.post('/api/v2/chat', json={'chat_id': chat_id, 'message': message}).status_code == 200
+
+
+def test_finds_new_messages(client, word):
+    chat_id = str(uuid.uuid4())
+    say(client, chat_id, f'где живёт {word}?')
+    results = [result for result in search(client, word)['results'] if result['sender'] == 'user']
+    assert len(results) == 1
+    assert results[0]['chat_id'] == chat_id and results[0]['seq'] == 1
+    assert f'<mark>{word}</mark>' in results[0]['snippet']
+
+
+def test_pages_do_not_overlap(client, word):
+    for number in range(5):
+        say(client, str(uuid.uuid4()), f'{word} номер {number}')
+    seen = []
+    page = 1
+    while page:
+        data = search(client, f'{word} номер', page=page, limit=2)
+        assert len(data['results']) <= 2
+        seen += [(result['chat_id'], result['seq']) for result in data['results']]
+        page = data['next_page']
+    assert len(seen) == len(set(seen)) >= 5
+
+
+def test_finds_chats_by_user_name(client, word):
+    chat_id = str(uuid.uuid4())
+    client.post('/set_username', json={'name': word.capitalize()})
+    say(client, chat_id, 'привет')
+    results = search(client, word)['results']
+    assert {result['chat_id'] for result in results} == {chat_id}
+    assert results[0]['user_name'] == word.capitalize()
+
+
+def test_garbage_collection_drops_chats_from_the_index(client, word, monkeypatch):
+    chat_id = str(uuid.uuid4())
+    monkeypatch.setattr('chat_storage.now_timestamp', lambda: '2000-01-01 00:00:00')
+    say(client, chat_id, word)
+    monkeypatch.undo()
+    assert search(client, word)['results']
+    app.chat_storage.collect_garbage(idle_ttl=3650 * DAY, on_remove=app.search_index.remove_chat)
+    assert app.chat_storage.chat_summary(chat_id) is None
+    assert search(client, word)['results'] == []
+
+
+def test_rejects_bad_requests(client, monkeypatch):
+    assert client.get('/api/search').status_code == 400
+    assert client.get('/api/search', query_string={'q': '   '}).status_code == 400
+    monkeypatch.setattr(app, 'SEARCH_TOKEN', 'secret')
+    assert client.get('/api/search', query_string={'q': 'привет'}).status_code == 403
+    allowed = client.get('/api/search', query_string={'q': 'привет'}, headers={'Authorization': 'Bearer secret'})
+    assert allowed.status_code == 200
+    monkeypatch.setattr(app, 'search_index', None)
+    assert client.get('/api/search', query_string={'q': 'привет'}).status_code == 404
@@ -0,0 +1,44 @@
+# tests/test_service_worker.py - Service worker и оболочка главной страницы
+
+import uuid
+
+import app
+
+
+def test_service_worker_caches_only_the_shell(client):
+    response = client.get('/sw.js')
+    script = response.get_data(as_text=True)
+    assert response.mimetype == 'application/javascript'
+    assert f"const SHELL_URL = '{app.SHELL_URL}'" in script
+    assert app.SHELL_URL in script.split('const PRECACHE = ')[1].split(';')[0]
+    assert 'staleWhileRevalidate(event, SHELL_URL)' in script
+    # Страницы с сессией и чатом в кэш не кладутся
+    assert 'networkFirst' not in script and "url.pathname === '/'" in script
+    assert client.get('/sw.js', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+
+def test_shell_has_no_session_or_chat_data(client):
+    chat_id = str(uuid.uuid4())
+    client.post('/api/v2/chat', json={'message': 'секретное сообщение', 'chat_id': chat_id})
+    client.post('/set_username', json={'name': 'Секретное_имя'})
+
+    response = client.get(app.SHELL_URL + '?chat_id=' + chat_id)
+    page = response.get_data(as_text=True)
+    assert response.status_code == 200 and response.cache_control.no_cache
+    assert 'Set-Cookie' not in response.headers
+    for private in ('секретное сообщение', 'Секретное_имя', chat_id, 'chat-item'):
+        assert private not in page
+    assert "let currentChatId = '';" in page
+
+    # Обычная главная по-прежнему собирается на сервере
+    page = client.get('/?chat_id=' + chat_id).get_data(as_text=True)
+    assert 'секретное сообщение' in page and 'Секретное_имя' in page
+
+
+def test_session_api_gives_the_shell_a_name(client):
+    visits = app.get_stats()['visits']
+    name = client.get('/api/session').get_json()['user_name']
+    assert name.startswith('Гость_')
+    response = client.get('/api/session')
+    assert response.get_json()['user_name'] == name and response.cache_control.no_store
+    assert app.get_stats()['visits'] == visits + 2
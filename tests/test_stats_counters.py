@@ -0,0 +1,88 @@
+# tests/test_stats_counters.py - Счётчики статистики: точный счёт из потоков и воркеров
+
+import json
+import multiprocessing
+import sqlite3
+import threading
+import uuid
+
+from stats_counters import StatsCounters
+
+THREADS = 8
+HITS = 1000
+
+
+def stored(db_path):
+    with sqlite3.connect(db_path) as conn:
+        return dict(conn.execute('SELECT key, value FROM stats'))
+
+
+def test_threads_count_exactly(tmp_path):
+    counters = StatsCounters(str(tmp_path / 'stats.db'), flush_interval=3600)
+    start = threading.Barrier(THREADS)
+
+    def hit():
+        start.wait()
+        for _ in range(HITS):
+            counters.incr('visits')
+
+    threads = [threading.Thread(target=hit) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    # Сброс посреди работы не теряет и не удваивает приросты
+    counters.flush()
+    for thread in threads:
+        thread.join()
+    counters.incr('refusals', 3)
+    assert counters.snapshot()['visits'] == THREADS * HITS
+
+    counters.flush()
+    assert stored(counters.db_path)['visits'] == THREADS * HITS
+    assert stored(counters.db_path)['refusals'] == 3
+    # Шарды завершившихся потоков выброшены, живой остался
+    assert len(counters._shards) == 1
+    counters.flush()
+    assert counters.snapshot() == stored(counters.db_path)
+
+
+def hit_from_worker(counters, hits):
+    for _ in range(hits):
+        counters.incr('chat_messages')
+    counters.flush()
+
+
+def test_forked_workers_add_up(tmp_path):
+    counters = StatsCounters(str(tmp_path / 'stats.db'), flush_interval=3600)
+    # Несброшенное до fork считает только родитель, воркеры начинают с нуля
+    counters.incr('chat_messages', 5)
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=hit_from_worker, args=(counters, HITS)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+        assert worker.exitcode == 0
+    counters.flush()
+    assert stored(counters.db_path)['chat_messages'] == 4 * HITS + 5
+    assert counters.snapshot()['chat_messages'] == 4 * HITS + 5
+
+
+def test_migrates_stats_json(tmp_path):
+    json_path = tmp_path / 'stats.json'
+    json_path.write_text(json.dumps({'visits': 7, 'saved_chats': 2}))
+    counters = StatsCounters(str(tmp_path / 'stats.db'), json_path=str(json_path), flush_interval=3600)
+    counters.incr('visits')
+    counters.flush()
+    assert stored(counters.db_path)['visits'] == 8
+    assert json.loads(json_path.read_text())['visits'] == 8
+    # Повторный запуск не переносит stats.json ещё раз
+    assert StatsCounters(counters.db_path, json_path=str(json_path)).snapshot()['visits'] == 8
+
+
+def test_chat_endpoint_counts_messages(client):
+    import app
+    before = app.get_stats()
+    response = client.post('/api/v2/chat', json={'chat_id': str(uuid.uuid4()), 'message': 'привет'})
+    assert response.status_code == 200
+    after = app.get_stats()
+    assert after['chat_messages'] == before['chat_messages'] + 1
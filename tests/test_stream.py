@@ -0,0 +1,96 @@
+# tests/test_stream.py - Потоковый ответ: токены по мере готовности, сохранение при обрыве
+
+import json
+import uuid
+import asyncio
+
+import app
+import asgi
+
+
+def read_events(chunks):
+    events = []
+    for chunk in chunks:
+        for block in chunk.decode('utf-8').split('\n\n'):
+            if block:
+                event, data = block.split('\n')
+                events.append((event[len('event: '):], json.loads(data[len('data: '):])))
+    return events
+
+
+def history(client, chat_id):
+    return client.get(f'/api/chats/{chat_id}/messages').get_json()['messages']
+
+
+def test_stream_saves_the_turn(client):
+    chat_id = str(uuid.uuid4())
+    response = client.post('/api/v2/chat/stream', json={'message': 'привет', 'chat_id': chat_id})
+    assert response.mimetype == 'text/event-stream'
+    events = read_events([response.data])
+    tokens = [data['text'] for event, data in events if event == 'token']
+    event, done = events[-1]
+    assert event == 'done' and done['response'] == ''.join(tokens) and tokens
+    assert [m['seq'] for m in done['messages']] == [1, 2] and done['seq'] == 2
+    assert [(m['sender'], m['text']) for m in history(client, chat_id)] == [
+        ('user', 'привет'), ('bot', done['response'])]
+
+
+def test_tokens_leave_as_the_generator_makes_them(client, monkeypatch):
+    produced = []
+
+    def slow_reply(message_text, user_name, rng, flags):
+        for token in ['раз', ' два', ' три']:
+            produced.append(token)
+            yield token
+
+    monkeypatch.setattr(app, 'stream_bot_response', slow_reply)
+    chat_id = str(uuid.uuid4())
+    response = client.post('/api/v2/chat/stream', json={'message': 'привет', 'chat_id': chat_id},
+                           buffered=False)
+    chunks = iter(response.response)
+    assert read_events([next(chunks)]) == [('token', {'text': 'раз'})]
+    assert produced == ['раз']
+    # Сообщение пользователя уже сохранено, ответ - ещё нет
+    assert [m['sender'] for m in history(client, chat_id)] == ['user']
+    events = read_events(chunks)
+    assert events[-1][1]['response'] == 'раз два три'
+    assert [m['text'] for m in history(client, chat_id)] == ['привет', 'раз два три']
+
+
+def test_disconnect_keeps_what_was_sent(client, monkeypatch):
+    monkeypatch.setattr(app, 'stream_bot_response',
+                        lambda message_text, user_name, rng, flags: iter(['раз', ' два', ' три']))
+    chat_id = str(uuid.uuid4())
+    response = client.post('/api/v2/chat/stream', json={'message': 'привет', 'chat_id': chat_id},
+                           buffered=False)
+    chunks = iter(response.response)
+    next(chunks)
+    next(chunks)
+    response.close()    # клиент ушёл посреди ответа
+    assert [(m['seq'], m['text']) for m in history(client, chat_id)] == [(1, 'привет'), (2, 'раз два')]
+
+
+def test_stream_without_chat_saves_nothing(client):
+    before = app.chat_storage.list_chats()[0]
+    events = read_events([client.post('/api/v2/chat/stream', json={'message': 'привет'}).data])
+    assert events[-1][0] == 'done' and 'messages' not in events[-1][1]
+    assert app.chat_storage.list_chats()[0] == before
+
+
+def test_stream_rejects_bad_chat_id(client):
+    response = client.post('/api/v2/chat/stream', json={'message': 'привет', 'chat_id': '../etc'})
+    assert response.status_code == 400
+
+
+def test_asgi_stream_saves_the_turn():
+    async def post():
+        client = asgi.app.test_client()
+        response = await client.post('/api/v2/chat/stream', json={'message': 'привет', 'chat_id': chat_id})
+        return await response.get_data()
+
+    chat_id = str(uuid.uuid4())
+    events = read_events([asyncio.run(post())])
+    event, done = events[-1]
+    assert event == 'done' and [m['seq'] for m in done['messages']] == [1, 2]
+    assert done['response'] == ''.join(data['text'] for event, data in events[:-1])
+    assert [m['text'] for m in app.chat_storage.load(chat_id)['messages']] == ['привет', done['response']]